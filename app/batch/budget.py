@@ -0,0 +1,114 @@
+# app/batch/budget.py
+import threading
+from typing import Optional
+
+
+class BudgetAllocator:
+    """
+    One probe budget for a whole batch. Each trace starts with a grant, gives back
+    what it did not spend when it finishes, and may ask for more while it is still
+    working on an undecided hop. Urgent requests (see BudgetController._topup) may
+    drain the pool; the others leave `reserve` of the total for them.
+    The sum of grants never exceeds `total`.
+
+    With `grant` 0 each trace gets a fair share: the pool over the targets still
+    to start (when the driver said how many to expect()), at most `per_trace` and
+    at least `floor`. A trace the pool cannot give `floor` gets nothing and ends
+    as "budget_exhausted" without probing, instead of starting on scraps.
+    """
+
+    def __init__(self, total: int, grant: int, topup: int = 6, reserve: float = 0.1,
+                 per_trace: Optional[int] = None, floor: int = 1):
+        self.total = total
+        self.grant_size = grant
+        self.per_trace = per_trace or grant or total
+        self.floor = max(1, floor)
+        self.topup_size = topup
+        self.reserve = int(total * reserve)
+        self.pool = total
+        self._lock = threading.Lock()
+        self.expected: Optional[int] = None  # traces still to start, when known
+        self.traces = 0
+        self.starved = 0
+        self.granted = 0
+        self.returned = 0
+        self.topups = 0
+        self.topups_urgent = 0
+        self.denied = 0
+
+    @classmethod
+    def from_settings(cls, settings, total: Optional[int] = None) -> Optional["BudgetAllocator"]:
+        """Allocator for Settings.batch_budget (or `total`); None when batch budgeting is off."""
+        total = total if total is not None else getattr(settings, "batch_budget", 0)
+        if not total:
+            return None
+        return cls(
+            total=total,
+            grant=getattr(settings, "batch_grant", 0),
+            topup=getattr(settings, "batch_topup", 0) or settings.per_hop_budget,
+            reserve=getattr(settings, "batch_reserve", 0.1),
+            per_trace=settings.total_budget,
+            floor=getattr(settings, "batch_grant_floor", 0) or settings.per_hop_budget,
+        )
+
+    def expect(self, n: int) -> None:
+        """`n` more traces will ask for a grant (negative: that many fewer), so shares can be fair."""
+        with self._lock:
+            self.expected = max(0, (self.expected or 0) + n)
+
+    def grant(self) -> int:
+        """Initial budget for a new trace: 0 once the pool cannot cover the floor."""
+        with self._lock:
+            if self.grant_size:
+                n = self.grant_size
+            elif self.expected:
+                n = max(self.floor, min(self.per_trace, self.pool // self.expected))
+            else:
+                n = self.per_trace
+            if self.expected:
+                self.expected -= 1
+            n = min(n, self.pool)
+            if n < self.floor:
+                n = 0
+                self.starved += 1
+            self.pool -= n
+            self.granted += n
+            self.traces += 1
+            return n
+
+    def request(self, urgent: bool, want: Optional[int] = None) -> int:
+        """More credits for a running trace; returns how many it got."""
+        want = want or self.topup_size
+        with self._lock:
+            avail = self.pool if urgent else max(0, self.pool - self.reserve)
+            n = min(want, avail)
+            if n <= 0:
+                self.denied += 1
+                return 0
+            self.pool -= n
+            self.granted += n
+            self.topups += 1
+            self.topups_urgent += urgent
+            return n
+
+    def release(self, n: int) -> None:
+        """A finished trace hands back the credits it did not use."""
+        if n <= 0:
+            return
+        with self._lock:
+            self.pool += n
+            self.granted -= n
+            self.returned += n
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total,
+            "spent": self.granted,  # once every trace has finished
+            "pool": self.pool,
+            "traces": self.traces,
+            "starved": self.starved,
+            "returned": self.returned,
+            "topups": self.topups,
+            "topups_urgent": self.topups_urgent,
+            "denied": self.denied,
+        }
@@ -0,0 +1,223 @@
+# app/batch/journal.py
+"""
+Append-only journal that makes batch runs resumable.
+
+Records are JSON lines keyed by the target's position in the input stream:
+    {"t": "done", "i": idx, "d": dest, "r": result}    target finished
+    {"t": "snap", "i": idx, "d": dest, "s": snapshot}  RunState after a hop closed
+Writes are buffered and fsynced in groups (every `fsync_every` records or
+`fsync_s` seconds, and on close), so a crash loses at most the last group.
+
+Every `checkpoint_every` finished targets the journal writes a sidecar
+(<path>.ckpt, replaced atomically): the byte offset it covers, the watermark
+(every index below it is done), the done indices above the watermark and the
+snapshots of traces still in flight. Recovery loads the sidecar and reads only
+the journal past its offset, so restart cost follows the journal tail, not the
+length of the run.
+
+With `mark_output` (e.g. app.io.writers.JsonlWriter.mark) the checkpoint also
+records where the output stood: every result journaled before the checkpoint is
+in the output up to that mark. A resumed run cuts the output back to it
+(app.io.writers.rewind_written) and writes again the results stored in the tail
+(`store_results`), so the output is rebuilt from the tail alone. Results must
+reach the output in the order they are journaled, as AsyncBatchRunner and
+run_sharded do.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterable, Iterator, Optional
+
+from app.prober.parse import loads
+
+
+class Journal:
+    def __init__(self, path: str, snapshots: bool = False, store_results: bool = False,
+                 fsync_every: int = 64, fsync_s: float = 1.0, checkpoint_every: int = 1024,
+                 mark_output: Optional[Callable[[], Optional[dict]]] = None):
+        self.path = path
+        self.ckpt_path = path + ".ckpt"
+        self.snapshots = snapshots          # journal RunState snapshots of traces in progress
+        self.store_results = store_results  # keep each result in its "done" record (for the output tail)
+        self.mark_output = mark_output      # flushes the output, returns where it ends
+        self.fsync_every = fsync_every
+        self.fsync_s = fsync_s
+        self.checkpoint_every = checkpoint_every
+
+        self.watermark = 0                       # every index below is done
+        self.done_above: set[int] = set()        # done indices >= watermark
+        self.partial: dict[int, dict] = {}       # idx -> latest snapshot of an unfinished trace
+        self.output_mark: Optional[dict] = None  # the output as of the checkpoint
+        self._tail_results: list[dict] = []      # results stored past the checkpoint
+        self.recovered = self._recover()
+
+        self._fh = open(path, "ab")
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._since_ckpt = 0
+        self.records = 0
+        self.syncs = 0
+
+    # -------------------------------
+    # Recovery
+    # -------------------------------
+    def _recover(self) -> dict:
+        offset = 0
+        if os.path.exists(self.ckpt_path):
+            with open(self.ckpt_path, "r", encoding="utf-8") as fh:
+                ckpt = json.load(fh)
+            offset = ckpt["offset"]
+            self.watermark = ckpt["watermark"]
+            self.done_above = set(ckpt["done_above"])
+            self.partial = {int(k): v for k, v in ckpt["partial"].items()}
+            self.output_mark = ckpt.get("output")
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < offset:
+            raise ValueError(f"journal {self.path} is shorter than its checkpoint says ({size} < {offset})")
+
+        tail = 0
+        good = offset
+        if size > offset:
+            with open(self.path, "rb") as fh:
+                fh.seek(offset)
+                for line in fh:
+                    if not line.endswith(b"\n"):
+                        break  # torn write from the crash
+                    try:
+                        rec = loads(line)
+                    except ValueError:
+                        break
+                    self._apply(rec)
+                    good += len(line)
+                    tail += 1
+            if good < size:
+                # drop the torn record so new ones don't get glued onto it
+                with open(self.path, "r+b") as fh:
+                    fh.truncate(good)
+        return {"from_checkpoint": offset > 0, "tail_records": tail,
+                "done": self.watermark + len(self.done_above), "partial": len(self.partial)}
+
+    def _apply(self, rec: dict) -> None:
+        idx = rec["i"]
+        if rec["t"] == "done":
+            self._mark_done(idx)
+            if "r" in rec:
+                self._tail_results.append(rec["r"])
+        elif rec["t"] == "snap" and not self.finished(idx):
+            self.partial[idx] = rec["s"]
+
+    def _mark_done(self, idx: int) -> None:
+        self.partial.pop(idx, None)
+        if idx < self.watermark:
+            return
+        self.done_above.add(idx)
+        while self.watermark in self.done_above:
+            self.done_above.remove(self.watermark)
+            self.watermark += 1
+
+    # -------------------------------
+    # Queries
+    # -------------------------------
+    def finished(self, idx: int) -> bool:
+        return idx < self.watermark or idx in self.done_above
+
+    def resume_state(self, idx: int) -> Optional[dict]:
+        """Latest snapshot of target `idx` if it was interrupted mid-trace."""
+        return self.partial.get(idx)
+
+    def results(self) -> Iterator[dict]:
+        """Every result stored in the journal, in the order targets finished (reads the whole file)."""
+        with open(self.path, "rb") as fh:
+            for line in fh:
+                if line.endswith(b"\n"):
+                    rec = loads(line)
+                    if rec["t"] == "done" and "r" in rec:
+                        yield rec["r"]
+
+    def unwritten(self, written: Optional[Iterable[dict]] = None) -> Iterator[dict]:
+        """
+        Results stored past the checkpoint, which the output of the interrupted run
+        may lack: it is written behind the journal. Once the output is cut back to
+        output_mark, a resumed run writes all of them again before tracing anything
+        new. Without a mark pass `written` (e.g. app.io.writers.iter_written()) to
+        get only those missing from it.
+        """
+        have = Counter(res.get("target") for res in written) if written is not None else Counter()
+        for res in self._tail_results:
+            target = res.get("target")
+            if have[target]:
+                have[target] -= 1
+            else:
+                yield res
+
+    # -------------------------------
+    # Writing
+    # -------------------------------
+    def _append(self, rec: dict) -> None:
+        self._fh.write(json.dumps(rec, separators=(",", ":"), ensure_ascii=False, default=str).encode() + b"\n")
+        self.records += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._synced_at >= self.fsync_s:
+            self._sync()
+
+    def _sync(self) -> None:
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self.syncs += 1
+
+    def snapshot(self, idx: int, dest: str, snap: dict) -> None:
+        with self._lock:
+            self.partial[idx] = snap
+            self._append({"t": "snap", "i": idx, "d": dest, "s": snap})
+
+    def done(self, idx: int, dest: str, result: Optional[dict] = None) -> None:
+        with self._lock:
+            rec = {"t": "done", "i": idx, "d": dest}
+            if self.store_results and result is not None:
+                rec["r"] = result
+            self._append(rec)
+            self._mark_done(idx)
+            self._since_ckpt += 1
+            if self._since_ckpt >= self.checkpoint_every:
+                self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        # every result journaled so far is in the output: note where it ends
+        mark = self.mark_output() if self.mark_output is not None else None
+        self._sync()
+        ckpt = {
+            "offset": self._fh.tell(),
+            "watermark": self.watermark,
+            "done_above": sorted(self.done_above),
+            "partial": {str(k): v for k, v in self.partial.items()},
+            **({"output": mark} if mark is not None else {}),
+        }
+        tmp = self.ckpt_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(ckpt, fh, separators=(",", ":"))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.ckpt_path)
+        self._since_ckpt = 0
+        self._tail_results.clear()
+
+    def checkpoint(self) -> None:
+        with self._lock:
+            self._checkpoint()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._fh.closed:
+                try:
+                    self._checkpoint()
+                finally:
+                    self._fh.close()
+
+    def stats(self) -> dict:
+        return {"records": self.records, "syncs": self.syncs, "watermark": self.watermark,
+                "recovered": self.recovered}
@@ -0,0 +1,257 @@
+# app/batch/runner.py
+import asyncio
+import functools
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, Callable, Iterable, Optional, Union
+
+from app.batch.budget import BudgetAllocator
+from app.brain.controller import BudgetController
+from app.brain.state import snapshot_run
+from app.logging import METRICS, perf_counter
+from app.prober.base import AsyncProber
+from app.prober.pacing import Pacer
+
+
+class AsyncBatchRunner:
+    """
+    Trace many targets concurrently: `in_flight` worker tasks each pull the next
+    target, drive a TraceSession for it to completion, and hand the result to
+    `on_result`. Targets are pulled lazily, so a generator over a huge file is fine.
+    `pps` caps the probes of all traces together (default: Settings.pps); each
+    destination is also held to Settings.pace_ms. With Settings.batch_budget the
+    traces draw on one shared probe budget (see app/batch/budget.py).
+    """
+
+    def __init__(self,
+                 prober: AsyncProber,
+                 settings,
+                 in_flight: int = 64,
+                 pps: Optional[float] = None,
+                 on_result: Optional[Callable[[dict], None]] = None,
+                 journal=None,
+                 priors: Optional[dict] = None):
+        self.check(settings)
+        self.prober = prober
+        self.s = settings
+        self.in_flight = max(1, in_flight)
+        self.pacer = Pacer.from_settings(settings, pps=pps)
+        self.on_result = on_result
+        # app.batch.journal.Journal: skip finished targets, resume interrupted ones
+        self.journal = journal
+        # target -> earlier result (app.brain.retrace.load_priors): re-trace instead of a cold trace
+        self.priors = priors
+        self.allocator = BudgetAllocator.from_settings(settings)
+        self.ctrl = BudgetController(None, settings, pacer=self.pacer, allocator=self.allocator)
+        self.stats = {"targets": 0, "probes": 0, "elapsed_s": 0.0}
+        self._emitter: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def check(settings) -> None:
+        """Raise ValueError for settings the runner cannot honour."""
+        if getattr(settings, "window_ttls", 1) > 1:
+            from app.brain.window import WindowSession
+            WindowSession.check(settings)
+
+    async def _trace_sequential(self, dest: str, resume: Optional[dict] = None,
+                                on_snapshot: Optional[Callable[[dict], None]] = None,
+                                prior: Optional[dict] = None) -> dict:
+        sess = self.ctrl.session(dest, resume=resume, prior=prior)
+        hop = sess.run.ttl
+        M = METRICS
+        while True:
+            timed = M.enabled
+            t0 = perf_counter() if timed else 0.0
+            probe = sess.next_probe()
+            if probe is None:
+                break
+            ttl, flow_id = probe
+            kw = sess.probe_kw()
+            if timed:
+                M.observe("ctl_next", perf_counter() - t0)
+            if self.ctrl.rate_limits is not None:
+                hold = sess.hold(ttl, flow_id)
+                if hold:
+                    await asyncio.sleep(hold)
+            await self.pacer.wait_async(dest)
+            t1 = perf_counter() if timed else 0.0
+            ev = await self.prober.probe_once(dest, ttl, flow_id=flow_id, **kw)
+            if timed:
+                t2 = perf_counter()
+                M.observe("probe", t2 - t1)
+            sess.feed(ttl, flow_id, ev)
+            if timed:
+                M.observe("ctl_feed", perf_counter() - t2)
+            if on_snapshot is not None and sess.run.ttl != hop and not sess.done:
+                # a hop closed: this is a clean point to resume from
+                hop = sess.run.ttl
+                on_snapshot(snapshot_run(sess.run))
+        return sess.result()
+
+    async def _trace_windowed(self, dest: str, window: int, resume: Optional[dict] = None,
+                              on_snapshot: Optional[Callable[[dict], None]] = None) -> dict:
+        """Settings.window_ttls > 1: up to `window` TTLs of this trace in flight at once."""
+        from app.brain.window import WindowSession
+        sess = WindowSession(self.ctrl, dest, window)
+        if resume is not None:
+            sess.resume(resume)
+        hop = sess.run.ttl
+        sent: set = set()
+
+        async def send(ttl: int, flow_id: int, kw: dict, hold: float):
+            if hold:
+                await asyncio.sleep(hold)
+            await self.pacer.wait_async(dest)
+            sent.add(asyncio.current_task())
+            return await self.prober.probe_once(dest, ttl, flow_id=flow_id, **kw)
+
+        tasks: dict = {}
+        try:
+            while True:
+                for ttl, flow_id in sess.next_probes():
+                    hold = sess.hold(ttl, flow_id) if self.ctrl.rate_limits is not None else 0.0
+                    kw = sess.probe_kw(ttl, flow_id)
+                    tasks[asyncio.ensure_future(send(ttl, flow_id, kw, hold))] = (ttl, flow_id)
+                if not tasks:
+                    break
+                if on_snapshot is not None and sess.run.ttl != hop:
+                    # the bottom of the window moved up: resume from here
+                    hop = sess.run.ttl
+                    on_snapshot(sess.snapshot())
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    ttl, flow_id = tasks.pop(task)
+                    sent.discard(task)
+                    sess.feed(ttl, flow_id, task.result())
+                # past the destination: unsent probes are refunded, sent ones written off
+                for task, (ttl, flow_id) in list(tasks.items()):
+                    if sess.cancelled(ttl):
+                        del tasks[task]
+                        task.cancel()
+                        if task in sent:
+                            sent.discard(task)
+                            sess.drop(ttl, flow_id)
+                        else:
+                            sess.refund(ttl, flow_id)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return sess.result()
+
+    async def trace(self, dest: str, resume: Optional[dict] = None,
+                    on_snapshot: Optional[Callable[[dict], None]] = None,
+                    prior: Optional[dict] = None) -> dict:
+        """
+        Trace one target. `resume`: a snapshot of an interrupted trace of it to carry
+        on from; `on_snapshot` gets one after every hop; `prior`: an earlier result
+        to verify (default: from self.priors). A re-trace goes hop by hop even with
+        Settings.window_ttls > 1: it sends about one probe per hop, with nothing to
+        overlap.
+        """
+        if prior is None and self.priors is not None:
+            prior = self.priors.get(dest)
+        window = getattr(self.s, "window_ttls", 1)
+        if window > 1 and prior is None:
+            res = await self._trace_windowed(dest, window, resume, on_snapshot)
+        else:
+            res = await self._trace_sequential(dest, resume, on_snapshot, prior)
+        self.stats["targets"] += 1
+        self.stats["probes"] += res["probes_used"]
+        self.stats["credits_unspent"] = self.stats.get("credits_unspent", 0) + res["credits_unspent"]
+        if "hop_cache" in res:
+            self.stats["cache_probes_saved"] = (
+                self.stats.get("cache_probes_saved", 0) + res["hop_cache"]["probes_saved"])
+        if "retrace" in res:
+            self.stats["retraced"] = self.stats.get("retraced", 0) + 1
+            self.stats["paths_changed"] = self.stats.get("paths_changed", 0) + bool(res["retrace"]["changed"])
+        if "adaptive_wait" in res:
+            self.stats["wait_saved_s"] = round(
+                self.stats.get("wait_saved_s", 0.0) + res["adaptive_wait"]["wait_saved_s"], 3)
+        return res
+
+    def _hand_off(self, idx: int, dest: str, res: dict) -> None:
+        # output first: a target the journal calls done must not be missing from it
+        if self.on_result is not None:
+            self.on_result(res)
+        if self.journal is not None:
+            self.journal.done(idx, dest, res)
+
+    async def _emit(self, idx: int, dest: str, res: dict) -> None:
+        """
+        Hand `res` to on_result and then the journal on the emit thread: a writer
+        waiting on a full queue (app.io.writers.JsonlWriter) or a journal fsync then
+        holds up this worker, not the loop. One thread, so results reach the output
+        one at a time in completion order, which is also the order they are journaled.
+        """
+        if self._emitter is None:
+            self._emitter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="emit")
+        await asyncio.get_running_loop().run_in_executor(self._emitter, self._hand_off, idx, dest, res)
+
+    async def _worker(self, next_target: Callable, results: Optional[list]) -> None:
+        journal = self.journal
+        while True:
+            item = await next_target()
+            if item is None:
+                return
+            idx, dest = item
+            if journal is None:
+                res = await self.trace(dest)
+            elif journal.finished(idx):
+                if self.allocator is not None:
+                    self.allocator.expect(-1)  # no grant needed
+                continue
+            else:
+                snap = functools.partial(journal.snapshot, idx, dest) if journal.snapshots else None
+                res = await self.trace(dest, resume=journal.resume_state(idx), on_snapshot=snap)
+            if self.on_result is not None or journal is not None:
+                await self._emit(idx, dest, res)
+            if results is not None:
+                results.append(res)
+
+    async def run(self, targets: Union[Iterable[str], AsyncIterable[str]], collect: bool = True) -> list[dict]:
+        """
+        Trace every target. Returns results in completion order when `collect` is set.
+        Targets are numbered by input position, which is what the journal keys on.
+        """
+        if hasattr(targets, "__aiter__"):
+            ait = targets.__aiter__()
+            lock = asyncio.Lock()  # async generators reject concurrent __anext__
+            counter = itertools.count()
+
+            async def next_target():
+                async with lock:
+                    try:
+                        dest = await ait.__anext__()
+                    except StopAsyncIteration:
+                        return None
+                    return next(counter), dest
+        else:
+            if self.allocator is not None and hasattr(targets, "__len__"):
+                self.allocator.expect(len(targets))  # fair shares of the batch budget
+            it = enumerate(targets)
+
+            async def next_target():
+                return next(it, None)
+
+        results: Optional[list] = [] if collect else None
+        t0 = time.monotonic()
+        try:
+            await asyncio.gather(*(self._worker(next_target, results) for _ in range(self.in_flight)))
+        finally:
+            if self._emitter is not None:
+                self._emitter.shutdown(wait=True)
+                self._emitter = None
+        self.stats["elapsed_s"] = time.monotonic() - t0
+        self.stats["pacing"] = self.pacer.stats()
+        if self.allocator is not None:
+            self.stats["budget"] = self.allocator.stats()
+        if self.ctrl.hop_cache is not None:
+            self.stats["hop_cache"] = self.ctrl.hop_cache.stats()
+        if self.ctrl.rate_limits is not None:
+            self.stats["rate_limits"] = self.ctrl.rate_limits.stats()
+        if METRICS.enabled:
+            self.stats["metrics"] = METRICS.snapshot()
+        if self.journal is not None:
+            self.stats["journal"] = self.journal.stats()
+        return results or []
@@ -0,0 +1,248 @@
+# app/batch/shard.py
+import asyncio
+import copy
+import hashlib
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from app.batch.runner import AsyncBatchRunner
+from app.logging import METRICS
+from app.prober.base import AsyncProber
+
+
+def shard_of(target: str, n_shards: int) -> int:
+    """Stable shard for `target` (blake2b, not the per-process salted hash())."""
+    digest = hashlib.blake2b(target.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_shards
+
+
+def _worker_main(shard: int,
+                 prober_factory: Callable[[], AsyncProber],
+                 settings,
+                 in_flight: int,
+                 pps: Optional[float],
+                 inq,
+                 outq,
+                 snapshots: bool = False,
+                 expected: Optional[int] = None) -> None:
+    """
+    Process entry point: trace every (idx, target, resume snapshot, prior) from inq, post
+    (idx, result) to outq, and with `snapshots` (idx, (target, snapshot)) after each hop.
+    `expected`: how many targets this shard will get, for fair shares of the batch budget.
+    """
+
+    async def main():
+        prober = prober_factory()
+        runner = AsyncBatchRunner(prober, settings, in_flight=in_flight, pps=pps)
+        if expected is not None and runner.allocator is not None:
+            runner.allocator.expect(expected)
+        loop = asyncio.get_running_loop()
+        lock = asyncio.Lock()
+        exhausted = False
+
+        async def next_item():
+            nonlocal exhausted
+            async with lock:
+                if exhausted:
+                    return None
+                item = await loop.run_in_executor(None, inq.get)
+                if item is None:
+                    exhausted = True
+                return item
+
+        async def worker():
+            while True:
+                item = await next_item()
+                if item is None:
+                    return
+                idx, dest, resume, prior = item
+                snap = (lambda s, i=idx, d=dest: outq.put(("snap", i, (d, s)))) if snapshots else None
+                res = await runner.trace(dest, resume=resume, on_snapshot=snap, prior=prior)
+                outq.put(("result", idx, res))
+
+        t0 = time.monotonic()
+        try:
+            await asyncio.gather(*(worker() for _ in range(runner.in_flight)))
+        finally:
+            await prober.close()
+        stats = dict(runner.stats, elapsed_s=time.monotonic() - t0, shard=shard, pid=os.getpid(),
+                     pacing=runner.pacer.stats())
+        if runner.ctrl.hop_cache is not None:
+            stats["hop_cache"] = runner.ctrl.hop_cache.stats()
+        if runner.ctrl.rate_limits is not None:
+            stats["rate_limits"] = runner.ctrl.rate_limits.stats()
+        if runner.allocator is not None:
+            stats["budget"] = runner.allocator.stats()
+        if METRICS.enabled:
+            stats["metrics"] = METRICS.snapshot()
+        outq.put(("done", shard, stats))
+
+    asyncio.run(main())
+
+
+def run_sharded(targets: Iterable[str],
+                settings,
+                prober_factory: Callable[[], AsyncProber],
+                workers: Optional[int] = None,
+                in_flight: int = 64,
+                pps: Optional[float] = None,
+                on_result: Optional[Callable[[dict], None]] = None,
+                queue_depth: int = 1024,
+                mp_context=None,
+                journal=None,
+                priors: Optional[dict] = None) -> dict:
+    """
+    Trace `targets` on a pool of worker processes, one AsyncBatchRunner (and one
+    prober from `prober_factory`) per process. Targets are assigned with shard_of()
+    so a rerun puts the same target on the same worker; `pps` (default: Settings.pps)
+    and Settings.batch_budget are split evenly, and with a sized `targets` (a list)
+    each worker shares its part fairly among the targets it gets.
+    Results are handed to `on_result` in input order. With a `journal`
+    (app.batch.journal.Journal, kept by this process) finished targets are skipped
+    and interrupted ones resumed. `priors` (target -> earlier result) turns the
+    traces of the targets it has into re-traces; only the parent keeps it.
+    """
+    AsyncBatchRunner.check(settings)  # before any worker starts
+    ctx = mp_context or mp.get_context()
+    workers = max(1, workers or os.cpu_count() or 1)
+    if pps is None:
+        pps = getattr(settings, "pps", 0) or None
+    share = (pps / workers) if pps else None
+    if getattr(settings, "batch_budget", 0):
+        settings = copy.copy(settings)
+        settings.batch_budget = max(1, settings.batch_budget // workers)
+
+    # fair shares of each worker's batch budget need its target count up front
+    expected: list[Optional[int]] = [None] * workers
+    if getattr(settings, "batch_budget", 0) and hasattr(targets, "__len__"):
+        expected = [0] * workers
+        for idx, dest in enumerate(targets):
+            if journal is None or not journal.finished(idx):
+                expected[shard_of(dest, workers)] += 1
+
+    inqs = [ctx.Queue(queue_depth) for _ in range(workers)]
+    outq = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker_main, name=f"trace-shard-{k}",
+                    args=(k, prober_factory, settings, in_flight, share, inqs[k], outq,
+                          journal is not None and journal.snapshots, expected[k]),
+                    daemon=True)
+        for k in range(workers)
+    ]
+    for p in procs:
+        p.start()
+
+    feed_error: list[BaseException] = []
+    skipped: set[int] = set()  # finished in an earlier run: nothing to emit
+
+    def feed():
+        try:
+            for idx, dest in enumerate(targets):
+                resume = None
+                if journal is not None:
+                    if journal.finished(idx):
+                        skipped.add(idx)
+                        continue
+                    resume = journal.resume_state(idx)
+                prior = priors.get(dest) if priors is not None else None
+                inqs[shard_of(dest, workers)].put((idx, dest, resume, prior))
+        except BaseException as e:  # surface reader errors in the parent
+            feed_error.append(e)
+        finally:
+            for q in inqs:
+                q.put(None)
+
+    feeder = threading.Thread(target=feed, name="shard-feeder", daemon=True)
+    feeder.start()
+
+    # Reorder buffer: results arrive per shard, emit them in input order
+    pending: dict[int, dict] = {}
+    next_idx = 0
+    shard_stats: dict[int, dict] = {}
+    t0 = time.monotonic()
+    while len(shard_stats) < workers:
+        try:
+            kind, key, payload = outq.get(timeout=1.0)
+        except queue.Empty:
+            dead = [p.name for p in procs if not p.is_alive() and p.exitcode not in (0, None)]
+            if dead:
+                for p in procs:
+                    p.terminate()
+                raise RuntimeError(f"shard worker(s) died: {', '.join(dead)}")
+            continue
+        if kind == "done":
+            shard_stats[key] = payload
+            continue
+        if kind == "snap":
+            journal.snapshot(key, *payload)
+            continue
+        pending[key] = payload
+        while True:
+            if next_idx in pending:
+                res = pending.pop(next_idx)
+                if on_result is not None:
+                    on_result(res)
+                # journaled once emitted, so a crash never skips a result still in the reorder buffer
+                if journal is not None:
+                    journal.done(next_idx, res["target"], res)
+            elif next_idx in skipped:
+                skipped.discard(next_idx)
+            else:
+                break
+            next_idx += 1
+
+    feeder.join()
+    for p in procs:
+        p.join()
+    if feed_error:
+        raise feed_error[0]
+
+    merged = {
+        "targets": sum(st["targets"] for st in shard_stats.values()),
+        "probes": sum(st["probes"] for st in shard_stats.values()),
+        "credits_unspent": sum(st.get("credits_unspent", 0) for st in shard_stats.values()),
+        **({"retraced": sum(st.get("retraced", 0) for st in shard_stats.values()),
+            "paths_changed": sum(st.get("paths_changed", 0) for st in shard_stats.values())}
+           if priors is not None else {}),
+        "elapsed_s": time.monotonic() - t0,
+        "workers": workers,
+        "shards": [shard_stats[k] for k in sorted(shard_stats)],
+    }
+    if journal is not None:
+        merged["journal"] = journal.stats()
+    pacing = [st["pacing"] for st in shard_stats.values()]
+    merged["pacing"] = {
+        "probes": sum(p["probes"] for p in pacing),
+        "rate_pps": sum(p["rate_pps"] or 0.0 for p in pacing) or None,
+        "wait_s": round(sum(p["wait_s"] for p in pacing), 6),
+        **{k: sum(p[k] for p in pacing) for k in ("throttled", "throttled_global", "throttled_dest")},
+    }
+    # per-process metrics (Settings.metrics): counters and phase totals add up
+    snaps = [st["metrics"] for st in shard_stats.values() if "metrics" in st]
+    if snaps:
+        counters: dict = {}
+        phases: dict = {}
+        for snap in snaps:
+            for k, n in snap["counters"].items():
+                counters[k] = counters.get(k, 0) + n
+            for k, ph in snap["phases"].items():
+                acc = phases.setdefault(k, {"count": 0, "sum_s": 0.0})
+                acc["count"] += ph["count"]
+                acc["sum_s"] = round(acc["sum_s"] + ph["sum_s"], 6)
+        merged["metrics"] = {"counters": counters, "phases": phases}
+    # each worker keeps its own hop cache; report the combined hit rate
+    caches = [st["hop_cache"] for st in shard_stats.values() if "hop_cache" in st]
+    if caches:
+        hits = sum(c["hits"] for c in caches)
+        lookups = hits + sum(c["misses"] for c in caches)
+        merged["hop_cache"] = {"hits": hits, "hit_rate": (hits / lookups) if lookups else 0.0}
+        merged["cache_probes_saved"] = sum(st.get("cache_probes_saved", 0) for st in shard_stats.values())
+    # each worker draws on its share of the batch budget; report the totals
+    budgets = [st["budget"] for st in shard_stats.values() if "budget" in st]
+    if budgets:
+        merged["budget"] = {k: sum(b[k] for b in budgets) for k in budgets[0]}
+    return merged
@@ -1,165 +1,674 @@
 # app/brain/controller.py
 
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Optional
 
-from app.brain.state import RunState
-from app.brain.rules import confident_rule, dark_rule, uncertain
+from app.brain.hopcache import HopCache
+from app.brain.ratelimit import RateLimits
+from app.brain.rtt import RttEstimator, RttPriors
+from app.brain.state import RunState, TtlState, restore_run
+from app.brain.rules import confident_rule, dark_rule, hops_from_reply_ttl, uncertain
+from app.logging import METRICS, perf_counter
+from app.prober.pacing import Pacer
+from app.prober.raw import decode_raw
+
+_BLANK = TtlState()  # stands in for TTLs never visited when reporting
+
+
+def _dark(t: Optional[TtlState]) -> bool:
+    """A hop that stayed silent on its own account (not one a rate-limited router kept quiet)."""
+    return t is not None and t.final == "∅" and not t.limited
 
 
 class BudgetController:
-    def __init__(self, prober, settings):
+    def __init__(self, prober, settings, hop_cache: Optional[HopCache] = None,
+                 pacer: Optional[Pacer] = None, allocator=None,
+                 rate_limits: Optional[RateLimits] = None):
         self.prober = prober
         self.s = settings
+        # every probe this controller sends waits for its slot here (see Settings.pace_ms / pps)
+        self.pacer = pacer or Pacer.from_settings(settings)
+        # batch-wide budget (app.batch.budget.BudgetAllocator); None = total_budget per trace
+        self.allocator = allocator
+        # shared by every trace this controller runs (see Settings.hop_cache)
+        self.hop_cache = hop_cache
+        if self.hop_cache is None and getattr(settings, "hop_cache", False):
+            self.hop_cache = HopCache(
+                max_entries=getattr(settings, "hop_cache_size", 4096),
+                ttl_s=getattr(settings, "hop_cache_ttl_s", 600.0),
+            )
+        # per-router ICMP rate-limit estimates, shared the same way (see Settings.ratelimit);
+        # a prober with its own clock (the simulator) keeps time for them and for holds
+        self.rate_limits = rate_limits or RateLimits.from_settings(
+            settings, clock=getattr(prober, "clock", time.monotonic))
+        self._sleep = getattr(prober, "sleep", time.sleep)
+        # Doubletree stop set, shared the same way (see Settings.strategy)
+        self.stop_set = None
+        # per-prefix RTT estimates seeding new traces (see Settings.adaptive_wait)
+        self.rtt_priors = None
+        if getattr(settings, "adaptive_wait", False) and getattr(settings, "wait_prefix_len", 24) > 0:
+            self.rtt_priors = RttPriors(prefix_len=settings.wait_prefix_len)
+        # phase timers and counters (app/logging.py); process-wide, off unless asked for
+        if getattr(settings, "metrics", False):
+            METRICS.enable()
 
-    def run(self, dest: str):
+    def _flow_ids(self) -> list[int]:
+        return list(self.s.flow_ids) if getattr(self.s, "flow_ids", None) else [0]
+
+    def _new_run(self, dest: str) -> RunState:
         run = RunState(max_ttl=self.s.max_ttl, total_budget=self.s.total_budget)
-        flow_ids = list(self.s.flow_ids) if getattr(self.s, "flow_ids", None) else [0]
+        if self.allocator is not None:
+            run.total_budget = run.grant = self.allocator.grant()
+        if getattr(self.s, "adaptive_wait", False):
+            run.rtt = self.rtt_priors.get(dest) if self.rtt_priors is not None else RttEstimator()
+        return run
 
-        while run.probes_used < run.total_budget and run.ttl <= run.max_ttl:
-            ttl = run.ttl
-            tstate = run.per_ttl[ttl]
+    def _topup(self, run: RunState, ttl: int) -> bool:
+        """
+        Out of budget while `ttl` is still undecided: ask the batch allocator for more.
+        Uncertain hops past the near side (noisy / ECMP-heavy, see uncertain()) are
+        urgent; anything else only gets credits the allocator can spare.
+        """
+        if self.allocator is None or run.probes_used < run.total_budget:
+            return False
+        tstate = run.per_ttl.get(ttl)
+        urgent = tstate is not None and ttl > 6 and uncertain(tstate)
+        extra = self.allocator.request(urgent)
+        run.total_budget += extra
+        run.grant_extra += extra
+        return extra > 0
 
-            # If this TTL is already decided, just move on.
-            if tstate.final is not None or tstate.confident:
-                run.ttl += 1
-                continue
+    def _finish(self, dest: str, run: RunState) -> None:
+        """
+        The trace is over: what it did not spend goes back to the batch pool and its
+        RTT estimate becomes the prior for its prefix. Only the first call does anything,
+        so results can be built from `run` as often as needed.
+        """
+        if run.returned is not None:
+            return
+        run.returned = 0
+        if self.allocator is not None:
+            run.returned = max(0, run.total_budget - run.probes_used)
+            self.allocator.release(run.returned)
+            run.total_budget -= run.returned
+        if self.rtt_priors is not None and run.rtt is not None:
+            self.rtt_priors.put(dest, run.rtt)
 
-            # -------------------------------
-            # 1) Compute dynamic per-hop cap
-            # -------------------------------
-            base_cap = self.s.per_hop_budget
-            dyn_cap = base_cap  # start with base
-
-            # Look at previous hop to detect "trouble zone"
-            prev = run.per_ttl.get(ttl - 1) if ttl > 1 else None
-
-            allow_rollover = False
-            # Only even consider spending extra credits if this hop is genuinely uncertain
-            if uncertain(tstate):
-                # Only try extra probes deeper in the path (beyond edge),
-                # and when the previous hop was dark or noisy.
-                if ttl > 6 and prev is not None:
-                    prev_noisy = (prev.final == "∅") or (prev.timeouts >= 2)
-                    if prev_noisy:
-                        allow_rollover = True
-
-            if allow_rollover:
-                extra_allow = min(
-                    run.pool,
-                    getattr(self.s, "rollover_cap_per_hop", 0)
-                )
-                dyn_cap = base_cap + extra_allow
-                dyn_cap = min(
-                    dyn_cap,
-                    getattr(self.s, "hard_per_hop_max", base_cap),
-                )
-
-            # Store for debugging / reporting
-            tstate.base_cap = base_cap
-            tstate.dyn_cap = dyn_cap
-
-            # -------------------------------
-            # 2) Choose flow & guard budget
-            # -------------------------------
-            # tiny ECMP peek via round-robin flow IDs
-            chosen_flow = flow_ids[(tstate.attempts) % len(flow_ids)]
-
-            if run.probes_used >= run.total_budget:
-                run.stop_reason = "budget_exhausted"
-                break
+    def _probe_kw(self, run: RunState) -> dict:
+        """Extra prober arguments for the next probe: the adaptive reply wait, once there is an RTT estimate."""
+        if run.rtt is None:
+            return {}
+        fixed = getattr(self.s, "probe_wait_s", 5.0)
+        wait = run.rtt.timeout_s(
+            k=getattr(self.s, "wait_rttvar_k", 4.0),
+            lo=getattr(self.s, "wait_min_s", 1.0),
+            hi=min(fixed, getattr(self.s, "wait_max_s", fixed)),
+            step=getattr(self.s, "wait_step_s", 0.0),
+        )
+        run.wait_s = wait if wait is not None else fixed
+        return {"wait_s": wait} if wait is not None else {}
 
-            # -------------------------------
-            # 3) Send one probe
-            # -------------------------------
-            ev = self.prober.probe_once(dest, ttl, flow_id=chosen_flow)
-            run.probes_used += 1
-            tstate.attempts += 1
+    # -------------------------------
+    # Per-hop building blocks (shared by run / run_batched)
+    # -------------------------------
+    def _hop_caps(self, run: RunState, ttl: int) -> tuple[int, int]:
+        """Return (base_cap, dyn_cap) for `ttl`, lending pool credits to troubled hops."""
+        tstate = run.per_ttl[ttl]
+        base_cap = self.s.per_hop_budget
+        dyn_cap = base_cap  # start with base
 
-            status = ev.get("status")
-            hop_ip = ev.get("hop_ip")
+        # Look at previous hop to detect "trouble zone"
+        prev = run.per_ttl.get(ttl - 1) if ttl > 1 else None
 
-            if status in ("ttl_exceeded", "dest_reached") and hop_ip:
-                tstate.counts[hop_ip] += 1
+        allow_rollover = False
+        # Only even consider spending extra credits if this hop is genuinely uncertain
+        if uncertain(tstate):
+            # Only try extra probes deeper in the path (beyond edge),
+            # and when the previous hop was dark or noisy.
+            if ttl > 6 and prev is not None:
+                prev_noisy = (prev.final == "∅") or (prev.timeouts >= 2)
+                if prev_noisy:
+                    allow_rollover = True
 
-                # If we get a destination-style reply, stop the entire run.
-                if status == "dest_reached" or hop_ip == dest:
+        if allow_rollover:
+            extra_allow = min(
+                run.pool,
+                getattr(self.s, "rollover_cap_per_hop", 0)
+            )
+            dyn_cap = base_cap + extra_allow
+            dyn_cap = min(
+                dyn_cap,
+                getattr(self.s, "hard_per_hop_max", base_cap),
+            )
+
+        # Store for debugging / reporting
+        tstate.base_cap = base_cap
+        tstate.dyn_cap = dyn_cap
+        return base_cap, dyn_cap
+
+    def _seed_from_cache(self, run: RunState, ttl: int) -> None:
+        """
+        Look up an untouched near-side hop in the hop cache. With hop_cache_confirm
+        the hop still gets one probe (see _record); otherwise it is taken as final.
+        """
+        tstate = run.per_ttl[ttl]
+        if (self.hop_cache is None or tstate.attempts or tstate.cached
+                or ttl > getattr(self.s, "hop_cache_max_ttl", 6)):
+            return
+        hop_ip = self.hop_cache.get(self.s.vantage, ttl, self._flow_ids()[0])
+        if hop_ip is None:
+            return
+        run.cache_hits += 1
+        tstate.cached = hop_ip
+        if not getattr(self.s, "hop_cache_confirm", True):
+            tstate.final = hop_ip
+            tstate.confident = True
+            run.cache_probes_saved += self.s.repeats_needed
+
+    def _remember(self, ttl: int, tstate: TtlState) -> None:
+        """Cache a near-side hop that locked onto a single IP (no ECMP ambiguity)."""
+        if (self.hop_cache is None or not tstate.confident or tstate.final in (None, "∅")
+                or len(tstate.counts) != 1 or ttl > getattr(self.s, "hop_cache_max_ttl", 6)):
+            return
+        for flow_id in self._flow_ids():
+            self.hop_cache.put(self.s.vantage, ttl, flow_id, tstate.final)
+
+    def _record(self, run: RunState, dest: str, ttl: int, ev: dict) -> bool:
+        """Account one probe result against `ttl`. Returns True if it reached `dest`."""
+        tstate = run.per_ttl[ttl]
+        run.probes_used += 1
+        tstate.attempts += 1
+
+        status = ev.get("status")
+        hop_ip = ev.get("hop_ip")
+        if METRICS.enabled:
+            METRICS.inc("probes")
+            if status in ("timeout", "dest_reached"):
+                METRICS.inc("timeouts" if status == "timeout" else "dest_reached")
+        if getattr(self.s, "debug", False) and ev.get("raw"):
+            if tstate.raws is None:
+                tstate.raws = []
+            tstate.raws.append(ev["raw"])
+
+        replied = status in ("ttl_exceeded", "dest_reached") and bool(hop_ip)
+        throttled = (self.rate_limits is not None
+                     and self._rate_limited(run, ttl, ev, hop_ip if replied else None))
+
+        if replied:
+            tstate.add_reply(hop_ip)
+            if run.rtt is not None and ev.get("rtt_ms") is not None:
+                run.rtt.update(ev["rtt_ms"])
+
+            # If we get a destination-style reply, stop the entire run.
+            if status == "dest_reached" or hop_ip == dest:
+                tstate.final = hop_ip
+                tstate.confident = True
+                run.dest_reached = True
+                run.stop_reason = "dest_reached"
+                return True
+
+            # First reply on a cache-seeded hop: one matching probe confirms it
+            if tstate.cached and tstate.final is None and tstate.attempts == 1:
+                if hop_ip == tstate.cached:
                     tstate.final = hop_ip
                     tstate.confident = True
-                    run.dest_reached = True
-                    run.stop_reason = "dest_reached"
-                    break
+                    run.cache_probes_saved += max(0, self.s.repeats_needed - 1)
+                else:
+                    self.hop_cache.invalidate(self.s.vantage, ttl, self._flow_ids()[0])
+        else:
+            # timeout/unreach etc.; a router throttling its ICMP is no evidence the hop is dark
+            if throttled:
+                tstate.limited += 1
             else:
-                # timeout/unreach etc.
                 tstate.timeouts += 1
+            if run.rtt is not None and status == "timeout":
+                run.wait_saved_s += getattr(self.s, "probe_wait_s", 5.0) - run.wait_s
+        return False
 
-            # -------------------------------
-            # 4) Per-hop decision logic
-            # -------------------------------
-            if confident_rule(tstate.counts, self.s.repeats_needed):
-                # The most frequent IP wins
-                top_ip = max(tstate.counts, key=lambda k: tstate.counts[k])
-                tstate.final = top_ip
-                tstate.confident = True
-            elif dark_rule(tstate.timeouts, tstate.attempts, dyn_cap):
-                # Too much silence -> mark as dark
+    def _router_at(self, run: RunState, ttl: int, flow_id: int) -> Optional[str]:
+        """Who should answer at `ttl`: the interface the hop answered from most, else a known near-side router."""
+        counts = run.per_ttl[ttl].counts
+        if counts:
+            return max(counts, key=counts.get)
+        return self.rate_limits.expect(ttl, flow_id)
+
+    def _rate_limited(self, run: RunState, ttl: int, ev: dict, hop_ip: Optional[str]) -> bool:
+        """Feed one probe outcome to the rate-limit estimates; True for a timeout the router's limit explains."""
+        flow_id = ev.get("flow_id") or 0
+        router = hop_ip or self._router_at(run, ttl, flow_id)
+        if router is None:
+            return False
+        # what counts is when the probe went out, not when its answer (or timeout) came back
+        if hop_ip is not None:
+            took_s = (ev.get("rtt_ms") or 0.0) / 1000.0
+        else:
+            took_s = run.wait_s if run.rtt is not None else getattr(self.s, "probe_wait_s", 5.0)
+        return self.rate_limits.observe(router, hop_ip is not None, ttl, flow_id, took_s)
+
+    def _hold(self, run: RunState, ttl: int, flow_id: int) -> float:
+        """Seconds to wait before probing `ttl` so a rate-limited router there can answer."""
+        if self.rate_limits is None:
+            return 0.0
+        return self.rate_limits.hold(self._router_at(run, ttl, flow_id))
+
+    def _apply_distance(self, run: RunState, dest: str, ev: dict) -> None:
+        """Account the distance probe (sent at max_ttl) and trim max_ttl if the destination answered."""
+        run.probes_used += 1
+        if ev.get("status") != "dest_reached" and ev.get("hop_ip") != dest:
+            return
+        est = hops_from_reply_ttl(ev.get("reply_ttl"))
+        if est is not None:
+            run.dest_distance_est = est
+            run.max_ttl = min(run.max_ttl, est + getattr(self.s, "distance_slack", 2))
+
+    def _decide(self, tstate: TtlState, dyn_cap: int) -> None:
+        if tstate.final is not None:
+            return
+        if confident_rule(tstate.counts, self.s.repeats_needed):
+            # The most frequent IP wins
+            top_ip = max(tstate.counts, key=lambda k: tstate.counts[k])
+            tstate.final = top_ip
+            tstate.confident = True
+        elif dark_rule(tstate.timeouts, tstate.attempts, dyn_cap):
+            # Too much silence -> mark as dark, unless it was a rate limit keeping the router quiet.
+            # A limited hop that never answered stays "∅" (its per_ttl entry says why) and does
+            # not count toward gap_limit.
+            if tstate.limited and tstate.counts:
+                tstate.final = max(tstate.counts, key=lambda k: tstate.counts[k])
+            else:
                 tstate.final = "∅"
 
-            # -------------------------------
-            # 5) Move on or keep probing
-            # -------------------------------
-            if tstate.final is not None or tstate.attempts >= dyn_cap:
-                used = tstate.attempts
-
-                # If we used fewer probes than base_cap, deposit credits into the pool.
-                if used < base_cap:
-                    deposit = base_cap - used
-                    run.pool = min(
-                        run.pool + deposit,
-                        getattr(self.s, "rollover_pool_max", 10),
-                    )
-                    tstate.pool_in = deposit
-                else:
-                    # If we went beyond base_cap, withdraw the extra from the pool.
-                    extra_used = max(0, used - base_cap)
-                    if extra_used > 0:
-                        run.pool = max(0, run.pool - extra_used)
-                        tstate.pool_out = extra_used
+    def _close_hop(self, run: RunState, ttl: int, tstate: TtlState, base_cap: int) -> None:
+        self._remember(ttl, tstate)
+        used = tstate.attempts
+
+        # If we used fewer probes than base_cap, deposit credits into the pool.
+        if used < base_cap:
+            deposit = base_cap - used
+            run.pool = min(
+                run.pool + deposit,
+                getattr(self.s, "rollover_pool_max", 10),
+            )
+            tstate.pool_in = deposit
+            if METRICS.enabled:
+                METRICS.inc("pool_deposits", deposit)
+        else:
+            # If we went beyond base_cap, withdraw the extra from the pool.
+            extra_used = max(0, used - base_cap)
+            if extra_used > 0:
+                run.pool = max(0, run.pool - extra_used)
+                tstate.pool_out = extra_used
+                if METRICS.enabled:
+                    METRICS.inc("pool_withdrawals", extra_used)
+        tstate.closed = True
+
+        # Too many silent hops in a row: the rest of the path is unlikely to answer
+        gap_limit = getattr(self.s, "gap_limit", 0)
+        if (gap_limit and _dark(tstate) and run.stop_reason is None
+                and self._dark_run(run, ttl) >= gap_limit):
+            run.stop_reason = "gap_limit"
+
+    @staticmethod
+    def _dark_run(run: RunState, ttl: int) -> int:
+        """Length of the run of consecutive dark hops through `ttl` (hops may close out of order)."""
+        lo = hi = ttl
+        while lo > 1 and _dark(run.per_ttl.get(lo - 1)):
+            lo -= 1
+        while _dark(run.per_ttl.get(hi + 1)):
+            hi += 1
+        return hi - lo + 1
+
+    # -------------------------------
+    # Sequential mode: one probe per loop iteration
+    # -------------------------------
+    def session(self, dest: str, resume: Optional[dict] = None, prior: Optional[dict] = None) -> "TraceSession":
+        """
+        A TraceSession for `dest`; `resume` is a snapshot_run() of an interrupted
+        trace to carry on from (strategies with state beyond RunState start over).
+        `prior`: an earlier result for `dest` (or its compact_prior()); the trace then
+        verifies that path instead of starting cold, whatever the strategy.
+        """
+        if prior is not None:
+            from app.brain.retrace import RetraceSession
+            sess = RetraceSession(self, dest, prior)
+        elif getattr(self.s, "strategy", "forward") == "doubletree":
+            from app.brain.doubletree import DoubletreeSession, StopSet
+            if self.stop_set is None:
+                self.stop_set = StopSet(prefix_len=getattr(self.s, "doubletree_prefix_len", 24))
+            sess = DoubletreeSession(self, dest, self.stop_set)
+        elif getattr(self.s, "strategy", "forward") == "multipath":
+            from app.brain.multipath import MultipathSession
+            sess = MultipathSession(self, dest)
+        else:
+            sess = TraceSession(self, dest)
+        if resume is not None and sess.resumable:
+            self._resume(sess, resume)
+        return sess
+
+    def _resume(self, sess, snap: dict) -> None:
+        """Swap the fresh RunState of `sess` for a restored one (at a hop boundary)."""
+        fresh = sess.run
+        run = restore_run(snap)
+        if self.allocator is not None:
+            # the old grant died with the old process: what is left runs on the new one
+            run.grant = fresh.grant
+            run.grant_extra = 0
+            run.total_budget = run.probes_used + fresh.total_budget
+        if run.rtt is None:
+            run.rtt = fresh.rtt
+        sess.run = run
+        sess._distance = None  # already sent (or not wanted) the first time round
+
+    def run(self, dest: str, prior: Optional[dict] = None):
+        sess = self.session(dest, prior=prior)
+        M = METRICS
+        while True:
+            timed = M.enabled  # read once per probe: the only cost when metrics are off
+            t0 = perf_counter() if timed else 0.0
+            probe = sess.next_probe()
+            if probe is None:
+                break
+            ttl, flow_id = probe
+            kw = sess.probe_kw()
+            if timed:
+                M.observe("ctl_next", perf_counter() - t0)
+            if self.rate_limits is not None:
+                hold = sess.hold(ttl, flow_id)
+                if hold:
+                    self._sleep(hold)
+            self.pacer.wait(dest)
+            t1 = perf_counter() if timed else 0.0
+            ev = self.prober.probe_once(dest, ttl, flow_id=flow_id, **kw)
+            if timed:
+                t2 = perf_counter()
+                M.observe("probe", t2 - t1)
+            sess.feed(ttl, flow_id, ev)
+            if timed:
+                M.observe("ctl_feed", perf_counter() - t2)
+        return sess.result()
+
+    # -------------------------------
+    # Windowed mode: several TTLs in flight at once (see app/brain/window.py)
+    # -------------------------------
+    def run_windowed(self, dest: str, window: Optional[int] = None):
+        """Like run(), with up to `window` (default Settings.window_ttls) TTLs probed concurrently."""
+        from app.brain.window import WindowSession
+        sess = WindowSession(self, dest, window or getattr(self.s, "window_ttls", 4))
+
+        def send(ttl: int, flow_id: int, kw: dict, hold: float):
+            if hold:
+                self._sleep(hold)
+            self.pacer.wait(dest)
+            return self.prober.probe_once(dest, ttl, flow_id=flow_id, **kw)
+
+        pool = ThreadPoolExecutor(max_workers=sess.window * max(1, self.s.repeats_needed),
+                                  thread_name_prefix="window")
+        pending: dict = {}
+        try:
+            while True:
+                for ttl, flow_id in sess.next_probes():
+                    hold = sess.hold(ttl, flow_id) if self.rate_limits is not None else 0.0
+                    pending[pool.submit(send, ttl, flow_id, sess.probe_kw(ttl, flow_id), hold)] = (ttl, flow_id)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    ttl, flow_id = pending.pop(fut)
+                    sess.feed(ttl, flow_id, fut.result())
+                # past the destination: unsent probes are refunded, running ones written off
+                for fut, (ttl, flow_id) in list(pending.items()):
+                    if sess.cancelled(ttl):
+                        del pending[fut]
+                        if fut.cancel():
+                            sess.refund(ttl, flow_id)
+                        else:
+                            sess.drop(ttl, flow_id)
+        finally:
+            # probes already on the prober finish before the caller can close it
+            pool.shutdown(wait=True, cancel_futures=True)
+        return sess.result()
+
+    # -------------------------------
+    # Batched mode: plan several TTLs, send them as one probe_batch
+    # -------------------------------
+    def _plan_batch(self, run: RunState) -> list[tuple[int, int]]:
+        """
+        Pick the next `batch_ttls` undecided hops starting at run.ttl and ask each for
+        just enough probes to possibly lock it (repeats_needed minus its best count),
+        never past its dyn_cap nor the remaining total budget.
+        """
+        flow_ids = self._flow_ids()
+        max_ttls = max(1, getattr(self.s, "batch_ttls", 4))
+        remaining = run.total_budget - run.probes_used
+
+        plan: list[tuple[int, int]] = []
+        planned_ttls = 0
+        ttl = run.ttl
+        while ttl <= run.max_ttl and planned_ttls < max_ttls and len(plan) < remaining:
+            tstate = run.per_ttl[ttl]
+            self._seed_from_cache(run, ttl)
+            if tstate.closed or tstate.final is not None or tstate.confident:
+                ttl += 1
+                continue
+            _base_cap, dyn_cap = self._hop_caps(run, ttl)
+            best = max(tstate.counts.values(), default=0)
+            need = max(1, self.s.repeats_needed - best)
+            if tstate.cached and not tstate.attempts:
+                need = 1  # a single confirmation probe
+            n = min(need, max(1, dyn_cap - tstate.attempts), remaining - len(plan))
+            for i in range(n):
+                plan.append((ttl, flow_ids[(tstate.attempts + i) % len(flow_ids)]))
+            planned_ttls += 1
+            ttl += 1
+        return plan
+
+    def _fold_batch(self, run: RunState, dest: str, plan: list[tuple[int, int]], events: list[dict]) -> None:
+        """
+        Apply batch results in TTL order, charging every probe that went out. Once
+        the destination answers, later results are only charged: they tell nothing
+        new. Probes the prober reports unsent (sent=False, e.g. scamper stopped at
+        the destination first) are not charged at all.
+        """
+        by_ttl: dict[int, list[dict]] = {}
+        for (ttl, _flow), ev in zip(plan, events):
+            if ev.get("sent", True):
+                by_ttl.setdefault(ttl, []).append(ev)
+
+        reached = False
+        for ttl in sorted(by_ttl):
+            tstate = run.per_ttl[ttl]
+            for ev in by_ttl[ttl]:
+                if reached:
+                    run.probes_used += 1
+                    tstate.attempts += 1
+                elif self._record(run, dest, ttl, ev):
+                    reached = True
+            if not reached:
+                self._decide(tstate, tstate.dyn_cap)
+                if tstate.final is not None or tstate.attempts >= tstate.dyn_cap:
+                    self._close_hop(run, ttl, tstate, tstate.base_cap)
+
+    def run_batched(self, dest: str):
+        run = self._new_run(dest)
+        if getattr(self.s, "distance_probe", False):
+            self.pacer.wait(dest)
+            self._apply_distance(run, dest, self.prober.probe_once(dest, run.max_ttl, flow_id=self._flow_ids()[0]))
+
+        while run.ttl <= run.max_ttl and (run.probes_used < run.total_budget or self._topup(run, run.ttl)):
+            plan = self._plan_batch(run)
+            if not plan:
+                break
+            self.pacer.wait(dest, n=len(plan))
+            events = self.prober.probe_batch(dest, plan, **self._probe_kw(run))
+            self._fold_batch(run, dest, plan, events)
+            if run.stop_reason:
+                break
 
+            # Skip over every hop that is now settled
+            while run.ttl <= run.max_ttl:
+                tstate = run.per_ttl[run.ttl]
+                if not (tstate.closed or tstate.final is not None or tstate.confident):
+                    break
                 run.ttl += 1
-            else:
-                # Still undecided and under dyn_cap -> keep probing this hop
-                time.sleep(getattr(self.s, "per_probe_delay_s", 0.03))
 
-        # -------------------------------
-        # 6) Build summary result
-        # -------------------------------
+        self._finish(dest, run)
+        return self._result(dest, run)
+
+    # -------------------------------
+    # Build summary result
+    # -------------------------------
+    @staticmethod
+    def _ttl_dict(t: TtlState) -> dict:
+        return {
+            "final": t.final,
+            "counts": dict(t.counts),
+            "timeouts": t.timeouts,
+            "attempts": t.attempts,
+            **({"rate_limited": t.limited} if t.limited else {}),
+            # debug meta
+            "base_cap": t.base_cap,
+            "dyn_cap": t.dyn_cap,
+            "pool_in": t.pool_in,
+            "pool_out": t.pool_out,
+            # retained payloads are only collected with Settings.debug
+            **({"raw": [decode_raw(r) for r in t.raws]} if t.raws else {}),
+        }
+
+    @staticmethod
+    def _wait_summary(run: RunState) -> dict:
+        est = run.rtt
+        return {
+            "srtt_ms": round(est.srtt, 3) if est.srtt is not None else None,
+            "rttvar_ms": round(est.rttvar, 3) if est.srtt is not None else None,
+            "timeouts": sum(t.timeouts for t in run.per_ttl.values()),
+            "wait_saved_s": round(run.wait_saved_s, 3),
+        }
+
+    def _result(self, dest: str, run: RunState) -> dict:
         path = {}
-        for k in range(1, run.max_ttl + 1):
+        for k in sorted(run.per_ttl):
             if run.per_ttl[k].final is not None:
                 path[k] = run.per_ttl[k].final
 
+        # budget as it was before _finish handed the unspent part back
+        budget = run.total_budget + (run.returned or 0)
+        unspent = max(0, budget - run.probes_used)
+
+        # "sparse": only hops that were probed (or seeded); "full": every TTL 1..max_ttl
+        if getattr(self.s, "result_format", "full") == "sparse":
+            ttls = [k for k in sorted(run.per_ttl) if run.per_ttl[k].probed]
+        else:
+            ttls = range(1, run.max_ttl + 1)
+
         return {
             "target": dest,
             "path": path,
             "probes_used": run.probes_used,
             "stop_reason": (
                 run.stop_reason
-                or ("max_ttl" if run.ttl > run.max_ttl else "unknown")
+                or ("max_ttl" if run.ttl > run.max_ttl
+                    else "budget_exhausted" if run.probes_used >= budget else "unknown")
             ),
-            "per_ttl": {
-                k: {
-                    "final": run.per_ttl[k].final,
-                    "counts": dict(run.per_ttl[k].counts),
-                    "timeouts": run.per_ttl[k].timeouts,
-                    "attempts": run.per_ttl[k].attempts,
-                    # debug meta
-                    "base_cap": run.per_ttl[k].base_cap,
-                    "dyn_cap": run.per_ttl[k].dyn_cap,
-                    "pool_in": run.per_ttl[k].pool_in,
-                    "pool_out": run.per_ttl[k].pool_out,
-                }
-                for k in range(1, run.max_ttl + 1)
-            },
+            "per_ttl": {k: self._ttl_dict(run.per_ttl.get(k, _BLANK)) for k in ttls},
             "pool_remaining": run.pool,
+            # budget this trace did not need; a batch-level allocator can hand it to others
+            "credits_unspent": unspent,
+            **({"grant": {"initial": run.grant, "extra": run.grant_extra, "returned": run.returned or 0}}
+               if self.allocator is not None else {}),
+            **({"dest_distance_est": run.dest_distance_est} if run.dest_distance_est is not None else {}),
+            **({"hop_cache": {"hits": run.cache_hits, "probes_saved": run.cache_probes_saved}}
+               if self.hop_cache is not None else {}),
+            **({"adaptive_wait": self._wait_summary(run)} if run.rtt is not None else {}),
         }
+
+
+class TraceSession:
+    """
+    The sequential BudgetController loop turned inside out: the caller asks for the
+    next (ttl, flow_id) to send, performs the probe however it likes (blocking,
+    asyncio, batched with other targets) and feeds the event back. Pacing is the
+    driver's job too (ctrl.pacer).
+    """
+
+    # all of the session's state is in self.run, so a snapshot of it can be resumed
+    resumable = True
+
+    def __init__(self, ctrl: BudgetController, dest: str):
+        self.ctrl = ctrl
+        self.s = ctrl.s
+        self.dest = dest
+        self.run = ctrl._new_run(dest)
+        self.flow_ids = ctrl._flow_ids()
+        self.done = False
+        # Settings.distance_probe: None (off) -> "pending" -> "sent" -> None
+        self._distance = "pending" if getattr(self.s, "distance_probe", False) else None
+        self._caps = (0, 0)
+
+    def next_probe(self) -> Optional[tuple[int, int]]:
+        """Return the next (ttl, flow_id) to send, or None once the trace is finished."""
+        run = self.run
+        if self.done:
+            return None
+        if self._distance == "pending" and run.probes_used < run.total_budget:
+            self._distance = "sent"
+            return run.max_ttl, self.flow_ids[0]
+
+        while run.ttl <= run.max_ttl and run.stop_reason is None:
+            if run.probes_used >= run.total_budget and not self.ctrl._topup(run, run.ttl):
+                break
+            ttl = run.ttl
+            tstate = run.per_ttl[ttl]
+            self.ctrl._seed_from_cache(run, ttl)
+
+            # If this TTL is already decided, just move on.
+            if tstate.final is not None or tstate.confident:
+                run.ttl += 1
+                continue
+
+            # 1) Compute dynamic per-hop cap
+            self._caps = self.ctrl._hop_caps(run, ttl)
+
+            # 2) Choose flow: tiny ECMP peek via round-robin flow IDs
+            return ttl, self.flow_ids[tstate.attempts % len(self.flow_ids)]
+
+        self.done = True
+        return None
+
+    def feed(self, ttl: int, flow_id: int, ev: dict) -> None:
+        run = self.run
+        if self._distance == "sent":
+            self._distance = None
+            self.ctrl._apply_distance(run, self.dest, ev)
+            return
+        tstate = run.per_ttl[ttl]
+
+        # 3) Account the probe
+        if self.ctrl._record(run, self.dest, ttl, ev):
+            self.done = True
+            return
+
+        # 4) Per-hop decision logic
+        base_cap, dyn_cap = self._caps
+        self.ctrl._decide(tstate, dyn_cap)
+
+        # 5) Move on or keep probing
+        if tstate.final is not None or tstate.attempts >= dyn_cap:
+            self.ctrl._close_hop(run, ttl, tstate, base_cap)
+            run.ttl += 1
+
+    def probe_kw(self) -> dict:
+        """Keyword arguments to pass to probe_once for the probe next_probe() returned."""
+        return self.ctrl._probe_kw(self.run)
+
+    def hold(self, ttl: int, flow_id: int) -> float:
+        """Seconds the driver should wait before sending this probe (a rate-limited router; see Settings.ratelimit)."""
+        return self.ctrl._hold(self.run, ttl, flow_id)
+
+    def finish(self) -> None:
+        """Settle the finished trace with the shared state (batch pool, RTT priors); result() calls it."""
+        self.ctrl._finish(self.dest, self.run)
+
+    def result(self) -> dict:
+        self.finish()
+        return self.ctrl._result(self.dest, self.run)
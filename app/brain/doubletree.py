@@ -0,0 +1,228 @@
+# app/brain/doubletree.py
+import ipaddress
+import threading
+from typing import Optional
+
+from app.brain.controller import BudgetController, TraceSession
+
+
+class StopSet:
+    """
+    Global Doubletree stop set shared by every trace in a batch: (interface,
+    destination prefix) pairs already discovered. prefix_len=0 turns it into a
+    plain interface set (Doubletree's "local" stop set).
+    Also keeps a running mean of destination distance, used to pick the
+    mid-path TTL new traces start from, and for each pair the hops a finished
+    trace saw below it, which fill in the TTLs a backward walk stopping there
+    skipped.
+    """
+
+    def __init__(self, prefix_len: int = 24):
+        self.prefix_len = prefix_len
+        self._pairs: set[tuple[str, str]] = set()
+        self._below: dict[tuple[str, str], tuple[str, ...]] = {}  # pair -> hops at TTL 1.. under it
+        self._lock = threading.Lock()
+        self._dist_sum = 0
+        self._dist_n = 0
+
+    def _prefix(self, dest: str) -> str:
+        if self.prefix_len <= 0:
+            return ""
+        try:
+            addr = ipaddress.ip_address(dest)
+        except ValueError:
+            return dest  # hostname: treat as its own prefix
+        plen = min(self.prefix_len, addr.max_prefixlen)
+        return str(ipaddress.ip_network(f"{addr}/{plen}", strict=False))
+
+    def add(self, hop_ip: str, dest: str) -> None:
+        with self._lock:
+            self._pairs.add((hop_ip, self._prefix(dest)))
+
+    def __contains__(self, item: tuple[str, str]) -> bool:
+        hop_ip, dest = item
+        return (hop_ip, self._prefix(dest)) in self._pairs
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def note_path(self, dest: str, path: dict) -> None:
+        """Remember, for each hop of a finished trace's `path` (TTL -> IP), the known hops below it."""
+        prefix = self._prefix(dest)
+        below: list[str] = []
+        with self._lock:
+            for ttl in range(1, max(path, default=0) + 1):
+                hop = path.get(ttl)
+                if hop is None:
+                    return  # a gap: nothing above it has a complete path below
+                if hop != "∅" and hop != dest:
+                    self._below[(hop, prefix)] = tuple(below)
+                below.append(hop)
+
+    def below(self, hop_ip: str, dest: str) -> Optional[tuple[str, ...]]:
+        """The hops (TTL 1, 2, ...) under `hop_ip` on the way to `dest`'s prefix, if a trace saw them all."""
+        return self._below.get((hop_ip, self._prefix(dest)))
+
+    def note_distance(self, hops: int) -> None:
+        with self._lock:
+            self._dist_sum += hops
+            self._dist_n += 1
+
+    def mid_path_ttl(self, default: int) -> int:
+        """Half the mean destination distance seen so far, else `default`."""
+        if not self._dist_n:
+            return default
+        return max(1, round(self._dist_sum / self._dist_n / 2))
+
+
+class DoubletreeSession(TraceSession):
+    """
+    Doubletree probing: start at a mid-path TTL h, walk forward to the destination
+    exactly like the forward strategy, then walk backward from h-1 and stop as soon
+    as a hop's (interface, destination prefix) is already in the stop set. Per-hop
+    confidence / dark decisions are the usual confident_rule / dark_rule.
+    """
+
+    resumable = False  # phase and stop-set progress live outside RunState
+
+    def __init__(self, ctrl: BudgetController, dest: str, stop_set: StopSet):
+        super().__init__(ctrl, dest)
+        self.stop_set = stop_set
+        default = getattr(self.s, "doubletree_start_ttl", 8)
+        self.start_ttl = min(self.run.max_ttl, stop_set.mid_path_ttl(default))
+        self.run.ttl = self.start_ttl
+        self.phase = "forward"
+        self.back_ttl = self.start_ttl - 1
+        self.forward_stop: Optional[str] = None
+        self.backward_stop_ttl: Optional[int] = None
+        self.skipped_filled = 0
+
+    # -------------------------------
+    # phase switching
+    # -------------------------------
+    def _end_forward(self) -> None:
+        run = self.run
+        self.forward_stop = (
+            run.stop_reason
+            or ("max_ttl" if run.ttl > run.max_ttl else "budget_exhausted")
+        )
+        self.phase = "backward"
+        self.done = False
+
+    def next_probe(self) -> Optional[tuple[int, int]]:
+        if self.phase == "forward":
+            probe = super().next_probe()
+            if probe is not None:
+                return probe
+            self._end_forward()
+        if self.phase == "backward":
+            return self._next_backward()
+        return None
+
+    def _next_backward(self) -> Optional[tuple[int, int]]:
+        run = self.run
+        while self.back_ttl >= 1:
+            if run.probes_used >= run.total_budget and not self.ctrl._topup(run, self.back_ttl):
+                break
+            ttl = self.back_ttl
+            tstate = run.per_ttl[ttl]
+            self.ctrl._seed_from_cache(run, ttl)
+            if tstate.final is not None:
+                if self._check_stop(ttl, tstate.final):
+                    break
+                self.back_ttl -= 1
+                continue
+            self._caps = self.ctrl._hop_caps(run, ttl)
+            return ttl, self.flow_ids[tstate.attempts % len(self.flow_ids)]
+
+        self.phase = "done"
+        self.done = True
+        return None
+
+    def _check_stop(self, ttl: int, final: str) -> bool:
+        """
+        True if backward probing should stop at this (decided) hop. It stops only
+        where the stop set also knows every hop below, which then fill in the
+        TTLs left unprobed; a known interface met at another distance (a
+        different path under it) is walked past.
+        """
+        if final == "∅":
+            return False
+        if (final, self.dest) in self.stop_set:
+            below = self.stop_set.below(final, self.dest)
+            if below is not None and len(below) == ttl - 1:
+                self.backward_stop_ttl = ttl
+                self.skipped_filled = self._fill(below)
+                return True
+        self.stop_set.add(final, self.dest)
+        return False
+
+    def _fill(self, below: tuple[str, ...]) -> int:
+        """Take the hops under the stop point from the stop set. Returns how many were filled."""
+        filled = 0
+        for ttl, hop in enumerate(below, start=1):
+            tstate = self.run.per_ttl[ttl]
+            if tstate.final is None and not tstate.attempts:
+                tstate.final = hop
+                filled += 1
+        return filled
+
+    # -------------------------------
+    # feeding results
+    # -------------------------------
+    def feed(self, ttl: int, flow_id: int, ev: dict) -> None:
+        if self.phase == "forward":
+            super().feed(ttl, flow_id, ev)
+            tstate = self.run.per_ttl[ttl]
+            if tstate.final not in (None, "∅"):
+                self.stop_set.add(tstate.final, self.dest)
+            if self.done:
+                self._end_forward()
+            return
+
+        run = self.run
+        tstate = run.per_ttl[ttl]
+        if self.ctrl._record(run, self.dest, ttl, ev):
+            # h overshot the destination: it is closer than we guessed, so the
+            # copies of it recorded at higher TTLs are not real hops
+            for k, t in run.per_ttl.items():
+                if k > ttl and t.final == self.dest:
+                    t.final = None
+            self.back_ttl -= 1
+            return
+
+        base_cap, dyn_cap = self._caps
+        self.ctrl._decide(tstate, dyn_cap)
+        if tstate.final is not None or tstate.attempts >= dyn_cap:
+            self.ctrl._close_hop(run, ttl, tstate, base_cap)
+            if tstate.final is not None and self._check_stop(ttl, tstate.final):
+                self.back_ttl = 0
+            else:
+                self.back_ttl -= 1
+
+    def result(self) -> dict:
+        run = self.run
+        # the backward walk can find the destination closer than the forward walk did
+        if self.forward_stop is not None and not run.dest_reached:
+            run.stop_reason = self.forward_stop
+        skipped = list(range(1, self.backward_stop_ttl)) if self.backward_stop_ttl else []
+        res = super().result()
+
+        dest_ttl = min((k for k, v in res["path"].items() if v == self.dest), default=None)
+        if dest_ttl is not None:
+            self.stop_set.note_distance(dest_ttl)
+        self.stop_set.note_path(self.dest, res["path"])
+
+        # Forward-walk baseline: every hop below the stop point would have been
+        # probed too, at no fewer than repeats_needed probes each.
+        res.update({
+            "strategy": "doubletree",
+            "start_ttl": self.start_ttl,
+            "backward_stop_ttl": self.backward_stop_ttl,
+            # TTLs under the stop point that were not probed: their path entries
+            # come from an earlier trace through the same stop-set hop
+            "skipped_ttls": skipped,
+            "skipped_filled": self.skipped_filled,
+            "baseline_probes_est": run.probes_used + len(skipped) * self.s.repeats_needed,
+        })
+        return res
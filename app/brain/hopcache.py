@@ -0,0 +1,70 @@
+# app/brain/hopcache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class HopCache:
+    """
+    Bounded, expiring map of (vantage, ttl, flow_id) -> hop IP, shared by every trace
+    a controller runs. Near-side hops (TTL 1..~6) are the same routers for nearly
+    every destination seen from one vantage point, so a fresh entry lets a trace
+    seed that hop instead of spending repeats_needed probes on it again.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_s: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._data: OrderedDict = OrderedDict()  # key -> (hop_ip, expires_at), LRU order
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, vantage: str, ttl: int, flow_id: int) -> Optional[str]:
+        key = (vantage, ttl, flow_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            hop_ip, expires_at = entry
+            if expires_at <= self.clock():
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return hop_ip
+
+    def put(self, vantage: str, ttl: int, flow_id: int, hop_ip: str) -> None:
+        key = (vantage, ttl, flow_id)
+        with self._lock:
+            self._data[key] = (hop_ip, self.clock() + self.ttl_s)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, vantage: str, ttl: int, flow_id: int) -> None:
+        with self._lock:
+            self._data.pop((vantage, ttl, flow_id), None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,193 @@
+# app/brain/multipath.py
+import math
+from functools import lru_cache
+from typing import Optional
+
+from app.brain.controller import BudgetController, TraceSession
+from app.brain.rules import dark_rule
+
+
+@lru_cache(maxsize=None)
+def mda_stop(k: int, alpha: float) -> int:
+    """
+    n_k of the MDA stopping rule: replies needed at a hop where k interfaces have
+    been seen to rule out a (k+1)-th one with probability 1 - alpha, assuming the
+    load balancer spreads flows uniformly.
+    """
+    return math.ceil(math.log(alpha / (k + 1)) / math.log(k / (k + 1)))
+
+
+def mda_confidence(k: int, n: int) -> float:
+    """Confidence that k interfaces are all there is after n replies (0 when nothing answered)."""
+    if k <= 0:
+        return 0.0
+    return max(0.0, 1.0 - (k + 1) * (k / (k + 1)) ** n)
+
+
+def mda_uniform(counts, alpha: float) -> bool:
+    """
+    Uniformity test: False when the least answered of k interfaces got so few of
+    n replies that a uniform split gives that with probability below alpha
+    (binomial tail, union bound over the k interfaces).
+    """
+    k = len(counts)
+    if k < 2:
+        return True
+    n = sum(counts.values())
+    p = 1.0 / k
+    tail = sum(math.comb(n, i) * p ** i * (1 - p) ** (n - i) for i in range(min(counts.values()) + 1))
+    return k * tail >= alpha
+
+
+def meshed(prev: dict, here: dict) -> bool:
+    """
+    Meshing test over flow -> interface observations at two adjacent hops: some
+    interface below fans out to several above it while some interface above is
+    reached from several below (the diamond is a mesh, not parallel paths).
+    """
+    succ: dict[str, set] = {}
+    pred: dict[str, set] = {}
+    for flow_id, ip in here.items():
+        if flow_id in prev:
+            succ.setdefault(prev[flow_id], set()).add(ip)
+            pred.setdefault(ip, set()).add(prev[flow_id])
+    return any(len(v) > 1 for v in succ.values()) and any(len(v) > 1 for v in pred.values())
+
+
+class MultipathSession(TraceSession):
+    """
+    MDA-lite ECMP enumeration. Every probe at a hop goes out on a different flow.
+    A hop starts "lite": like the forward strategy it is settled by
+    repeats_needed replies from one interface, without the MDA's n_1 probes,
+    since most hops do not load balance. Once two flows land on different
+    interfaces (a divergence) the hop is enumerated with the MDA stopping rule:
+    done once its replies reach n_k for the k interfaces seen so far (mda_stop),
+    and the hops after it get that rule too until one closes on a single
+    interface again (the paths converged).
+
+    Enumeration assumes a uniform split over unmeshed paths, as MDA-lite does;
+    where the uniformity test (mda_uniform) or the meshing test against the
+    hop below (meshed) fails, the stopping rule is not trusted and the hop is
+    probed up to mda_hop_budget, as the full MDA would. The trace's total budget
+    still bounds everything; hops are walked forward as usual.
+
+    Flows that answered at the previous hop are reused first, so the flow ->
+    interface observations of adjacent hops line up and give the links between
+    them; only then are fresh flow IDs drawn. Per-TTL results gain
+    "interfaces", "confidence" and "links", and "meshed" / "nonuniform" where
+    those tests failed.
+    """
+
+    resumable = False  # per-flow observations live outside RunState
+
+    def __init__(self, ctrl: BudgetController, dest: str):
+        super().__init__(ctrl, dest)
+        self.alpha = getattr(self.s, "mda_alpha", 0.05)
+        self.hop_cap = max(1, getattr(self.s, "mda_hop_budget", 16))
+        self.flows: dict[int, dict[int, str]] = {}   # ttl -> flow_id -> interface that answered
+        self.tried: dict[int, set[int]] = {}         # ttl -> flow IDs already sent there
+        self._fresh = max(self.flow_ids) + 1
+        self.diverged = False                        # inside a diamond: hops are enumerated in full
+        self.meshed: set[int] = set()                # TTLs that failed the meshing test
+        self.nonuniform: set[int] = set()            # TTLs that failed the uniformity test
+
+    def _pick_flow(self, ttl: int) -> int:
+        tried = self.tried.setdefault(ttl, set())
+        for flow_id in (*self.flows.get(ttl - 1, ()), *self.flow_ids):
+            if flow_id not in tried:
+                break
+        else:
+            flow_id = self._fresh
+            self._fresh += 1
+        tried.add(flow_id)
+        return flow_id
+
+    def next_probe(self) -> Optional[tuple[int, int]]:
+        run = self.run
+        if self.done:
+            return None
+        if self._distance == "pending" and run.probes_used < run.total_budget:
+            self._distance = "sent"
+            return run.max_ttl, self.flow_ids[0]
+
+        while run.ttl <= run.max_ttl and run.stop_reason is None:
+            if run.probes_used >= run.total_budget and not self.ctrl._topup(run, run.ttl):
+                break
+            ttl = run.ttl
+            tstate = run.per_ttl[ttl]
+            if tstate.closed:
+                run.ttl += 1
+                continue
+            tstate.base_cap = self.s.per_hop_budget
+            if not tstate.dyn_cap:
+                tstate.dyn_cap = self.hop_cap if self.diverged else self.s.per_hop_budget
+            return ttl, self._pick_flow(ttl)
+
+        self.done = True
+        return None
+
+    def _enumerated(self, ttl: int, tstate) -> bool:
+        """MDA stopping rule at a diverged hop; the tests that void it raise its cap to mda_hop_budget."""
+        counts = tstate.counts
+        k = len(counts)
+        if k > 1 and ttl not in self.meshed and meshed(self.flows.get(ttl - 1, {}), self.flows.get(ttl, {})):
+            self.meshed.add(ttl)
+        if sum(counts.values()) < mda_stop(k, self.alpha):
+            return False
+        if ttl in self.meshed or not mda_uniform(counts, self.alpha):
+            if ttl not in self.meshed:
+                self.nonuniform.add(ttl)
+            return tstate.attempts >= self.hop_cap
+        return True
+
+    def feed(self, ttl: int, flow_id: int, ev: dict) -> None:
+        if self._distance == "sent":
+            super().feed(ttl, flow_id, ev)
+            return
+        run = self.run
+        tstate = run.per_ttl[ttl]
+        if ev.get("status") in ("ttl_exceeded", "dest_reached") and ev.get("hop_ip"):
+            self.flows.setdefault(ttl, {})[flow_id] = ev["hop_ip"]
+        if self.ctrl._record(run, self.dest, ttl, ev):
+            self.done = True
+            return
+
+        k = len(tstate.counts)
+        if k > 1 and not self.diverged:
+            # two flows, two interfaces: a load balancer, enumerate it
+            self.diverged = True
+            tstate.dyn_cap = self.hop_cap
+        if not k:
+            done = (tstate.attempts >= tstate.dyn_cap
+                    or dark_rule(tstate.timeouts, tstate.attempts, self.s.per_hop_budget))
+        elif self.diverged:
+            done = self._enumerated(ttl, tstate)
+        else:
+            done = max(tstate.counts.values()) >= self.s.repeats_needed
+        if not done and tstate.attempts < tstate.dyn_cap:
+            return
+        tstate.confident = k > 0 and done
+        if self.diverged and k == 1 and tstate.confident:
+            self.diverged = False  # the paths converged on this hop
+        # the most frequent interface stands in for the hop on the single-path view
+        tstate.final = max(tstate.counts, key=tstate.counts.get) if k else "∅"
+        self.ctrl._close_hop(run, ttl, tstate, tstate.base_cap)
+        run.ttl += 1
+
+    def result(self) -> dict:
+        res = super().result()
+        for ttl, hop in res["per_ttl"].items():
+            if not hop["counts"]:
+                continue
+            here = self.flows.get(ttl, {})
+            prev = self.flows.get(ttl - 1, {})
+            hop["interfaces"] = sorted(hop["counts"])
+            hop["confidence"] = round(mda_confidence(len(hop["counts"]), sum(hop["counts"].values())), 4)
+            hop["links"] = sorted({(prev[f], ip) for f, ip in here.items() if f in prev})
+            if ttl in self.meshed:
+                hop["meshed"] = True
+            if ttl in self.nonuniform:
+                hop["nonuniform"] = True
+        res["strategy"] = "multipath"
+        res["mda_alpha"] = self.alpha
+        return res
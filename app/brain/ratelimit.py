@@ -0,0 +1,155 @@
+# app/brain/ratelimit.py
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class _Router:
+    __slots__ = ("last_reply", "next_send", "interval", "short_n", "short_lost", "long_n", "long_lost",
+                 "limited")
+
+    def __init__(self, interval: float):
+        self.last_reply: Optional[float] = None
+        self.next_send = -math.inf  # a slot hold() already gave out to a probe
+        self.interval = interval    # reply interval: a decaying minimum of the spacing between its replies
+        self.short_n = 0          # probes sent sooner after one of its replies than the interval ...
+        self.short_lost = 0       # ... and how many of them went unanswered
+        self.long_n = 0           # probes after a longer quiet spell ...
+        self.long_lost = 0
+        self.limited = False
+
+
+class RateLimits:
+    """
+    Per-router ICMP rate-limit estimates shared by every trace a controller runs.
+
+    Each probe outcome is attributed to the router expected to answer it (the
+    reply's source, or the interface the hop already answered from) and sorted by
+    whether it went out sooner after that router's previous reply than the
+    router's reply interval. That is the closest recent spacing between two of its
+    replies: a reply lowers it to its own gap if closer, else lets it drift a
+    `relax` fraction of the way back up to `gap_s`, so one close pair (a limiter
+    with burst > 1, two traces' probes crossing) is forgotten instead of making
+    every later loss look late. A token-bucket limiter drops the probes that
+    follow a reply closely and answers the ones that come after a pause; plain
+    loss does not care. A router whose early probes are mostly lost (at least
+    `min_samples` of them) while later ones are mostly answered is flagged limited.
+
+    Flagged routers get their probes spaced by that interval (hold(), which books
+    the slot it hands out so probes queued together go out one interval apart).
+    Their early timeouts don't count toward dark_rule, and neither do those of a
+    router with too few early probes to judge yet: one on a single path only
+    ever gets a handful. Near-side routers (TTL <= near_ttl), which every trace
+    crosses, are also remembered per (ttl, flow) so a trace that has not heard
+    from the hop yet still knows who is behind it.
+    """
+
+    def __init__(self, gap_s: float = 1.0, min_samples: int = 3, near_ttl: int = 6,
+                 max_routers: int = 65536, relax: float = 0.25,
+                 clock: Callable[[], float] = time.monotonic):
+        self.gap_s = gap_s
+        self.relax = relax
+        self.min_samples = min_samples
+        self.near_ttl = near_ttl
+        self.max_routers = max_routers
+        self.clock = clock
+        self._routers: "OrderedDict[str, _Router]" = OrderedDict()  # LRU
+        self._near: dict[tuple[int, int], str] = {}  # (ttl, flow) -> limited near-side router
+        self._lock = threading.Lock()
+        self.early_timeouts = 0
+
+    @classmethod
+    def from_settings(cls, settings, clock: Callable[[], float] = time.monotonic) -> Optional["RateLimits"]:
+        if not getattr(settings, "ratelimit", False):
+            return None
+        return cls(gap_s=getattr(settings, "ratelimit_gap_s", 1.0),
+                   min_samples=getattr(settings, "ratelimit_min_samples", 3),
+                   near_ttl=getattr(settings, "hop_cache_max_ttl", 6),
+                   clock=clock)
+
+    def _router(self, ip: str) -> _Router:
+        r = self._routers.get(ip)
+        if r is None:
+            r = self._routers[ip] = _Router(self.gap_s)
+            while len(self._routers) > self.max_routers:
+                self._routers.popitem(last=False)
+        else:
+            self._routers.move_to_end(ip)
+        return r
+
+    def _judge(self, r: _Router) -> None:
+        if r.short_n < self.min_samples or not r.long_n:
+            return
+        r.limited = r.short_lost >= 0.6 * r.short_n and r.long_lost <= 0.3 * r.long_n
+        if r.short_n + r.long_n > 64:
+            # age the evidence so a router that stops limiting is let go again
+            r.short_n, r.short_lost = r.short_n // 2, r.short_lost // 2
+            r.long_n, r.long_lost = r.long_n // 2, r.long_lost // 2
+
+    def observe(self, ip: str, answered: bool, ttl: int = 0, flow_id: int = 0,
+                took_s: float = 0.0) -> bool:
+        """
+        Account one probe expected to be answered by `ip`, which was sent `took_s`
+        ago (its RTT, or the reply wait for a timeout). Returns True for a timeout the
+        router's rate limit explains: the probe went out early, and the router is
+        flagged or has too few early probes yet to be judged either way.
+        """
+        now = self.clock() - took_s
+        with self._lock:
+            r = self._router(ip)
+            gap = now - r.last_reply if r.last_reply is not None else math.inf
+            early = gap < r.interval
+            if early:
+                r.short_n += 1
+                r.short_lost += not answered
+            else:
+                r.long_n += 1
+                r.long_lost += not answered
+            if answered:
+                if r.last_reply is not None:
+                    r.interval = min(gap, r.interval + (self.gap_s - r.interval) * self.relax)
+                r.last_reply = now
+            self._judge(r)
+            # until there is enough evidence to judge the router, a timeout right after
+            # one of its replies gets the benefit of the doubt
+            explained = not answered and early and (r.limited or r.short_n < self.min_samples)
+            if explained:
+                self.early_timeouts += 1
+            if 0 < ttl <= self.near_ttl:
+                if r.limited:
+                    self._near[(ttl, flow_id)] = ip
+                elif self._near.get((ttl, flow_id)) == ip:
+                    del self._near[(ttl, flow_id)]
+            return explained
+
+    def limited(self, ip: Optional[str]) -> bool:
+        r = self._routers.get(ip) if ip else None
+        return r is not None and r.limited
+
+    def expect(self, ttl: int, flow_id: int) -> Optional[str]:
+        """The limited near-side router other traces met at (ttl, flow_id), if any."""
+        return self._near.get((ttl, flow_id)) if ttl <= self.near_ttl else None
+
+    def hold(self, ip: Optional[str]) -> float:
+        """
+        Seconds to wait before probing `ip` so its limiter has a reply to spare
+        (0 = go). The caller is taken to send then: the next hold() for `ip` is
+        counted from that slot, so probes queued together go out an interval apart.
+        """
+        r = self._routers.get(ip) if ip else None
+        if r is None or not r.limited or r.last_reply is None:
+            return 0.0
+        now = self.clock()
+        with self._lock:
+            # a little past the interval, so the probe does not land on the limiter's edge
+            send = max(now, max(r.last_reply, r.next_send) + 1.1 * r.interval)
+            r.next_send = send
+            return send - now
+
+    def stats(self) -> dict:
+        with self._lock:
+            limited = [ip for ip, r in self._routers.items() if r.limited]
+        return {"routers": len(self._routers), "limited": len(limited),
+                "early_timeouts": self.early_timeouts}
@@ -0,0 +1,141 @@
+# app/brain/retrace.py
+import zlib
+from typing import Optional
+
+from app.brain.controller import BudgetController, TraceSession
+
+
+def compact_prior(result: dict) -> dict:
+    """
+    The part of an earlier result a re-trace needs: the path (TTL keys as ints, as
+    they come back from JSON as strings), the interfaces seen per TTL and whether
+    the destination answered. Small enough to keep for every target of a batch.
+    """
+    path = {int(k): v for k, v in result.get("path", {}).items()}
+    seen = {int(k): sorted(h["counts"]) for k, h in result.get("per_ttl", {}).items()
+            if len(h.get("counts") or ()) > 1}
+    return {"path": path, "interfaces": seen, "dest_reached": result.get("stop_reason") == "dest_reached"}
+
+
+class RetraceSession(TraceSession):
+    """
+    Re-trace of a destination with an earlier result as prior. Each hop the prior
+    knows gets one verification probe: a reply from the interface (or one of the
+    ECMP interfaces) it had, or silence where it had "∅", closes the hop at once.
+    Anything else escalates the hop to the usual confident_rule / dark_rule probing,
+    with the verification probe counting as its first attempt. Hops past the
+    prior's end are traced cold.
+
+    With Settings.retrace_sample < 1 only that fraction of hops is verified (chosen
+    by a stable hash of target and TTL); the rest are taken from the prior unprobed,
+    until the first disagreement, after which every remaining hop is verified.
+    The destination hop is always verified. The result gains "retrace": probe
+    counts and the hops that changed against the prior.
+    """
+
+    resumable = False  # escalated hops and the sampling state live outside RunState
+
+    def __init__(self, ctrl: BudgetController, dest: str, prior: dict):
+        super().__init__(ctrl, dest)
+        if "interfaces" not in prior:
+            prior = compact_prior(prior)
+        self.prior = prior["path"]
+        self.alts = prior["interfaces"]
+        self.sample = getattr(self.s, "retrace_sample", 1.0)
+        self._dest_ttl = max(self.prior, default=0) if prior["dest_reached"] else None
+        self._distance = None  # the prior already says how far the destination is
+        self._verifying: Optional[int] = None  # TTL whose verification probe is out
+        self.escalated: set[int] = set()
+        self.verified = 0
+        self.skipped = 0
+
+    def _sampled(self, ttl: int) -> bool:
+        if self.sample >= 1.0 or ttl == self._dest_ttl:
+            return True
+        return zlib.crc32(f"{self.dest}/{ttl}".encode()) < self.sample * 0x100000000
+
+    def _agrees(self, ttl: int, ev: dict) -> bool:
+        want = self.prior[ttl]
+        if ev.get("status") in ("ttl_exceeded", "dest_reached") and ev.get("hop_ip"):
+            return ev["hop_ip"] == want or ev["hop_ip"] in self.alts.get(ttl, ())
+        return want == "∅" and ev.get("status") == "timeout"
+
+    def next_probe(self) -> Optional[tuple[int, int]]:
+        run = self.run
+        while not self.done and run.stop_reason is None and run.ttl <= run.max_ttl:
+            ttl = run.ttl
+            if ttl not in self.prior or ttl in self.escalated:
+                break
+            tstate = run.per_ttl[ttl]
+            if not self._sampled(ttl):
+                # taken on trust; nothing was sent, so nothing goes to the pool or hop cache
+                tstate.final = self.prior[ttl]
+                tstate.confident = tstate.final != "∅"
+                tstate.closed = True
+                self.skipped += 1
+                run.ttl += 1
+                continue
+            if run.probes_used >= run.total_budget and not self.ctrl._topup(run, ttl):
+                break
+            self._verifying = ttl
+            self._caps = (1, 1)
+            return ttl, self.flow_ids[0]
+        return super().next_probe()
+
+    def feed(self, ttl: int, flow_id: int, ev: dict) -> None:
+        if self._verifying != ttl:
+            super().feed(ttl, flow_id, ev)
+            return
+        self._verifying = None
+        self.verified += 1
+        run = self.run
+        tstate = run.per_ttl[ttl]
+        agrees = self._agrees(ttl, ev)
+        if self.ctrl._record(run, self.dest, ttl, ev):
+            self.done = True
+            return
+        if not agrees:
+            self.escalated.add(ttl)
+            self.sample = 1.0
+            return
+        tstate.final = self.prior[ttl]
+        tstate.confident = tstate.final != "∅"
+        self.ctrl._close_hop(run, ttl, tstate, 1)
+        run.ttl += 1
+
+    def _diff(self, path: dict) -> list[dict]:
+        last = max(path, default=0)
+        changed = []
+        for ttl in sorted(set(self.prior) | set(path)):
+            was, now = self.prior.get(ttl), path.get(ttl)
+            if was != now and (ttl <= last or self.run.dest_reached):
+                changed.append({"ttl": ttl, "was": was, "now": now})
+        return changed
+
+    def result(self) -> dict:
+        res = super().result()
+        changed = self._diff(res["path"])
+        res["retrace"] = {
+            "verified": self.verified,
+            "skipped": self.skipped,
+            "escalated": sorted(self.escalated),
+            "changed": changed,
+        }
+        return res
+
+
+def load_priors(paths) -> dict[str, dict]:
+    """target -> compact_prior() from result JSONL files (gzip ok); later files win."""
+    from app.io.readers import open_text
+    from app.prober.parse import loads
+    priors = {}
+    for path in ([paths] if isinstance(paths, str) else paths):
+        fh = open_text(path)
+        try:
+            for line in fh:
+                if line.strip():
+                    res = loads(line)
+                    priors[res["target"]] = compact_prior(res)
+        finally:
+            fh.close()
+    return priors
@@ -0,0 +1,86 @@
+# app/brain/rtt.py
+import ipaddress
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def dest_prefix(dest: str, prefix_len: int) -> str:
+    """`dest` truncated to its /prefix_len network (hostnames are their own prefix)."""
+    try:
+        addr = ipaddress.ip_address(dest)
+    except ValueError:
+        return dest
+    plen = min(prefix_len, addr.max_prefixlen)
+    return str(ipaddress.ip_network(f"{addr}/{plen}", strict=False))
+
+
+class RttEstimator:
+    """
+    Smoothed RTT / RTT variance over the replies of one trace (RFC 6298 gains),
+    turned into a probe timeout. Deeper hops are further away, so the timeout
+    never drops below twice the largest RTT seen so far.
+    """
+
+    __slots__ = ("srtt", "rttvar", "max_rtt", "samples")
+
+    def __init__(self, srtt: Optional[float] = None, rttvar: float = 0.0, max_rtt: float = 0.0):
+        self.srtt = srtt          # ms
+        self.rttvar = rttvar      # ms
+        self.max_rtt = max_rtt    # ms
+        self.samples = 0
+
+    def update(self, rtt_ms: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt_ms
+            self.rttvar = rtt_ms / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt_ms)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt_ms
+        self.max_rtt = max(self.max_rtt, rtt_ms)
+        self.samples += 1
+
+    def timeout_s(self, k: float = 4.0, lo: float = 1.0, hi: float = 5.0,
+                  step: float = 0.0) -> Optional[float]:
+        """Wait for the next probe, clamped to [lo, hi] and rounded up to `step`; None without data."""
+        if self.srtt is None:
+            return None
+        wait = max(self.srtt + k * self.rttvar, 2 * self.max_rtt) / 1000.0
+        if step:
+            wait = math.ceil(wait / step) * step
+        return min(hi, max(lo, wait))
+
+
+class RttPriors:
+    """
+    Last RTT estimate per destination prefix, shared by every trace a controller
+    runs, so a new trace towards a known prefix starts with a tight timeout.
+    """
+
+    def __init__(self, prefix_len: int = 24, max_entries: int = 4096):
+        self.prefix_len = prefix_len
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()  # prefix -> (srtt, rttvar, max_rtt), LRU order
+        self._lock = threading.Lock()
+
+    def get(self, dest: str) -> RttEstimator:
+        key = dest_prefix(dest, self.prefix_len)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+        return RttEstimator(*entry) if entry is not None else RttEstimator()
+
+    def put(self, dest: str, est: RttEstimator) -> None:
+        if est.srtt is None:
+            return
+        key = dest_prefix(dest, self.prefix_len)
+        with self._lock:
+            self._data[key] = (est.srtt, est.rttvar, est.max_rtt)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -26,4 +26,15 @@ def uncertain(tstate) -> bool:
     """
     many_timeouts = tstate.timeouts >= 2
     heavy_ecmp = len(tstate.counts) >= 3
-    return many_timeouts or heavy_ecmp
\ No newline at end of file
+    return many_timeouts or heavy_ecmp
+
+
+def hops_from_reply_ttl(reply_ttl) -> int | None:
+    """
+    Estimate how many hops away a replying host is from the IP-TTL of its reply:
+    assume the smallest common initial TTL (32, 64, 128, 255) not below it.
+    """
+    if not reply_ttl or reply_ttl > 255:
+        return None
+    initial = next(t for t in (32, 64, 128, 255) if t >= reply_ttl)
+    return initial - reply_ttl + 1
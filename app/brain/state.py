@@ -1,21 +1,60 @@
 # app/brain/state.py
 from collections import Counter
 from dataclasses import dataclass, field
+from types import MappingProxyType
 
-@dataclass
+# read-only stand-in for a hop that has not seen a reply yet
+_NO_COUNTS = MappingProxyType({})
+
+
+@dataclass(slots=True)
 class TtlState:
     final: str | None = None
-    counts: Counter = field(default_factory=Counter)
+    # reply counts per IP; the Counter is only allocated on the first reply
+    _counts: Counter | None = None
     timeouts: int = 0
     attempts: int = 0
+    limited: int = 0  # timeouts put down to the router's ICMP rate limit (not counted in timeouts)
     confident: bool = False
+    closed: bool = False  # controller has moved past this hop
+    cached: str | None = None  # hop IP seeded from the cross-target hop cache
+    raws: list | None = None   # retained probe payloads, only with Settings.debug
     # debug meta for reporting (optional)
     base_cap: int = 0
     dyn_cap: int = 0
     pool_in: int = 0     # credits deposited at hop exit
     pool_out: int = 0    # credits spent beyond base at this hop
 
-@dataclass
+    @property
+    def counts(self):
+        """Reply counts per IP (read-only empty mapping until the first reply)."""
+        return self._counts if self._counts is not None else _NO_COUNTS
+
+    @counts.setter
+    def counts(self, value) -> None:
+        self._counts = Counter(value) if value else None
+
+    def add_reply(self, hop_ip: str) -> None:
+        if self._counts is None:
+            self._counts = Counter()
+        self._counts[hop_ip] += 1
+
+    @property
+    def probed(self) -> bool:
+        return self.attempts > 0 or self.final is not None
+
+
+class TtlTable(dict):
+    """ttl -> TtlState, creating a hop's state on first access instead of up front."""
+
+    __slots__ = ()
+
+    def __missing__(self, ttl: int) -> TtlState:
+        tstate = self[ttl] = TtlState()
+        return tstate
+
+
+@dataclass(slots=True)
 class RunState:
     max_ttl: int
     total_budget: int
@@ -25,9 +64,57 @@ class RunState:
     dest_reached: bool = False
     # NEW: global credit pool
     pool: int = 0
-    # per-ttl book-keeping
-    per_ttl: dict = field(default_factory=dict)
+    # hop cache accounting
+    cache_hits: int = 0
+    cache_probes_saved: int = 0
+    # adaptive wait (Settings.adaptive_wait): RTT estimate, wait of the probe in
+    # flight, and reply-wait time saved on timeouts against the fixed wait
+    rtt: object | None = None
+    wait_s: float = 0.0
+    wait_saved_s: float = 0.0
+    # batch budget (Settings.batch_budget): initial grant and top-ups received
+    grant: int | None = None
+    grant_extra: int = 0
+    # credits handed back when the trace finished (BudgetController._finish); None before
+    returned: int | None = None
+    # hop distance of the destination from the distance probe (Settings.distance_probe)
+    dest_distance_est: int | None = None
+    # per-ttl book-keeping, filled lazily as hops are visited
+    per_ttl: TtlTable = field(default_factory=TtlTable)
+
+
+# -------------------------------
+# Snapshots (app/batch/journal.py): JSON-safe copies of a trace's state
+# -------------------------------
+_RUN_FIELDS = ("max_ttl", "total_budget", "ttl", "probes_used", "stop_reason", "dest_reached", "pool",
+               "cache_hits", "cache_probes_saved", "wait_s", "wait_saved_s", "grant", "grant_extra",
+               "dest_distance_est")
+_TTL_FIELDS = ("final", "timeouts", "attempts", "limited", "confident", "closed", "cached",
+               "base_cap", "dyn_cap", "pool_in", "pool_out")
+
+
+def snapshot_run(run: RunState) -> dict:
+    """Everything needed to carry on with `run` later (retained raw payloads are left out)."""
+    snap = {k: getattr(run, k) for k in _RUN_FIELDS}
+    if run.rtt is not None:
+        snap["rtt"] = [run.rtt.srtt, run.rtt.rttvar, run.rtt.max_rtt]
+    snap["per_ttl"] = {
+        str(ttl): {**{k: getattr(t, k) for k in _TTL_FIELDS}, "counts": dict(t.counts)}
+        for ttl, t in run.per_ttl.items() if t.probed or t.cached
+    }
+    return snap
+
 
-    def __post_init__(self):
-        for k in range(1, self.max_ttl + 1):
-            self.per_ttl[k] = TtlState()
+def restore_run(snap: dict) -> RunState:
+    run = RunState(max_ttl=snap["max_ttl"], total_budget=snap["total_budget"])
+    for k in _RUN_FIELDS:
+        setattr(run, k, snap[k])
+    if snap.get("rtt") is not None:
+        from app.brain.rtt import RttEstimator
+        run.rtt = RttEstimator(*snap["rtt"])
+    for ttl, fields in snap["per_ttl"].items():
+        t = run.per_ttl[int(ttl)]
+        for k in _TTL_FIELDS:
+            setattr(t, k, fields[k])
+        t.counts = fields["counts"]
+    return run
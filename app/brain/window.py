@@ -0,0 +1,197 @@
+# app/brain/window.py
+from collections import deque
+from typing import Optional
+
+from app.brain.controller import BudgetController
+from app.brain.state import snapshot_run
+
+
+class WindowSession:
+    """
+    Speculative variant of TraceSession: instead of finishing hop k before touching
+    k+1, keep probes outstanding for every undecided TTL in ttl..ttl+window-1 and
+    settle hops as their replies come back, in any order.
+
+    Every outstanding probe holds a budget reservation. Once the destination
+    answers at TTL d, probes queued for TTLs past d are cancelled and refunded
+    (see refund / drop); replies for them that were already on the wire are
+    counted as wasted. Hops below d are still finished. Forward strategy only.
+
+    Drivers: call next_probes(), send them concurrently, feed() each reply, and
+    check cancelled() for what is still in flight; repeat until next_probes()
+    returns nothing and nothing is outstanding.
+
+    snapshot() / resume() carry a trace across a restart (app/batch/journal.py)
+    like TraceSession's: probes still out when the snapshot is taken count as
+    spent, and their hops are probed again on resume.
+    """
+
+    def __init__(self, ctrl: BudgetController, dest: str, window: int):
+        self.check(ctrl.s)
+        self.ctrl = ctrl
+        self.s = ctrl.s
+        self.dest = dest
+        self.window = max(1, window)
+        self.run = ctrl._new_run(dest)
+        self.flow_ids = ctrl._flow_ids()
+        self.inflight: dict[int, int] = {}   # ttl -> reserved (outstanding) probes
+        # (ttl, flow_id) -> reply waits of its outstanding probes: the estimate moves
+        # while they are out, and savings / rate-limit timing need each one's own
+        self._waits: dict[tuple[int, int], deque] = {}
+        self.dest_ttl: Optional[int] = None
+        self.wasted = 0
+        self.refunded = 0
+        self.done = False
+
+    @staticmethod
+    def check(settings) -> None:
+        """Raise ValueError for settings a windowed trace cannot honour."""
+        strategy = getattr(settings, "strategy", "forward")
+        if strategy != "forward":
+            raise ValueError(f"window_ttls > 1 traces with the forward strategy only, not {strategy!r}")
+
+    @property
+    def reserved(self) -> int:
+        return sum(self.inflight.values())
+
+    def _settled(self, ttl: int) -> bool:
+        t = self.run.per_ttl.get(ttl)
+        return t is not None and (t.closed or t.final is not None or t.confident)
+
+    def _release(self, ttl: int) -> None:
+        n = self.inflight.get(ttl, 0) - 1
+        if n > 0:
+            self.inflight[ttl] = n
+        else:
+            self.inflight.pop(ttl, None)
+
+    def next_probes(self) -> list[tuple[int, int]]:
+        """Every (ttl, flow_id) that can go out now; each one reserves a unit of budget."""
+        run = self.run
+        if self.done:
+            return []
+        # slide the window past hops that are settled and have nothing in flight
+        while run.ttl <= run.max_ttl and self._settled(run.ttl) and run.ttl not in self.inflight:
+            run.ttl += 1
+
+        probes: list[tuple[int, int]] = []
+        if run.stop_reason not in (None, "dest_reached"):
+            top = 0  # gap limit: no new probes
+        else:
+            top = min(run.max_ttl, run.ttl + self.window - 1)
+            if self.dest_ttl is not None:
+                top = min(top, self.dest_ttl - 1)
+
+        for ttl in range(run.ttl, top + 1):
+            self.ctrl._seed_from_cache(run, ttl)
+            if self._settled(ttl):
+                continue
+            tstate = run.per_ttl[ttl]
+            _base_cap, dyn_cap = self.ctrl._hop_caps(run, ttl)
+            out = self.inflight.get(ttl, 0)
+            best = max(tstate.counts.values(), default=0)
+            need = max(1, self.s.repeats_needed - best)
+            if tstate.cached and not tstate.attempts:
+                need = 1  # a single confirmation probe
+            left = run.total_budget - run.probes_used - self.reserved
+            if left <= 0 and not out and self.ctrl._topup(run, ttl):
+                left = run.total_budget - run.probes_used - self.reserved
+            n = min(need - out, dyn_cap - tstate.attempts - out, left)
+            for i in range(max(0, n)):
+                probes.append((ttl, self.flow_ids[(tstate.attempts + out + i) % len(self.flow_ids)]))
+            if n > 0:
+                self.inflight[ttl] = out + n
+
+        if not probes and not self.inflight:
+            self.done = True
+        return probes
+
+    def snapshot(self) -> dict:
+        """The run as app.brain.state.snapshot_run() gives it, with the probes in flight spent."""
+        snap = snapshot_run(self.run)
+        snap["probes_used"] += self.reserved
+        return snap
+
+    def resume(self, snap: dict) -> None:
+        """Carry on from snapshot() of an interrupted trace of the same destination (nothing sent yet)."""
+        self.ctrl._resume(self, snap)
+        self.dest_ttl = min((k for k, t in self.run.per_ttl.items() if t.final == self.dest), default=None)
+
+    def probe_kw(self, ttl: int, flow_id: int) -> dict:
+        """Prober arguments for one of next_probes(); its reply wait is kept until it is fed back."""
+        kw = self.ctrl._probe_kw(self.run)
+        self._waits.setdefault((ttl, flow_id), deque()).append(self.run.wait_s)
+        return kw
+
+    def _sent_wait(self, ttl: int, flow_id: Optional[int] = None) -> Optional[float]:
+        """Forget the reply wait of an outstanding probe to `ttl` (on `flow_id`, if given) and return it."""
+        keys = [(ttl, flow_id)] if flow_id is not None else [k for k in self._waits if k[0] == ttl]
+        for key in keys:
+            waits = self._waits.get(key)
+            if waits:
+                wait = waits.popleft()
+                if not waits:
+                    del self._waits[key]
+                return wait
+        return None
+
+    def hold(self, ttl: int, flow_id: int) -> float:
+        """Seconds this probe should wait before going out (a rate-limited router; see Settings.ratelimit)."""
+        return self.ctrl._hold(self.run, ttl, flow_id)
+
+    def cancelled(self, ttl: int) -> bool:
+        """True if an outstanding probe for `ttl` is no longer wanted (past the destination)."""
+        return self.dest_ttl is not None and ttl > self.dest_ttl
+
+    def refund(self, ttl: int, flow_id: Optional[int] = None) -> None:
+        """A cancelled probe that was never sent: give its reservation back."""
+        self._release(ttl)
+        self._sent_wait(ttl, flow_id)
+        self.refunded += 1
+
+    def drop(self, ttl: int, flow_id: Optional[int] = None) -> None:
+        """A cancelled probe that was already sent: it cost a probe, its reply is ignored."""
+        self._release(ttl)
+        self._sent_wait(ttl, flow_id)
+        self.run.probes_used += 1
+        self.wasted += 1
+
+    def feed(self, ttl: int, flow_id: int, ev: dict) -> None:
+        run = self.run
+        tstate = run.per_ttl.get(ttl)
+        if self.cancelled(ttl) or (tstate is not None and tstate.closed):
+            # past the destination, or the hop was settled by an earlier reply
+            self.drop(ttl, flow_id)
+            return
+        self._release(ttl)
+        tstate = run.per_ttl[ttl]
+        wait = self._sent_wait(ttl, flow_id)
+        if wait is not None:
+            run.wait_s = wait  # what _record charges this probe's timeout against
+
+        if self.ctrl._record(run, self.dest, ttl, ev):
+            if self.dest_ttl is None or ttl < self.dest_ttl:
+                # the destination is closer than an earlier reply said: the copies
+                # of it recorded at higher TTLs are not real hops
+                for k, t in run.per_ttl.items():
+                    if k > ttl and t.final == self.dest:
+                        t.final = None
+                        t.confident = False
+                self.dest_ttl = ttl
+            tstate.closed = True
+            return
+
+        base_cap, dyn_cap = tstate.base_cap, tstate.dyn_cap
+        self.ctrl._decide(tstate, dyn_cap)
+        if tstate.final is not None or tstate.attempts >= dyn_cap:
+            self.ctrl._close_hop(run, ttl, tstate, base_cap)
+
+    def finish(self) -> None:
+        """Settle the finished trace with the shared state (batch pool, RTT priors); result() calls it."""
+        self.ctrl._finish(self.dest, self.run)
+
+    def result(self) -> dict:
+        self.finish()
+        res = self.ctrl._result(self.dest, self.run)
+        res["window"] = {"size": self.window, "wasted": self.wasted, "refunded": self.refunded}
+        return res
@@ -16,5 +16,84 @@ class Settings:
     hard_per_hop_max: int = 6         # hard ceiling for attempts even with rollover
     rollover_pool_max: int = 10       # don’t hoard infinite credits
 
-    # (optional) adaptive wait toggle for later prober tuning
+    # batched mode: how many undecided TTLs to plan into one probe_batch call
+    batch_ttls: int = 4
+
+    # cross-target hop cache for the shared near side of the path
+    hop_cache: bool = False
+    hop_cache_max_ttl: int = 6        # only seed hops up to this TTL
+    hop_cache_ttl_s: float = 600.0    # entry lifetime
+    hop_cache_size: int = 4096
+    hop_cache_confirm: bool = True    # spend 1 probe to confirm a cached hop (False: trust it)
+    vantage: str = "local"            # cache key: which vantage point these traces start from
+
+    # probing strategy: "forward" walks up from TTL 1; "doubletree" starts mid-path,
+    # goes forward, then backward until it meets the shared stop set; "multipath"
+    # enumerates every ECMP interface per hop (MDA-lite, app/brain/multipath.py)
+    strategy: str = "forward"
+    doubletree_start_ttl: int = 8     # start TTL until a mean path length is known
+    doubletree_prefix_len: int = 24   # stop-set key is (interface, dest /prefix); 0 = interface only
+    mda_alpha: float = 0.05           # multipath: a hop's interface set is complete w.p. 1 - mda_alpha
+    mda_hop_budget: int = 16          # multipath: probes per hop at most (total_budget still applies)
+
+    # result per_ttl: "full" lists every TTL 1..max_ttl, "sparse" only probed ones
+    result_format: str = "full"
+
+    # which scamper payloads probers keep in ProbeEvent["raw"]:
+    # "none" | "errors" | "sampled" | "full"; results only carry them when debug is set
+    raw_retention: str = "errors"
+    raw_sample_rate: float = 0.01
+    debug: bool = False
+
+    # pacing (app/prober/pacing.py), the only place probes are delayed: one probe
+    # per pace_ms to each destination, and at most `pps` for the whole process
+    pps: float = 0.0                  # 0 = no process-wide limit
+    pace_burst: int = 1               # probes a bucket lets through back to back
+    pace_jitter_ms: float = 10.0      # up to this much extra on throttled sends
+
+    # speculative window: keep probes outstanding for this many undecided TTLs at once
+    # (BudgetController.run_windowed, AsyncBatchRunner); 1 = strictly hop by hop
+    window_ttls: int = 1
+
+    # stop after this many consecutive dark (∅) hops ("gap_limit"); 0 = walk on to max_ttl
+    gap_limit: int = 0
+    # one probe at max_ttl before the trace: if the destination answers, the IP-TTL of
+    # its reply estimates its distance and max_ttl is trimmed to that + distance_slack
+    distance_probe: bool = False
+    distance_slack: int = 2
+
+    # batch-wide budget (app/batch/budget.py): one pool of batch_budget probes for a whole
+    # run instead of total_budget per trace; 0 = off. Traces start with batch_grant
+    # (0 = a fair share of the pool, at most total_budget), return what they don't spend
+    # and may top up by batch_topup (0 = per_hop_budget); non-urgent top-ups leave
+    # batch_reserve of the pool alone. A trace the pool can't grant batch_grant_floor
+    # (0 = per_hop_budget) is not started and ends as "budget_exhausted"
+    batch_budget: int = 0
+    batch_grant: int = 0
+    batch_grant_floor: int = 0
+    batch_topup: int = 0
+    batch_reserve: float = 0.1
+
+    # re-trace against an earlier result (app/brain/retrace.py): the fraction of the
+    # prior's hops that get a verification probe; the rest are taken on trust
+    retrace_sample: float = 1.0
+
+    # ICMP rate-limit detection (app/brain/ratelimit.py): routers whose probes are lost
+    # right after a reply but answered after a pause get their probes spaced out, and
+    # those early timeouts don't make a hop dark
+    ratelimit: bool = False
+    ratelimit_gap_s: float = 1.0      # "right after a reply"; also the longest spacing used
+    ratelimit_min_samples: int = 3    # early probes needed before a router is judged
+
+    # phase timers / counters in app/logging.py (process-wide METRICS registry)
+    metrics: bool = False
+
+    # adaptive wait: per-probe reply timeout from the trace's smoothed RTT
+    # (app/brain/rtt.py), passed to scamper as trace -w; off = scamper's fixed wait
     adaptive_wait: bool = False
+    probe_wait_s: float = 5.0         # the fixed wait (scamper's default), for savings accounting
+    wait_min_s: float = 1.0
+    wait_max_s: float = 5.0
+    wait_rttvar_k: float = 4.0        # timeout = srtt + k * rttvar (at least 2x the largest RTT)
+    wait_step_s: float = 1.0          # scamper's trace -w takes whole seconds
+    wait_prefix_len: int = 24         # reuse estimates across traces per dest prefix; 0 = off
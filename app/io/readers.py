@@ -0,0 +1,170 @@
+# app/io/readers.py
+import csv
+import gzip
+import hashlib
+import io
+import ipaddress
+import json
+import math
+import random
+import sys
+from typing import Iterator, Optional
+
+
+def open_text(path: str):
+    """Open a target file for streaming text reads; gzip is detected by magic bytes. '-' = stdin."""
+    if path == "-":
+        return sys.stdin
+    fh = open(path, "rb")
+    magic = fh.peek(2)[:2] if hasattr(fh, "peek") else b""
+    if magic == b"\x1f\x8b":
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=fh), encoding="utf-8")
+    return io.TextIOWrapper(fh, encoding="utf-8")
+
+
+def _detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "plain"
+
+
+def iter_entries(path: str, fmt: Optional[str] = None, column: str = "target") -> Iterator[str]:
+    """
+    Yield raw target entries (IP, hostname or CIDR) one at a time.
+    plain: one per line, '#' comments. csv: `column` if there is a header with it,
+    else the first column. jsonl: `column`/"dst"/"ip" key, or a bare JSON string.
+    """
+    fmt = fmt or _detect_format(path)
+    fh = open_text(path)
+    try:
+        if fmt == "csv":
+            rows = csv.reader(fh)
+            idx = 0
+            for n, row in enumerate(rows):
+                if not row:
+                    continue
+                if n == 0 and column in row:
+                    idx = row.index(column)
+                    continue
+                val = row[idx].strip() if idx < len(row) else ""
+                if val and not val.startswith("#"):
+                    yield val
+        elif fmt == "jsonl":
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                obj = json.loads(line)
+                if isinstance(obj, str):
+                    yield obj
+                elif isinstance(obj, dict):
+                    val = obj.get(column) or obj.get("dst") or obj.get("ip")
+                    if val:
+                        yield str(val)
+        else:
+            for line in fh:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    yield line
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def permute_range(n: int, seed: int = 0) -> Iterator[int]:
+    """
+    Every integer in [0, n) exactly once, in a seeded pseudo-random order, in O(1)
+    memory: a full-period LCG over the next power of two (a % 4 == 1, c odd),
+    skipping values >= n.
+    """
+    if n <= 0:
+        return
+    m = 1 << max(2, (n - 1).bit_length())
+    rng = random.Random(seed)
+    a = (rng.randrange(m) & ~3) | 1   # a ≡ 1 (mod 4)
+    c = rng.randrange(m) | 1          # c odd
+    x = rng.randrange(m)
+    for _ in range(m):
+        x = (a * x + c) % m
+        if x < n:
+            yield x
+
+
+def expand_cidr(entry: str, per_prefix: int = 24, host_offset: int = 1,
+                shuffle: bool = False, seed: int = 0) -> Iterator[str]:
+    """
+    Lazily expand a CIDR into one address per /per_prefix sub-block (host_offset
+    into each block, e.g. x.y.z.1 for /24s). Plain addresses and hostnames pass
+    through unchanged. per_prefix >= the address width yields every address.
+    """
+    if "/" not in entry:
+        yield entry
+        return
+    net = ipaddress.ip_network(entry, strict=False)
+    width = net.max_prefixlen
+    step_len = max(net.prefixlen, min(per_prefix, width))
+    blocks = 1 << (step_len - net.prefixlen)
+    block_size = 1 << (width - step_len)
+    offset = host_offset if block_size > host_offset else 0
+    base = int(net.network_address)
+    order = permute_range(blocks, seed) if shuffle else range(blocks)
+    for i in order:
+        yield str(ipaddress.ip_address(base + i * block_size + offset))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter (bytearray bits, double hashing over blake2b)."""
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 1e-4):
+        self.nbits = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        d = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, item: str) -> bool:
+        """Insert `item`; returns False if it was (probably) already present."""
+        new = False
+        for pos in self._positions(item):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[p // 8] & (1 << (p % 8)) for p in self._positions(item))
+
+
+def iter_targets(path: str,
+                 fmt: Optional[str] = None,
+                 column: str = "target",
+                 per_prefix: int = 24,
+                 shuffle: bool = False,
+                 seed: int = 0,
+                 dedup: bool = True,
+                 dedup_capacity: int = 1_000_000,
+                 dedup_error_rate: float = 1e-4) -> Iterator[str]:
+    """
+    Stream destinations from a plain / CSV / JSONL (optionally gzip) file, expanding
+    CIDRs lazily and dropping repeats with a Bloom filter. Nothing is read ahead:
+    the batch runners pull one target at a time, which is the backpressure.
+    A Bloom false positive (rate ~dedup_error_rate) skips a fresh target.
+    """
+    seen = BloomFilter(dedup_capacity, dedup_error_rate) if dedup else None
+    for n, entry in enumerate(iter_entries(path, fmt=fmt, column=column)):
+        for dest in expand_cidr(entry, per_prefix=per_prefix, shuffle=shuffle, seed=seed + n):
+            if seen is not None and not seen.add(dest):
+                continue
+            yield dest
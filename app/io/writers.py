@@ -0,0 +1,342 @@
+# app/io/writers.py
+import bz2
+import glob
+import gzip
+import json
+import lzma
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Iterator, Optional
+
+_COMPRESSORS = {
+    None: ("", None),
+    "gzip": (".gz", lambda f: gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)),
+    "bz2": (".bz2", lambda f: bz2.BZ2File(f, mode="wb")),
+    "xz": (".xz", lambda f: lzma.LZMAFile(f, mode="wb", preset=1)),
+}
+
+try:  # Python 3.14+: zstd in the stdlib
+    from compression import zstd as _zstd  # type: ignore[import-not-found]
+    _COMPRESSORS["zstd"] = (".zst", lambda f: _zstd.ZstdFile(f, mode="wb"))
+except ImportError:
+    pass
+
+_OPENERS = {
+    "bz2": lambda name: bz2.open(name, "rt", encoding="utf-8"),
+    "xz": lambda name: lzma.open(name, "rt", encoding="utf-8"),
+}
+if "zstd" in _COMPRESSORS:
+    _OPENERS["zstd"] = lambda name: _zstd.open(name, "rt", encoding="utf-8")
+
+_STOP = object()
+
+
+class _Mark:
+    """Queued by JsonlWriter.mark(): the writer thread answers with the position reached."""
+
+    __slots__ = ("done", "value")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[dict] = None
+
+
+def dumps_compact(res: dict) -> bytes:
+    """One result dict -> one JSONL line (no indent, no spaces, UTF-8 so '∅' stays short)."""
+    return json.dumps(res, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+
+
+def _trim_torn_tail(name: str) -> None:
+    """Cut a half-written last line (a crash mid-write) so appended records start on a line of their own."""
+    if not os.path.exists(name):
+        return
+    with open(name, "r+b") as fh:
+        end = fh.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(pos, 1 << 16)
+            fh.seek(pos - step)
+            chunk = fh.read(step)
+            nl = chunk.rfind(b"\n")
+            if nl >= 0:
+                pos = pos - step + nl + 1
+                break
+            pos -= step
+        if pos < end:
+            fh.truncate(pos)
+
+
+def written_files(path: str, compress: Optional[str] = None) -> list[str]:
+    """The files a JsonlWriter for `path` has written so far: the file itself, or its rotated parts in order."""
+    suffix = _COMPRESSORS[compress][0]
+    if path == "-":
+        return []
+    parts = sorted(glob.glob(f"{glob.escape(path)}.[0-9][0-9][0-9][0-9][0-9]{suffix}"))
+    single = f"{path}{suffix}"
+    return parts + ([single] if os.path.exists(single) else [])
+
+
+def rewind_written(path: str, compress: Optional[str], mark: dict) -> None:
+    """
+    Cut a JsonlWriter's output for `path` back to `mark` (from JsonlWriter.mark()):
+    the marked file is truncated there and rotated files after it are removed.
+    """
+    names = written_files(path, compress)
+    if mark["file"] not in names:
+        raise ValueError(f"output {mark['file']} is missing; cannot rewind {path} to it")
+    for name in names[names.index(mark["file"]) + 1:]:
+        os.remove(name)
+    with open(mark["file"], "r+b") as fh:
+        fh.truncate(mark["size"])
+
+
+def iter_written(path: str, compress: Optional[str] = None) -> Iterator[dict]:
+    """
+    Results already in a JsonlWriter's output for `path`. A file is read up to
+    any damage a crash left (a torn last line, a truncated compressed stream).
+    """
+    from app.io.readers import open_text
+    from app.prober.parse import loads
+    for name in written_files(path, compress):
+        fh = open_text(name) if compress in (None, "gzip") else _OPENERS[compress](name)
+        try:
+            for line in fh:
+                if not line.endswith("\n"):
+                    break
+                yield loads(line)
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            fh.close()
+
+
+class JsonlWriter:
+    """
+    Streaming writer for controller result dicts: compact JSONL, large write
+    buffer, optional stdlib compression, size/time based rotation, and (by default)
+    a background thread so the probing loop only pays for a queue put.
+
+    With rotation, files are named <path>.00000[.gz], <path>.00001[.gz], ...
+    path "-" writes to stdout (no rotation, no compression).
+    append=True keeps what is already there (a resumed run): the file is opened
+    for append, and with rotation numbering continues after the existing files.
+    """
+
+    def __init__(self,
+                 path: str,
+                 buffer_bytes: int = 1 << 20,
+                 rotate_bytes: Optional[int] = None,
+                 rotate_s: Optional[float] = None,
+                 compress: Optional[str] = None,
+                 background: bool = True,
+                 queue_size: int = 10000,
+                 flush_s: float = 1.0,
+                 append: bool = False):
+        if compress not in _COMPRESSORS:
+            raise ValueError(f"unsupported compression {compress!r}; have {sorted(k for k in _COMPRESSORS if k)}")
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self.rotate_bytes = rotate_bytes
+        self.rotate_s = rotate_s
+        self.compress = compress
+        self.append = append
+        self.flush_s = flush_s
+        self.put_timeout_s = 0.1  # how often a write waiting on a full queue checks the thread
+        self.full_waits = 0       # such waits: the disk is not keeping up
+
+        self._buf = bytearray()
+        self._raw = None
+        self._fh = None
+        self._file_bytes = 0
+        self._file_opened_at = 0.0
+        self._seq = 0
+        self.files: list[str] = []
+        self.records = 0
+        self.bytes_written = 0  # uncompressed
+        self._error: Optional[BaseException] = None
+
+        self._open_next()
+
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        if background:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._drain, name="jsonl-writer", daemon=True)
+            self._thread.start()
+
+    # -------------------------------
+    # file handling
+    # -------------------------------
+    def _rotating(self) -> bool:
+        return self.path != "-" and bool(self.rotate_bytes or self.rotate_s)
+
+    def _open_next(self) -> None:
+        if self.path == "-":
+            self._raw = None
+            self._fh = sys.stdout.buffer
+            return
+        suffix, wrap = _COMPRESSORS[self.compress]
+        if self._rotating():
+            name = f"{self.path}.{self._seq:05d}{suffix}"
+            while self.append and os.path.exists(name):
+                self._seq += 1
+                name = f"{self.path}.{self._seq:05d}{suffix}"
+        else:
+            name = f"{self.path}{suffix}"
+        self._seq += 1
+        parent = os.path.dirname(name)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        if self.append and wrap is None:
+            _trim_torn_tail(name)
+        # compressed streams append as a new member, which the stdlib readers concatenate
+        self._raw = open(name, "ab" if self.append else "wb", buffering=self.buffer_bytes)
+        self._fh = wrap(self._raw) if wrap else self._raw
+        self._file_bytes = 0
+        self._file_opened_at = time.monotonic()
+        self.files.append(name)
+
+    def _close_current(self) -> None:
+        if self._raw is None:
+            self._fh.flush()
+            return
+        if self._fh is not self._raw:
+            self._fh.close()  # finishes the compressed stream, leaves _raw open
+        self._raw.close()
+
+    def _flush_buf(self) -> None:
+        if self._buf:
+            self._fh.write(self._buf)
+            self._file_bytes += len(self._buf)
+            self._buf.clear()
+
+    def _maybe_rotate(self) -> None:
+        if not self._rotating():
+            return
+        too_big = self.rotate_bytes and self._file_bytes + len(self._buf) >= self.rotate_bytes
+        too_old = self.rotate_s and time.monotonic() - self._file_opened_at >= self.rotate_s
+        if too_big or too_old:
+            self._flush_buf()
+            self._close_current()
+            self._open_next()
+
+    def _sync_point(self) -> Optional[dict]:
+        """Get everything written so far onto disk and return where it ends (None for stdout)."""
+        self._flush_buf()
+        if self._raw is None:
+            self._fh.flush()
+            return None
+        if self._fh is not self._raw:
+            self._fh.close()  # end the compressed stream, so cutting the file here leaves it whole
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        mark = {"file": self.files[-1], "size": self._raw.tell()}
+        if self._fh is not self._raw:
+            self._fh = _COMPRESSORS[self.compress][1](self._raw)  # the next stream starts past the mark
+        return mark
+
+    def _write_now(self, res: dict) -> None:
+        line = dumps_compact(res)
+        self._buf += line
+        self.records += 1
+        self.bytes_written += len(line)
+        if len(self._buf) >= self.buffer_bytes:
+            self._flush_buf()
+        self._maybe_rotate()
+
+    # -------------------------------
+    # background thread
+    # -------------------------------
+    def _drain(self) -> None:
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_s)
+                except queue.Empty:
+                    # idle: push what we have so readers see progress
+                    self._flush_buf()
+                    self._fh.flush()
+                    self._maybe_rotate()
+                    continue
+                if item is _STOP:
+                    return
+                if isinstance(item, _Mark):
+                    item.value = self._sync_point()
+                    item.done.set()
+                    continue
+                self._write_now(item)
+        except BaseException as e:  # surfaced by write()/close()
+            self._error = e
+
+    # -------------------------------
+    # public API
+    # -------------------------------
+    def _put(self, item) -> None:
+        """Queue `item` for the thread, waiting while the queue is full but never on a dead thread."""
+        while True:
+            if self._error is not None:
+                raise RuntimeError("JSONL writer thread failed") from self._error
+            if self._thread is None or not self._thread.is_alive():
+                raise RuntimeError("JSONL writer thread is not running")
+            try:
+                self._queue.put(item, timeout=self.put_timeout_s)
+                return
+            except queue.Full:
+                self.full_waits += 1
+
+    def write(self, res: dict) -> None:
+        """
+        Queue one result (with background=True). Blocks while the queue is full,
+        so from an event loop call it through run_in_executor, as AsyncBatchRunner does.
+        """
+        if self._error is not None:
+            raise RuntimeError("JSONL writer thread failed") from self._error
+        if self._queue is not None:
+            self._put(res)
+        else:
+            self._write_now(res)
+
+    def mark(self) -> Optional[dict]:
+        """
+        Flush and fsync every result written so far and return the position it ends
+        at ({"file", "size"}, None for stdout); rewind_written() cuts back to it.
+        app.batch.journal.Journal keeps one with each checkpoint.
+        """
+        if self._queue is None:
+            return self._sync_point()
+        m = _Mark()
+        self._put(m)
+        while not m.done.wait(self.put_timeout_s):
+            if self._error is not None:
+                raise RuntimeError("JSONL writer thread failed") from self._error
+            if not self._thread.is_alive():
+                raise RuntimeError("JSONL writer thread is not running")
+        return m.value
+
+    def close(self) -> None:
+        if self._thread is not None:
+            try:
+                self._put(_STOP)
+                self._thread.join()
+            except RuntimeError:
+                pass  # the thread died: its error is raised below
+            self._thread = None
+        if self._fh is not None:
+            self._flush_buf()
+            self._close_current()
+            self._fh = None
+        if self._error is not None:
+            raise RuntimeError("JSONL writer thread failed") from self._error
+
+    def stats(self) -> dict:
+        return {"records": self.records, "bytes": self.bytes_written, "files": list(self.files),
+                "full_waits": self.full_waits}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,157 @@
+# app/logging.py
+"""
+Hot-path instrumentation: phase timers (monotonic clock) kept as histograms, plus
+event counters, exported as Prometheus text or periodic JSONL snapshots.
+
+There is one process-wide registry, METRICS. It starts disabled; call sites guard
+on its `enabled` flag, so a disabled registry costs one attribute check per
+phase (tools/bench_metrics.py measures it):
+
+    M = METRICS
+    t0 = perf_counter() if M.enabled else 0.0
+    ...
+    if M.enabled:
+        M.observe("parse", perf_counter() - t0)
+
+Phases: scamper_run (spawn + wait of one scamper process), scamper_wait (a
+control-socket command), parse, pace_wait (pacing sleeps), ctl_next / ctl_feed
+(controller decisions) and probe (the prober call as the controller sees it).
+Counters: probes, timeouts, dest_reached, pool_deposits, pool_withdrawals.
+"""
+import bisect
+import json
+import threading
+import time
+from time import perf_counter
+from typing import Optional, TextIO
+
+__all__ = ["METRICS", "Histogram", "Metrics", "JsonlSnapshots", "perf_counter"]
+
+# histogram upper bounds in seconds: 1us .. 10s, four per decade
+BUCKETS = tuple(round(m * 10.0 ** e, 9) for e in range(-6, 1) for m in (1.0, 1.8, 3.2, 5.6)) + (10.0,)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot: above the largest bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None when empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, prefix: str = "traceroute"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = Histogram()
+            h.observe(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "ts": time.time(),
+                "counters": dict(self.counters),
+                "phases": {
+                    name: {
+                        "count": h.count,
+                        "sum_s": round(h.sum, 6),
+                        "p50_s": h.quantile(0.5),
+                        "p99_s": h.quantile(0.99),
+                    }
+                    for name, h in self.histograms.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        p = self.prefix
+        lines = []
+        with self._lock:
+            for name, n in sorted(self.counters.items()):
+                lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {n}"]
+            if self.histograms:
+                lines.append(f"# TYPE {p}_phase_seconds histogram")
+            for name, h in sorted(self.histograms.items()):
+                cum = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cum += n
+                    lines.append(f'{p}_phase_seconds_bucket{{phase="{name}",le="{bound:g}"}} {cum}')
+                lines.append(f'{p}_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{p}_phase_seconds_sum{{phase="{name}"}} {h.sum:.9f}')
+                lines.append(f'{p}_phase_seconds_count{{phase="{name}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, fh: TextIO) -> None:
+        fh.write(json.dumps(self.snapshot(), separators=(",", ":")) + "\n")
+        fh.flush()
+
+
+# the process-wide registry every instrumented module reports to
+METRICS = Metrics()
+
+
+class JsonlSnapshots:
+    """Append a METRICS snapshot to `path` every `interval_s` (and once more on stop)."""
+
+    def __init__(self, path: str, interval_s: float = 10.0, metrics: Metrics = METRICS):
+        self.metrics = metrics
+        self.interval_s = interval_s
+        self._fh = open(path, "a", encoding="utf-8")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="metrics-jsonl", daemon=True)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            self.metrics.write_jsonl(self._fh)
+
+    def start(self) -> "JsonlSnapshots":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.metrics.write_jsonl(self._fh)
+        self._fh.close()
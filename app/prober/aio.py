@@ -0,0 +1,126 @@
+# app/prober/aio.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from app.logging import METRICS, perf_counter
+from app.prober.base import AsyncProber, Prober, ProbeEvent
+from app.prober.parse import first_trace, has_trace_record
+from app.prober.scamper import (
+    DEFAULT_SCAMPER_BIN,
+    ScamperProber,
+    batch_events,
+    batch_runs,
+    parse_scamper_json_v01,
+)
+
+
+class ExecutorProber(AsyncProber):
+    """
+    Run a blocking Prober in a thread pool so asyncio code can await it.
+    Pairs well with ScamperCtlProber, whose probe_once is thread-safe and only
+    blocks on its reply; FakeProber works too for tests.
+    """
+
+    def __init__(self, prober: Prober, max_workers: int = 64):
+        self.prober = prober
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="probe")
+
+    async def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                         wait_s: Optional[float] = None) -> ProbeEvent:
+        loop = asyncio.get_running_loop()
+        kw = {"wait_s": wait_s} if wait_s is not None else {}
+        call = functools.partial(self.prober.probe_once, dest, ttl, flow_id, **kw)
+        return await loop.run_in_executor(self._pool, call)
+
+    async def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                          wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        loop = asyncio.get_running_loop()
+        kw = {"wait_s": wait_s} if wait_s is not None else {}
+        call = functools.partial(self.prober.probe_batch, dest, requests, **kw)
+        return await loop.run_in_executor(self._pool, call)
+
+    async def close(self) -> None:
+        # let probes already running finish (off the loop) before the prober goes away
+        await asyncio.to_thread(functools.partial(self._pool.shutdown, wait=True, cancel_futures=True))
+        self.prober.close()
+
+
+class AsyncScamperProber(AsyncProber):
+    """
+    Same command lines and parsing as ScamperProber, but the scamper process is
+    spawned with asyncio so hundreds can be waiting on the network concurrently.
+    """
+
+    def __init__(self,
+                 scamper_bin: str = DEFAULT_SCAMPER_BIN,
+                 method: str = "udp-paris",
+                 use_sudo: bool = True,
+                 raw_retention: str = "errors",
+                 raw_sample_rate: float = 0.01):
+        # reuse the sync prober for command building (and its binary check)
+        self._cmd = ScamperProber(scamper_bin=scamper_bin, method=method, use_sudo=use_sudo,
+                                  raw_retention=raw_retention, raw_sample_rate=raw_sample_rate)
+        self.method = method
+        self.use_sudo = use_sudo
+        self.raw_policy = self._cmd.raw_policy
+
+    async def _run_cmd(self, cmd: str) -> bytes:
+        t0 = perf_counter() if METRICS.enabled else 0.0
+        proc = await asyncio.create_subprocess_shell(
+            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        out, _ = await proc.communicate()
+        if METRICS.enabled:
+            METRICS.observe("scamper_run", perf_counter() - t0)
+        return out
+
+    async def _run_tries(self, dest: str, ttl: int, attempts: int = 1, last_ttl: Optional[int] = None,
+                         wait_s: Optional[float] = None, flow_id: int = 0) -> tuple[Optional[bytes], bytes]:
+        """Try without sudo, then with sudo -n. Returns (output with a trace record or None, last output)."""
+        tries = [False, True] if self.use_sudo else [False]
+        out = b""
+        for use_sudo in tries:
+            cmd = self._cmd._build_cmd(dest, ttl, attempts=attempts, use_sudo=use_sudo, last_ttl=last_ttl,
+                                       wait_s=wait_s, flow_id=flow_id)
+            try:
+                out = await self._run_cmd(cmd)
+            except Exception as e:
+                out = f"exception: {e}".encode()
+            if has_trace_record(out):
+                return out, out
+        return None, out
+
+    async def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                         wait_s: Optional[float] = None) -> ProbeEvent:
+        out, last_out = await self._run_tries(dest, ttl, wait_s=wait_s, flow_id=flow_id)
+        if out is None:
+            return {
+                "target": dest, "ttl": ttl, "flow_id": flow_id, "protocol": self.method,
+                "status": "timeout", "hop_ip": None, "rtt_ms": None,
+                "timestamp": datetime.utcnow().isoformat(), "raw": self.raw_policy.error(None, last_out),
+            }
+        ev = parse_scamper_json_v01(out, ttl, self.method, self.raw_policy)
+        ev["target"] = ev.get("target") or dest
+        ev["flow_id"] = flow_id
+        return ev
+
+    async def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                          wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        """One scamper process per batch_runs() command, all running at once."""
+        runs = batch_runs(requests)
+        outs = await asyncio.gather(*(
+            self._run_tries(dest, first, attempts=attempts, last_ttl=last, wait_s=wait_s, flow_id=flow_id)
+            for first, last, attempts, flow_id, _members in runs))
+        events: list = [None] * len(requests)
+        for (_first, _last, _attempts, _flow, members), (out, last_out) in zip(runs, outs):
+            obj, line = first_trace(out or b"")
+            raw = self.raw_policy.error(None, last_out) if out is None else None
+            for i, ev in zip(members, batch_events(obj, line, [requests[i] for i in members],
+                                                   self.method, self.raw_policy)):
+                ev["target"] = ev.get("target") or dest
+                if raw is not None:
+                    ev["raw"] = raw
+                events[i] = ev
+        return events
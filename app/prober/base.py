@@ -10,11 +10,49 @@ class ProbeEvent(TypedDict, total=False):
     status: str                 # "ttl_exceeded" | "dest_reached" | "timeout" | "unreach"
     hop_ip: Optional[str]
     rtt_ms: Optional[float]
+    reply_ttl: Optional[int]    # IP-TTL of the reply packet, when the backend reports it
+    sent: bool                  # False: planned in a probe_batch but never sent (absent = sent)
     timestamp: str
-    raw: dict
+    raw: dict                   # or app.prober.raw.RawPayload, see Settings.raw_retention
 
 class Prober(ABC):
+    """
+    `wait_s` (only passed with Settings.adaptive_wait) is how long to wait for a
+    reply before calling the probe a timeout; None = the backend's fixed wait.
+    """
+
     @abstractmethod
-    def probe_once(self, dest: str, ttl: int, flow_id: int = 0) -> ProbeEvent:
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                   wait_s: Optional[float] = None) -> ProbeEvent:
         """Send exactly one probe for dest@ttl and return a ProbeEvent dict."""
         raise NotImplementedError
+
+    def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                    wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        """
+        Send one probe per (ttl, flow_id) in `requests` and return the events in the
+        same order. Backends that can cover a TTL range in one go should override this.
+        """
+        kw = {"wait_s": wait_s} if wait_s is not None else {}
+        return [self.probe_once(dest, ttl, flow_id=flow_id, **kw) for ttl, flow_id in requests]
+
+    def close(self) -> None:
+        """Release any long-lived resources (processes, sockets). No-op by default."""
+        return None
+
+
+class AsyncProber(ABC):
+    """asyncio twin of Prober, for runners that keep many traces in flight."""
+
+    @abstractmethod
+    async def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                         wait_s: Optional[float] = None) -> ProbeEvent:
+        raise NotImplementedError
+
+    async def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                          wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        kw = {"wait_s": wait_s} if wait_s is not None else {}
+        return [await self.probe_once(dest, ttl, flow_id=flow_id, **kw) for ttl, flow_id in requests]
+
+    async def close(self) -> None:
+        return None
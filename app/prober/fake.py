@@ -13,7 +13,7 @@ class FakeProber(Prober):
             for k, v in script.items():
                 self.script[k] = deque(v)
 
-    def probe_once(self, dest: str, ttl: int, flow_id: int = 0) -> ProbeEvent:
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0, wait_s=None) -> ProbeEvent:
         key = (ttl, flow_id)
         dq = self.script.get(key)
         if dq and len(dq) > 0:
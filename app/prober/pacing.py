@@ -0,0 +1,168 @@
+# app/prober/pacing.py
+"""
+Probe pacing: one token bucket for the whole process and one per destination.
+
+Drivers (BudgetController.run / run_batched, AsyncBatchRunner) ask the Pacer for a
+send slot before every probe and sleep until it; probers themselves never sleep.
+A reservation is made under a lock and returns the delay, so the same Pacer can be
+shared by threads and asyncio tasks: `wait()` sleeps, `wait_async()` awaits.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from app.logging import METRICS
+
+
+class TokenBucket:
+    """
+    `rate` tokens/s, at most `burst` of them saved up (kept as a GCRA theoretical
+    arrival time, so no refill bookkeeping). Asking for more than `burst` at once
+    is allowed once the bucket is full; the excess is paid back by later callers.
+    """
+
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.tat = float("-inf")
+
+    def ready_at(self, now: float, n: int = 1) -> float:
+        return max(now, self.tat + min(0.0, (n - 1) * self.interval - self.tolerance))
+
+    def take(self, at: float, n: int = 1) -> None:
+        self.tat = max(self.tat, at) + n * self.interval
+
+
+class Pacer:
+    """
+    Hands out send times that respect both the process-wide `pps` limit and the
+    `per_dest_pps` limit of the destination (either may be None = unlimited).
+    A probe that has to wait gets up to `jitter_s` extra, so targets held back by
+    the same bucket don't all fire on the same tick.
+    """
+
+    def __init__(self,
+                 pps: Optional[float] = None,
+                 per_dest_pps: Optional[float] = None,
+                 burst: int = 1,
+                 jitter_s: float = 0.0,
+                 max_dests: int = 65536,
+                 clock: Callable[[], float] = time.monotonic,
+                 seed: Optional[int] = None):
+        self.glob = TokenBucket(pps, burst) if pps else None
+        self.per_dest_pps = per_dest_pps or None
+        self.burst = burst
+        self.jitter_s = jitter_s
+        self.max_dests = max_dests
+        self.clock = clock
+        self._rng = random.Random(seed)
+        self._dests: "OrderedDict[str, TokenBucket]" = OrderedDict()  # LRU
+        self._lock = threading.Lock()
+
+        self.probes = 0
+        self.wait_s = 0.0
+        self.throttled = 0          # reservations that had to wait
+        self.throttled_global = 0   # ... because of the process-wide bucket
+        self.throttled_dest = 0     # ... because of the destination's bucket
+        self._first: Optional[float] = None
+        self._last = 0.0
+
+    @classmethod
+    def from_settings(cls, settings, pps: Optional[float] = None, **kw) -> "Pacer":
+        """Per destination one probe every Settings.pace_ms; `pps` overrides Settings.pps."""
+        pace_ms = getattr(settings, "pace_ms", 0)
+        return cls(
+            pps=pps if pps is not None else (getattr(settings, "pps", 0) or None),
+            per_dest_pps=(1000.0 / pace_ms) if pace_ms > 0 else None,
+            burst=getattr(settings, "pace_burst", 1),
+            jitter_s=getattr(settings, "pace_jitter_ms", 0) / 1000.0,
+            **kw,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.glob is not None or self.per_dest_pps is not None
+
+    def _dest_bucket(self, dest: str) -> TokenBucket:
+        bucket = self._dests.get(dest)
+        if bucket is None:
+            bucket = self._dests[dest] = TokenBucket(self.per_dest_pps, self.burst)
+            if len(self._dests) > self.max_dests:
+                self._dests.popitem(last=False)
+        else:
+            self._dests.move_to_end(dest)
+        return bucket
+
+    def reserve(self, dest: Optional[str] = None, n: int = 1) -> float:
+        """Claim the next slot for `n` probes to `dest`; returns how long to wait for it."""
+        with self._lock:
+            now = self.clock()
+            if self._first is None:
+                self._first = now
+            self.probes += n
+            if not self.enabled:
+                self._last = now
+                return 0.0
+
+            at = now
+            if self.glob is not None:
+                at = self.glob.ready_at(now, n)
+            dbucket = self._dest_bucket(dest) if (self.per_dest_pps and dest is not None) else None
+            if dbucket is not None:
+                at_dest = dbucket.ready_at(now, n)
+                if at_dest > at:
+                    at = at_dest
+                    self.throttled_dest += 1
+                elif at > now:
+                    self.throttled_global += 1
+            elif at > now:
+                self.throttled_global += 1
+
+            if at > now:
+                self.throttled += 1
+                if self.jitter_s:
+                    at += self._rng.uniform(0.0, self.jitter_s)
+            if self.glob is not None:
+                self.glob.take(at, n)
+            if dbucket is not None:
+                dbucket.take(at, n)
+
+            delay = at - now
+            self.wait_s += delay
+            self._last = max(self._last, at)
+            return delay
+
+    def wait(self, dest: Optional[str] = None, n: int = 1) -> float:
+        """Blocking callers: sleep until the slot. Returns the time waited."""
+        delay = self.reserve(dest, n)
+        if delay > 0:
+            time.sleep(delay)
+            if METRICS.enabled:
+                METRICS.observe("pace_wait", delay)
+        return delay
+
+    async def wait_async(self, dest: Optional[str] = None, n: int = 1) -> float:
+        """asyncio callers: same as wait() without blocking the loop."""
+        delay = self.reserve(dest, n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+            if METRICS.enabled:
+                METRICS.observe("pace_wait", delay)
+        return delay
+
+    def stats(self) -> dict:
+        span = (self._last - self._first) if self._first is not None else 0.0
+        return {
+            "probes": self.probes,
+            # probes sent after the first one, over the time they were spread across
+            "rate_pps": round((self.probes - 1) / span, 3) if span > 0 else None,
+            "wait_s": round(self.wait_s, 6),
+            "throttled": self.throttled,
+            "throttled_global": self.throttled_global,
+            "throttled_dest": self.throttled_dest,
+        }
@@ -0,0 +1,157 @@
+# app/prober/parse.py
+"""
+Shared scamper `-O json` parsing for the single-probe, batch and full-trace paths.
+
+Output is handled as bytes, line by line, and only lines that can be a trace record
+(they contain b'"trace"', whatever the spacing around "type":) are decoded, so
+cycle-start / cycle-stop records and noise never hit the JSON decoder. orjson is
+used when installed.
+"""
+import json
+from datetime import datetime
+from typing import IO, Iterable, Iterator, Optional, Union
+
+from app.prober.base import ProbeEvent
+from app.prober.raw import RawPolicy
+
+try:
+    import orjson
+
+    def loads(data: Union[bytes, str]):
+        return orjson.loads(data)
+
+    JSON_ERRORS: tuple = (orjson.JSONDecodeError, ValueError)
+    DECODER = "orjson"
+except ImportError:  # stdlib fallback
+    def loads(data: Union[bytes, str]):
+        return json.loads(data)
+
+    JSON_ERRORS = (ValueError,)
+    DECODER = "json"
+
+# scamper writes "type":"trace"; matching the bare value also tolerates re-serialized
+# output with a space after the colon. Candidates are still checked after decoding.
+TRACE_MARK = b'"trace"'
+
+Source = Union[bytes, str, IO[bytes], Iterable[bytes]]
+
+
+def iter_trace_lines(src: Source) -> Iterator[bytes]:
+    """
+    Yield the raw lines of `src` that look like trace records. `src` may be a whole
+    output buffer (bytes/str) or anything that yields byte lines (a pipe, a socket
+    makefile), which is consumed incrementally.
+    """
+    if isinstance(src, str):
+        src = src.encode("utf-8", "replace")
+    lines = src.splitlines() if isinstance(src, bytes) else src
+    for line in lines:
+        if TRACE_MARK in line:
+            yield line.strip()
+
+
+def iter_traces(src: Source) -> Iterator[tuple[dict, bytes]]:
+    """Decoded trace records in `src`, each with the line it came from."""
+    for line in iter_trace_lines(src):
+        try:
+            obj = loads(line)
+        except JSON_ERRORS:
+            continue
+        if isinstance(obj, dict) and obj.get("type") == "trace":
+            yield obj, line
+
+
+def first_trace(src: Source) -> tuple[Optional[dict], bytes]:
+    """First trace record in `src` (stops reading a stream as soon as it has one)."""
+    for obj, line in iter_traces(src):
+        return obj, line
+    return None, b""
+
+
+def has_trace_record(out: Union[bytes, str]) -> bool:
+    """Cheap check that scamper produced (something that looks like) a trace record."""
+    if isinstance(out, str):
+        return TRACE_MARK.decode() in out
+    return TRACE_MARK in out
+
+
+def hop_status(hop: dict, dst: Optional[str]) -> str:
+    ip = hop.get("addr")
+    itype = hop.get("icmp_type")
+    icode = hop.get("icmp_code")
+
+    status = "ttl_exceeded"  # default for intermediate routers
+
+    # --- Destination classification by method ---
+    # UDP-Paris: dest replies ICMP Dest Unreachable, Port Unreachable (3,3)
+    if itype == 3 and icode == 3:
+        status = "dest_reached"
+
+    # ICMP-Paris: dest Echo Reply (type 0)
+    elif itype == 0:
+        status = "dest_reached"
+
+    # Fallback: if reply IP equals destination, treat as dest even if ICMP fields are odd
+    if ip and dst and ip == dst:
+        status = "dest_reached"
+    return status
+
+
+def index_hops(obj: dict) -> dict[int, list[dict]]:
+    """probe_ttl -> replies in arrival order, built in one pass over `hops`."""
+    by_ttl: dict[int, list[dict]] = {}
+    for hop in obj.get("hops") or ():
+        ttl = hop.get("probe_ttl") or hop.get("ttl")
+        if ttl is not None:
+            by_ttl.setdefault(ttl, []).append(hop)
+    return by_ttl
+
+
+def _blank_event(ttl: int, flow_id: int, method: str, ts: str) -> ProbeEvent:
+    return {
+        "target": None, "ttl": ttl, "flow_id": flow_id, "protocol": method,
+        "status": "timeout", "hop_ip": None, "rtt_ms": None,
+        "timestamp": ts, "raw": {}
+    }
+
+
+def _raw_for(obj: dict, line: bytes, raw_policy: Optional[RawPolicy]):
+    # Without a policy the decoded record is kept (legacy behaviour)
+    return raw_policy.record(line) if raw_policy else obj
+
+
+def trace_events(obj: Optional[dict], line: bytes, requests: list[tuple[int, int]],
+                 method: str = "udp-paris", raw_policy: Optional[RawPolicy] = None) -> list[ProbeEvent]:
+    """
+    One ProbeEvent per (ttl, flow_id) request from an already decoded trace record.
+    Replies for a TTL are handed out in arrival order; requests left over are timeouts.
+    """
+    ts = datetime.utcnow().isoformat()
+    if obj is None:
+        return [_blank_event(ttl, flow_id, method, ts) for ttl, flow_id in requests]
+
+    dst = obj.get("dst") or obj.get("target")
+    raw = _raw_for(obj, line, raw_policy)
+    by_ttl = index_hops(obj)
+    taken: dict[int, int] = {}
+
+    events: list[ProbeEvent] = []
+    for ttl, flow_id in requests:
+        event = _blank_event(ttl, flow_id, method, ts)
+        event["target"] = dst
+        event["raw"] = raw
+        replies = by_ttl.get(ttl)
+        i = taken.get(ttl, 0)
+        if replies and i < len(replies):
+            hop = replies[i]
+            taken[ttl] = i + 1
+            event.update({"hop_ip": hop.get("addr"), "rtt_ms": hop.get("rtt"), "status": hop_status(hop, dst),
+                          "reply_ttl": hop.get("reply_ttl")})
+        events.append(event)
+    return events
+
+
+def trace_event(obj: Optional[dict], line: bytes, ttl: int, method: str = "udp-paris",
+                raw_policy: Optional[RawPolicy] = None, flow_id: int = 0) -> ProbeEvent:
+    """The reply for a single probed `ttl` from an already decoded trace record."""
+    return trace_events(obj, line, [(ttl, flow_id)], method, raw_policy)[0]
@@ -0,0 +1,76 @@
+# app/prober/raw.py
+import json
+import random
+from typing import Optional, Union
+
+RETENTION_MODES = ("none", "errors", "sampled", "full")
+
+
+class RawPayload:
+    """
+    Scamper output kept as the raw bytes it arrived as; JSON is only decoded when
+    somebody actually looks (json()). Truthy when non-empty, like the dicts it replaces.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Union[bytes, str]):
+        self.data = data.encode("utf-8", "replace") if isinstance(data, str) else data
+
+    def __bool__(self) -> bool:
+        return bool(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def text(self) -> str:
+        return self.data.decode("utf-8", "replace")
+
+    def json(self):
+        """Decode the payload (a JSON record); non-JSON output comes back as text."""
+        try:
+            return json.loads(self.data)
+        except ValueError:
+            return self.text()
+
+    def __repr__(self) -> str:
+        return f"RawPayload({len(self.data)} bytes)"
+
+
+def decode_raw(raw):
+    """Plain-data view of an event's `raw` (for JSON output), decoding lazily kept payloads."""
+    if isinstance(raw, RawPayload):
+        return raw.json()
+    if isinstance(raw, dict):
+        return {k: decode_raw(v) for k, v in raw.items()}
+    return raw
+
+
+class RawPolicy:
+    """
+    Decides which probe payloads are kept in ProbeEvent["raw"]:
+      none    - never (errors still carry their short "error" message)
+      errors  - only scamper output for failed probes
+      sampled - errors, plus a `sample_rate` fraction of successful records
+      full    - everything (previous behaviour)
+    """
+
+    def __init__(self, mode: str = "errors", sample_rate: float = 0.01, seed: Optional[int] = None):
+        if mode not in RETENTION_MODES:
+            raise ValueError(f"raw_retention must be one of {RETENTION_MODES}, got {mode!r}")
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self._rng = random.Random(seed)
+
+    def record(self, data: Union[bytes, str]) -> Union[RawPayload, dict]:
+        """`raw` for a successfully parsed trace record."""
+        if self.mode == "full" or (self.mode == "sampled" and self._rng.random() < self.sample_rate):
+            return RawPayload(data)
+        return {}
+
+    def error(self, message: Optional[str], output: Union[bytes, str, None] = None) -> dict:
+        """`raw` for a failed probe: the short message always, the output if errors are kept."""
+        raw: dict = {"error": message} if message else {}
+        if output and self.mode != "none":
+            raw["output"] = RawPayload(output)
+        return raw
@@ -0,0 +1,216 @@
+# app/prober/replay.py
+"""
+Record / replay of probe results, for repeatable A/B runs of the controller.
+
+A recording is an append-only text log, one probe per line:
+
+    <dest> TAB <ttl> TAB <flow_id> TAB <event as compact JSON> NL
+
+The key comes first so an index can be built without decoding any JSON. The
+ReplayProber keeps that index in a sqlite sidecar (<log>.idx): key and repeat
+number -> byte offset. Opening a recording only indexes what was appended since
+the last open, and replies are read with a seek, so multi-GB logs are never
+loaded into memory.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional, Union
+
+from app.prober.base import Prober, ProbeEvent
+from app.prober.parse import loads
+from app.prober.raw import decode_raw
+
+
+class RecordingProber(Prober):
+    """
+    Wraps any Prober and appends every (dest, ttl, flow_id) -> event it returns to
+    `path`. Payloads in "raw" are dropped unless keep_raw is set.
+    """
+
+    def __init__(self, prober: Prober, path: str, keep_raw: bool = False):
+        self.prober = prober
+        self.path = path
+        self.keep_raw = keep_raw
+        self._fh = open(path, "ab")
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def _write(self, dest: str, ttl: int, flow_id: int, ev: ProbeEvent) -> None:
+        rec = dict(ev)
+        rec["raw"] = decode_raw(rec.get("raw")) if self.keep_raw else {}
+        line = f"{dest}\t{ttl}\t{flow_id}\t".encode() + json.dumps(
+            rec, separators=(",", ":"), ensure_ascii=False, default=str).encode() + b"\n"
+        with self._lock:
+            self._fh.write(line)
+            self.recorded += 1
+
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                   wait_s: Optional[float] = None) -> ProbeEvent:
+        kw = {"wait_s": wait_s} if wait_s is not None else {}
+        ev = self.prober.probe_once(dest, ttl, flow_id=flow_id, **kw)
+        self._write(dest, ttl, flow_id, ev)
+        return ev
+
+    def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                    wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        kw = {"wait_s": wait_s} if wait_s is not None else {}
+        events = self.prober.probe_batch(dest, requests, **kw)
+        for (ttl, flow_id), ev in zip(requests, events):
+            self._write(dest, ttl, flow_id, ev)
+        return events
+
+    def flush(self) -> None:
+        with self._lock:
+            self._fh.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+        self.prober.close()
+
+
+class ReplayIndex:
+    """sqlite sidecar: (dest, ttl, flow_id, seq) -> offset of the seq-th recorded reply."""
+
+    def __init__(self, log_path: str, index_path: Optional[str] = None):
+        self.log_path = log_path
+        self.db = sqlite3.connect(index_path or log_path + ".idx", check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS probes (
+                dest TEXT, ttl INTEGER, flow INTEGER, seq INTEGER, off INTEGER,
+                PRIMARY KEY (dest, ttl, flow, seq)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v INTEGER);
+        """)
+        self.indexed = self._meta("size")
+        if self.indexed > os.path.getsize(log_path):
+            # the log was replaced by a shorter one: start over
+            self.db.execute("DELETE FROM probes")
+            self.indexed = 0
+        self.update()
+
+    def _meta(self, key: str) -> int:
+        row = self.db.execute("SELECT v FROM meta WHERE k = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def update(self, chunk: int = 50_000) -> int:
+        """Index lines appended since the last call; returns how many were added."""
+        seqs: dict[tuple, int] = {}
+        rows, added = [], 0
+        with open(self.log_path, "rb") as fh:
+            fh.seek(self.indexed)
+            off = self.indexed
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    break  # a record still being written
+                parts = line.split(b"\t", 3)
+                if len(parts) == 4:
+                    key = (parts[0].decode(), int(parts[1]), int(parts[2]))
+                    seq = seqs.get(key)
+                    if seq is None:
+                        row = self.db.execute(
+                            "SELECT MAX(seq) FROM probes WHERE dest = ? AND ttl = ? AND flow = ?", key).fetchone()
+                        seq = -1 if row[0] is None else row[0]
+                    seqs[key] = seq = seq + 1
+                    rows.append((*key, seq, off))
+                off += len(line)
+                if len(rows) >= chunk:
+                    added += self._flush(rows, off)
+            added += self._flush(rows, off)
+        return added
+
+    def _flush(self, rows: list, size: int) -> int:
+        n = len(rows)
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('size', ?)", (size,))
+        self.indexed = size
+        rows.clear()
+        return n
+
+    def offset(self, dest: str, ttl: int, flow_id: int, seq: int) -> Optional[int]:
+        row = self.db.execute("SELECT off FROM probes WHERE dest = ? AND ttl = ? AND flow = ? AND seq = ?",
+                              (dest, ttl, flow_id, seq)).fetchone()
+        return row[0] if row else None
+
+    def count(self, dest: str, ttl: int, flow_id: int) -> int:
+        row = self.db.execute("SELECT COUNT(*) FROM probes WHERE dest = ? AND ttl = ? AND flow = ?",
+                              (dest, ttl, flow_id)).fetchone()
+        return row[0]
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class ReplayProber(Prober):
+    """
+    Serves a recording back: the n-th probe for (dest, ttl, flow_id) gets the n-th
+    event recorded for it. Probes past what was recorded go to `fallback`:
+      "timeout" - a synthetic timeout event (default)
+      "cycle"   - the recorded events for that key again, from the first
+      "error"   - raise KeyError
+      a Prober  - ask it (e.g. a SimulatedProber or a live prober)
+    reset() rewinds every key, so one ReplayProber can drive several runs.
+    """
+
+    def __init__(self, path: str, fallback: Union[str, Prober] = "timeout", index_path: Optional[str] = None):
+        if isinstance(fallback, str) and fallback not in ("timeout", "cycle", "error"):
+            raise ValueError(f"unknown replay fallback: {fallback}")
+        self.path = path
+        self.fallback = fallback
+        self.index = ReplayIndex(path, index_path)
+        self._fh = open(path, "rb")
+        self._lock = threading.Lock()
+        self._seq: dict[tuple[str, int, int], int] = {}
+        self.replayed = 0
+        self.missed = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._seq.clear()
+            self.replayed = self.missed = 0
+
+    def _read(self, off: int) -> ProbeEvent:
+        self._fh.seek(off)
+        return loads(self._fh.readline().split(b"\t", 3)[3])
+
+    def _timeout(self, dest: str, ttl: int, flow_id: int) -> ProbeEvent:
+        return {
+            "target": dest, "ttl": ttl, "flow_id": flow_id, "protocol": "replay",
+            "status": "timeout", "hop_ip": None, "rtt_ms": None,
+            "timestamp": datetime.utcnow().isoformat(), "raw": {"error": "not in recording"},
+        }
+
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                   wait_s: Optional[float] = None) -> ProbeEvent:
+        key = (dest, ttl, flow_id)
+        with self._lock:
+            seq = self._seq.get(key, 0)
+            self._seq[key] = seq + 1
+            off = self.index.offset(dest, ttl, flow_id, seq)
+            if off is None and self.fallback == "cycle":
+                n = self.index.count(dest, ttl, flow_id)
+                off = self.index.offset(dest, ttl, flow_id, seq % n) if n else None
+            if off is not None:
+                self.replayed += 1
+                return self._read(off)
+            self.missed += 1
+
+        if self.fallback == "error":
+            raise KeyError(f"no recorded probe #{seq + 1} for {dest} ttl={ttl} flow={flow_id}")
+        if isinstance(self.fallback, Prober):
+            kw = {"wait_s": wait_s} if wait_s is not None else {}
+            return self.fallback.probe_once(dest, ttl, flow_id=flow_id, **kw)
+        return self._timeout(dest, ttl, flow_id)
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+            self.index.close()
@@ -1,39 +1,138 @@
 # app/prober/scamper.py
-import json
+import math
 import os
-import random
 import shlex
 import shutil
 import subprocess
-import time
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 
+from app.logging import METRICS, perf_counter
 from app.prober.base import Prober, ProbeEvent
+from app.prober.parse import first_trace, has_trace_record, trace_event, trace_events
+from app.prober.raw import RawPolicy
 
 DEFAULT_SCAMPER_BIN = shutil.which("scamper") or "/usr/bin/scamper"
 
+
+def parse_scamper_json_v01(out: Union[bytes, str], ttl: int, method: str = "udp-paris",
+                           raw_policy: Optional[RawPolicy] = None) -> ProbeEvent:
+    """
+    Pick the reply for `ttl` out of scamper `-O json` output (one record per line).
+    Without a raw_policy the decoded record is kept in `raw` (legacy behaviour).
+    """
+    t0 = perf_counter() if METRICS.enabled else 0.0
+    obj, line = first_trace(out)
+    ev = trace_event(obj, line, ttl, method, raw_policy)
+    if METRICS.enabled:
+        METRICS.observe("parse", perf_counter() - t0)
+    return ev
+
+
+def parse_scamper_batch(out: Union[bytes, str], requests: list[tuple[int, int]], method: str = "udp-paris",
+                        raw_policy: Optional[RawPolicy] = None) -> list[ProbeEvent]:
+    """
+    Split one multi-TTL trace record into one ProbeEvent per (ttl, flow_id) request.
+    Replies for a TTL are handed out in arrival order; requests left over are timeouts.
+    """
+    t0 = perf_counter() if METRICS.enabled else 0.0
+    obj, line = first_trace(out)
+    events = trace_events(obj, line, requests, method, raw_policy)
+    if METRICS.enabled:
+        METRICS.observe("parse", perf_counter() - t0)
+    return events
+
+
+def batch_runs(requests: list[tuple[int, int]]) -> list[tuple[int, int, int, int, list[int]]]:
+    """
+    Split a batch into the trace commands that send exactly its probes: runs of
+    consecutive TTLs on one flow that each want the same number of attempts.
+    Returns (first_ttl, last_ttl, attempts, flow_id, request indices) per command,
+    the indices in the order scamper sends those probes.
+    """
+    per_hop: dict[tuple[int, int], list[int]] = {}
+    for i, (ttl, flow_id) in enumerate(requests):
+        per_hop.setdefault((flow_id, ttl), []).append(i)
+    runs: list[tuple[int, int, int, int, list[int]]] = []
+    for (flow_id, ttl), idx in sorted(per_hop.items()):
+        if runs:
+            first, last, attempts, run_flow, members = runs[-1]
+            if run_flow == flow_id and last == ttl - 1 and attempts == len(idx):
+                runs[-1] = (first, ttl, attempts, flow_id, members + idx)
+                continue
+        runs.append((ttl, ttl, len(idx), flow_id, idx))
+    return runs
+
+
+def batch_events(obj: Optional[dict], line: bytes, requests: list[tuple[int, int]],
+                 method: str = "udp-paris", raw_policy: Optional[RawPolicy] = None) -> list[ProbeEvent]:
+    """
+    trace_events() for the requests of one batch_runs() command. Probes past the
+    record's probe_count were never sent (scamper stopped at the destination or at
+    its gap limit first) and come back with sent=False, so they are not charged.
+    """
+    events = trace_events(obj, line, requests, method, raw_policy)
+    sent = obj.get("probe_count") if obj else None
+    if sent is not None:
+        for ev in events[sent:]:
+            ev["sent"] = False
+    return events
+
+
+def wait_opt(wait_s: Optional[float]) -> str:
+    """trace -w option for a reply wait (scamper takes whole seconds); '' = scamper's default."""
+    if wait_s is None:
+        return ""
+    return f" -w {max(1, math.ceil(wait_s))}"
+
+
+# Paris flow n != 0 goes out with source port (ICMP-paris: checksum) FLOW_PORT_BASE + n
+FLOW_PORT_BASE = 40000
+
+
+def flow_opt(method: str, flow_id: int) -> str:
+    """trace option putting probes on Paris flow `flow_id`; '' = flow 0, scamper's default flow."""
+    if not flow_id:
+        return ""
+    value = (FLOW_PORT_BASE + flow_id) & 0xFFFF
+    return f" -d {value}" if method.startswith("icmp") else f" -s {value}"
+
+
+def trace_template(method: str, ttl: int, attempts: int = 1, last_ttl: Optional[int] = None,
+                   wait_s: Optional[float] = None, flow_id: int = 0) -> str:
+    """The scamper trace command (without a target) probing TTLs ttl..last_ttl `attempts` times each."""
+    tpl = (f"trace -P {method} -q {attempts} -f {ttl} -m {last_ttl or ttl}"
+           + wait_opt(wait_s) + flow_opt(method, flow_id))
+    if attempts > 1:
+        # -Q: send every allotted attempt even after a reply (we want the counts)
+        tpl += " -Q"
+    return tpl
+
+
 class ScamperProber(Prober):
     """
     Simple wrapper around the 'scamper' binary to send a single-TTL Paris-style probe
     and return a normalized ProbeEvent. It will try non-sudo first and fall back to sudo -n.
+    Probes go out as soon as they are asked for; pacing is up to the caller (app.prober.pacing).
     """
 
     def __init__(self,
                  scamper_bin: str = DEFAULT_SCAMPER_BIN,
                  method: str = "udp-paris",
                  use_sudo: bool = True,
-                 pace_ms: int = 40):
+                 raw_retention: str = "errors",
+                 raw_sample_rate: float = 0.01):
         self.scamper = scamper_bin
         self.method = method
         self.use_sudo = use_sudo
-        self.pace_ms = pace_ms
+        self.raw_policy = RawPolicy(raw_retention, raw_sample_rate)
         if not os.path.exists(self.scamper):
             raise FileNotFoundError(f"scamper binary not found at {self.scamper}")
 
-    def _build_cmd(self, dest: str, ttl: int, attempts: int = 1, use_sudo: bool = False) -> str:
+    def _build_cmd(self, dest: str, ttl: int, attempts: int = 1, use_sudo: bool = False,
+                   last_ttl: Optional[int] = None, wait_s: Optional[float] = None, flow_id: int = 0) -> str:
         # Build a scamper command that applies the trace template to the -i target list
-        trace_tpl = f"trace -P {self.method} -q {attempts} -f {ttl} -m {ttl}"
+        trace_tpl = trace_template(self.method, ttl, attempts, last_ttl, wait_s, flow_id)
         # Use -O json for direct JSON output; some installs require -o file, but prefer stdout.
         base = f"{shlex.quote(self.scamper)} -O json -i {shlex.quote(dest)} -c {shlex.quote(trace_tpl)}"
         if use_sudo:
@@ -41,93 +140,38 @@ class ScamperProber(Prober):
             return f"sudo -n {base}"
         return base
 
-    def _run_cmd(self, cmd: str) -> str:
-        # Run command and return stdout. Caller handles exceptions.
-        proc = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    def _run_cmd(self, cmd: str) -> bytes:
+        # Run command and return raw stdout bytes (parsed without a text decode). Caller handles exceptions.
+        t0 = perf_counter() if METRICS.enabled else 0.0
+        proc = subprocess.run(cmd, shell=True, check=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if METRICS.enabled:
+            METRICS.observe("scamper_run", perf_counter() - t0)
         return proc.stdout
 
-    def _parse_scamper_json_v01(self, out: str, ttl: int) -> ProbeEvent:
-        event: ProbeEvent = {
-            "target": None, "ttl": ttl, "flow_id": 0, "protocol": self.method if hasattr(self, "method") else "udp-paris",
-            "status": "timeout", "hop_ip": None, "rtt_ms": None,
-            "timestamp": datetime.utcnow().isoformat(), "raw": {}
-        }
-
-        for line in out.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            if obj.get("type") != "trace":
-                continue
-
-            # Keep raw for debugging
-            event["raw"] = obj
-            dst = obj.get("dst") or obj.get("target")
-            event["target"] = dst
+    def _parse_scamper_json_v01(self, out: Union[bytes, str], ttl: int) -> ProbeEvent:
+        return parse_scamper_json_v01(out, ttl, getattr(self, "method", "udp-paris"),
+                                      getattr(self, "raw_policy", None))
 
-            # Find the reply for the TTL we just probed
-            hops = obj.get("hops", []) or []
-            for hop in hops:
-                if hop.get("probe_ttl") != ttl:
-                    continue
 
-                ip = hop.get("addr")
-                rtt = hop.get("rtt")
-                itype = hop.get("icmp_type")
-                icode = hop.get("icmp_code")
-
-                status = "ttl_exceeded"  # default for intermediate routers
-
-                # --- Destination classification by method ---
-                # UDP-Paris: dest replies ICMP Dest Unreachable, Port Unreachable (3,3)
-                if itype == 3 and icode == 3:
-                    status = "dest_reached"
-
-                # ICMP-Paris: dest Echo Reply (type 0)
-                elif itype == 0:
-                    status = "dest_reached"
-
-                # Fallback: if reply IP equals destination, treat as dest even if ICMP fields are odd
-                if ip and dst and ip == dst:
-                    status = "dest_reached"
-
-                event.update({"hop_ip": ip, "rtt_ms": rtt, "status": status})
-                return event
-
-            # If we saw the trace but not the specific TTL's reply, leave as timeout
-            return event
-
-        # No trace record found at all → leave as timeout with raw empty
-        return event
-
-
-    def probe_once(self, dest: str, ttl: int, flow_id: int = 0) -> ProbeEvent:
-        # pacing with tiny jitter so quick loops don't overwhelm the network
-        sleep_s = max(0, (self.pace_ms + random.randint(-10, 10)) / 1000.0)
-        time.sleep(sleep_s)
-
-        last_out: Optional[str] = None
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                   wait_s: Optional[float] = None) -> ProbeEvent:
+        last_out: Optional[bytes] = None
         # Try without sudo first (if configured), then try with sudo if allowed by self.use_sudo
         tries = [False]
         if self.use_sudo:
             tries.append(True)
 
         for use_sudo in tries:
-            cmd = self._build_cmd(dest, ttl, attempts=1, use_sudo=use_sudo)
+            cmd = self._build_cmd(dest, ttl, attempts=1, use_sudo=use_sudo, wait_s=wait_s, flow_id=flow_id)
             try:
                 out = self._run_cmd(cmd)
             except Exception as e:
-                last_out = f"exception: {e}"
+                last_out = f"exception: {e}".encode()
                 out = last_out
             last_out = out
 
             # quick failure checks
-            if "could not chown /var/empty" in out.lower():
+            if b"could not chown /var/empty" in out.lower():
                 # permission/privsep misconfiguration — return explicit error in raw
                 return {
                     "target": dest,
@@ -138,11 +182,11 @@ class ScamperProber(Prober):
                     "hop_ip": None,
                     "rtt_ms": None,
                     "timestamp": datetime.utcnow().isoformat(),
-                    "raw": {"error": "privsep: check /var/empty permissions", "output": out}
+                    "raw": self.raw_policy.error("privsep: check /var/empty permissions", out)
                 }
 
             # scamper prints usage when mis-invoked; detect that and return error
-            if out.strip().startswith("usage: scamper"):
+            if out.strip().startswith(b"usage: scamper"):
                 # include output for debugging
                 return {
                     "target": dest,
@@ -153,13 +197,12 @@ class ScamperProber(Prober):
                     "hop_ip": None,
                     "rtt_ms": None,
                     "timestamp": datetime.utcnow().isoformat(),
-                    "raw": {"error": "scamper usage", "output": out}
+                    "raw": self.raw_policy.error("scamper usage", out)
                 }
 
-            # Otherwise try parse; if parseable, return
-            parsed = self._parse_scamper_json_v01(out, ttl)
-            # If parsed contains some useful info (hop_ip or raw trace), return it
-            if parsed.get("raw"):
+            # Otherwise try parse; if scamper produced a trace record, return it
+            if has_trace_record(out):
+                parsed = self._parse_scamper_json_v01(out, ttl)
                 parsed["flow_id"] = flow_id
                 parsed["protocol"] = self.method
                 return parsed
@@ -174,5 +217,31 @@ class ScamperProber(Prober):
             "hop_ip": None,
             "rtt_ms": None,
             "timestamp": datetime.utcnow().isoformat(),
-            "raw": {"output": last_out}
+            "raw": self.raw_policy.error(None, last_out)
         }
+
+    def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                    wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        """One scamper invocation per batch_runs() command, so exactly `requests` go out."""
+        events: list = [None] * len(requests)
+        tries = [False, True] if self.use_sudo else [False]
+        for first, last, attempts, flow_id, members in batch_runs(requests):
+            out = b""
+            for use_sudo in tries:
+                cmd = self._build_cmd(dest, first, attempts=attempts, use_sudo=use_sudo, last_ttl=last,
+                                      wait_s=wait_s, flow_id=flow_id)
+                try:
+                    out = self._run_cmd(cmd)
+                except Exception as e:
+                    out = f"exception: {e}".encode()
+                if has_trace_record(out):
+                    break
+            obj, line = first_trace(out)
+            raw = self.raw_policy.error(None, out) if obj is None else None
+            run_events = batch_events(obj, line, [requests[i] for i in members], self.method, self.raw_policy)
+            for i, ev in zip(members, run_events):
+                ev["target"] = ev.get("target") or dest
+                if raw is not None:
+                    ev["raw"] = raw
+                events[i] = ev
+        return events
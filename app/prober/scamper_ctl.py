@@ -0,0 +1,306 @@
+# app/prober/scamper_ctl.py
+import itertools
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from app.logging import METRICS, perf_counter
+from app.prober.base import Prober, ProbeEvent
+from app.prober.parse import iter_traces, trace_event
+from app.prober.raw import RawPolicy
+from app.prober.scamper import DEFAULT_SCAMPER_BIN, batch_events, batch_runs, flow_opt, wait_opt
+
+
+class _Waiter:
+    __slots__ = ("ttl", "done", "obj", "line", "error")
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.done = threading.Event()
+        self.obj: Optional[dict] = None   # decoded once, by the reader thread
+        self.line: bytes = b""
+        self.error: Optional[str] = None
+
+
+class ScamperCtlProber(Prober):
+    """
+    Keeps ONE scamper process alive and talks to it over its unix control socket
+    (`scamper -U <sock>`), instead of spawning a process per probe.
+
+    Protocol (scamper remote control, attached mode):
+        -> attach format json           <- OK / MORE
+        -> trace ... -U <userid> <dst>  <- OK id-N
+                                        <- DATA <len>\\n<len bytes of json>
+                                        <- MORE
+    Every command carries a unique trace userid (`-U`) so the JSON record can be
+    matched back to the probe that is waiting for it. probe_once() is thread-safe:
+    many threads may have probes outstanding at the same time.
+    """
+
+    def __init__(self,
+                 scamper_bin: str = DEFAULT_SCAMPER_BIN,
+                 method: str = "udp-paris",
+                 use_sudo: bool = True,
+                 pps: Optional[int] = None,
+                 sock_path: Optional[str] = None,
+                 scamper_cmd: Optional[list[str]] = None,
+                 start_timeout_s: float = 5.0,
+                 probe_timeout_s: float = 10.0,
+                 raw_retention: str = "errors",
+                 raw_sample_rate: float = 0.01):
+        # scamper_cmd overrides the executable prefix (e.g. a fake-scamper stand-in)
+        if scamper_cmd is None:
+            if not os.path.exists(scamper_bin):
+                raise FileNotFoundError(f"scamper binary not found at {scamper_bin}")
+            scamper_cmd = [scamper_bin]
+            if use_sudo:
+                scamper_cmd = ["sudo", "-n"] + scamper_cmd
+        self.method = method
+        self.probe_timeout_s = probe_timeout_s
+        self.raw_policy = RawPolicy(raw_retention, raw_sample_rate)
+
+        self._tmpdir = None
+        if sock_path is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="scamper-ctl-")
+            sock_path = os.path.join(self._tmpdir, "ctl.sock")
+        self.sock_path = sock_path
+
+        argv = list(scamper_cmd) + ["-U", sock_path]
+        if pps:
+            argv += ["-p", str(int(pps))]
+        self._proc = subprocess.Popen(argv, stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        self._sock = self._connect(start_timeout_s)
+        self._rfile = self._sock.makefile("rb")
+
+        self._lock = threading.Lock()        # guards writes + the bookkeeping below
+        self._cv = threading.Condition(self._lock)
+        self._credits = 0                    # one per MORE from scamper
+        self._userids = itertools.count(1)
+        self._waiters: dict[int, _Waiter] = {}
+        self._unacked: deque[int] = deque()  # userids sent, waiting for OK/ERR
+        self._closed = False
+        self._dead_reason: Optional[str] = None
+
+        self._send_line("attach format json")
+        self._reader = threading.Thread(target=self._read_loop, name="scamper-ctl-reader", daemon=True)
+        self._reader.start()
+
+    # -------------------------------
+    # connection / framing
+    # -------------------------------
+    def _connect(self, timeout_s: float) -> socket.socket:
+        deadline = time.monotonic() + timeout_s
+        last_err: Optional[Exception] = None
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                err = self._proc.stderr.read().decode(errors="replace") if self._proc.stderr else ""
+                raise RuntimeError(f"scamper exited during startup (rc={self._proc.returncode}): {err.strip()}")
+            if os.path.exists(self.sock_path):
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    s.connect(self.sock_path)
+                    return s
+                except OSError as e:
+                    last_err = e
+                    s.close()
+            time.sleep(0.01)
+        self._proc.kill()
+        raise RuntimeError(f"could not connect to scamper control socket {self.sock_path}: {last_err}")
+
+    def _send_line(self, line: str) -> None:
+        self._sock.sendall(line.encode() + b"\n")
+
+    def _read_loop(self) -> None:
+        try:
+            while True:
+                line = self._rfile.readline()
+                if not line:
+                    break
+                line = line.rstrip(b"\r\n")
+                if line == b"MORE":
+                    self._grant()
+                elif line.startswith(b"DATA "):
+                    n = int(line[5:])
+                    self._on_data(self._rfile.read(n))
+                elif line.startswith(b"OK"):
+                    # "OK" (attach) carries no id; "OK id-N" acks the oldest command
+                    if line.startswith(b"OK id-"):
+                        with self._lock:
+                            if self._unacked:
+                                self._unacked.popleft()
+                elif line.startswith(b"ERR"):
+                    with self._lock:
+                        uid = self._unacked.popleft() if self._unacked else None
+                        w = self._waiters.pop(uid, None) if uid is not None else None
+                    if w is not None:
+                        w.error = line.decode(errors="replace")
+                        w.done.set()
+                    # a rejected command does not consume scamper's MORE credit
+                    self._grant()
+        except (OSError, ValueError) as e:
+            self._dead_reason = f"control socket error: {e}"
+        finally:
+            self._fail_all(self._dead_reason or "scamper control socket closed")
+
+    def _grant(self) -> None:
+        with self._cv:
+            self._credits += 1
+            self._cv.notify()
+
+    def _on_data(self, payload: bytes) -> None:
+        t0 = perf_counter() if METRICS.enabled else 0.0
+        for obj, line in iter_traces(payload):
+            with self._lock:
+                w = self._waiters.pop(obj.get("userid"), None)
+            if w is not None:
+                w.obj = obj
+                w.line = line
+                w.done.set()
+        if METRICS.enabled:
+            METRICS.observe("parse", perf_counter() - t0)
+
+    def _fail_all(self, reason: str) -> None:
+        with self._cv:
+            self._closed = True
+            self._dead_reason = self._dead_reason or reason
+            waiters = list(self._waiters.values())
+            self._waiters.clear()
+            # wake anyone blocked on a MORE that will never come
+            self._cv.notify_all()
+        for w in waiters:
+            w.error = reason
+            w.done.set()
+
+    # -------------------------------
+    # Prober API
+    # -------------------------------
+    def _build_cmd(self, dest: str, ttl: int, userid: int, attempts: int = 1,
+                   last_ttl: Optional[int] = None, wait_s: Optional[float] = None, flow_id: int = 0) -> str:
+        cmd = (f"trace -P {self.method} -q {attempts} -f {ttl} -m {last_ttl or ttl} -U {userid}"
+               + wait_opt(wait_s) + flow_opt(self.method, flow_id))
+        if attempts > 1:
+            cmd += " -Q"
+        return f"{cmd} {dest}"
+
+    def _error_event(self, dest: str, ttl: int, flow_id: int, error: str) -> ProbeEvent:
+        return {
+            "target": dest,
+            "ttl": ttl,
+            "flow_id": flow_id,
+            "protocol": self.method,
+            "status": "timeout",
+            "hop_ip": None,
+            "rtt_ms": None,
+            "timestamp": datetime.utcnow().isoformat(),
+            "raw": self.raw_policy.error(error),
+        }
+
+    def _submit(self, dest: str, ttl: int, attempts: int = 1, last_ttl: Optional[int] = None,
+                wait_s: Optional[float] = None, flow_id: int = 0) -> tuple[Optional[_Waiter], Optional[str]]:
+        """Send one trace command and block for its JSON record. Returns (waiter, error)."""
+        with self._cv:
+            if not self._cv.wait_for(lambda: self._credits > 0 or self._closed, self.probe_timeout_s):
+                return None, "scamper did not ask for more commands"
+            if self._closed:
+                return None, self._dead_reason or "prober closed"
+            self._credits -= 1
+            uid = next(self._userids) & 0xFFFFFFFF
+            w = _Waiter(ttl)
+            self._waiters[uid] = w
+            self._unacked.append(uid)
+            try:
+                self._send_line(self._build_cmd(dest, ttl, uid, attempts=attempts, last_ttl=last_ttl,
+                                                wait_s=wait_s, flow_id=flow_id))
+            except OSError as e:
+                self._waiters.pop(uid, None)
+                self._unacked.pop()
+                self._credits += 1
+                return None, f"send failed: {e}"
+
+        t0 = perf_counter() if METRICS.enabled else 0.0
+        if not w.done.wait(self.probe_timeout_s):
+            with self._lock:
+                self._waiters.pop(uid, None)
+            return None, "no reply from scamper"
+        if METRICS.enabled:
+            METRICS.observe("scamper_wait", perf_counter() - t0)
+        return w, w.error
+
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                   wait_s: Optional[float] = None) -> ProbeEvent:
+        w, error = self._submit(dest, ttl, wait_s=wait_s, flow_id=flow_id)
+        if error is not None or w is None:
+            return self._error_event(dest, ttl, flow_id, error or "no reply from scamper")
+
+        ev = trace_event(w.obj, w.line, ttl, self.method, self.raw_policy, flow_id=flow_id)
+        ev["target"] = ev.get("target") or dest
+        return ev
+
+    def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                    wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        """One trace command (-f/-m/-q and the flow) per batch_runs() command, all in flight at once."""
+        runs = batch_runs(requests)
+        events: list = [None] * len(requests)
+        outs: list[list] = [[] for _ in runs]
+        threads = [threading.Thread(target=self._batch_run, args=(dest, requests, run, wait_s, out), daemon=True)
+                   for run, out in zip(runs[1:], outs[1:])]
+        for t in threads:
+            t.start()
+        if runs:
+            self._batch_run(dest, requests, runs[0], wait_s, outs[0])
+        for t in threads:
+            t.join()
+        for (_first, _last, _attempts, _flow, members), out in zip(runs, outs):
+            for i, ev in zip(members, out):
+                events[i] = ev
+        return events
+
+    def _batch_run(self, dest: str, requests: list[tuple[int, int]], run: tuple,
+                   wait_s: Optional[float], out: list) -> None:
+        first, last, attempts, flow_id, members = run
+        reqs = [requests[i] for i in members]
+        w, error = self._submit(dest, first, attempts=attempts, last_ttl=last, wait_s=wait_s, flow_id=flow_id)
+        if error is not None or w is None:
+            out.extend(self._error_event(dest, ttl, fid, error or "no reply from scamper") for ttl, fid in reqs)
+            return
+        for ev in batch_events(w.obj, w.line, reqs, self.method, self.raw_policy):
+            ev["target"] = ev.get("target") or dest
+            out.append(ev)
+
+    def close(self) -> None:
+        with self._cv:
+            already = self._closed
+            self._closed = True
+            self._cv.notify_all()
+        if not already:
+            try:
+                self._send_line("done")
+            except OSError:
+                pass
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        if self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
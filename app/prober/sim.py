@@ -0,0 +1,217 @@
+# app/prober/sim.py
+"""
+Simulated network for offline runs: a synthetic topology generated from a seed and
+a Prober answering probes against it, with a simulated clock instead of real waits.
+
+Every destination gets its own path; the first `shared_hops` routers (the
+vantage point's access network) are the same for all of them. A hop may be an
+ECMP fan-out (the interface is picked per flow ID, Paris style), lossy, ICMP
+rate limited (per interface token bucket on the simulated clock) or silent, and
+destinations may not answer at all. Paths depend only on (seed, dest); probe
+outcomes come from the prober's own seeded RNG, so a given sequence of probes
+always gets the same answers.
+"""
+import random
+import zlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+from app.prober.base import Prober, ProbeEvent
+
+
+@dataclass(slots=True)
+class SimHop:
+    ifaces: tuple[str, ...]           # ECMP interfaces at this TTL (one = no load balancing)
+    rtt_ms: float                     # base RTT to this hop
+    loss: float = 0.0                 # probability a probe or its reply is lost
+    silent: bool = False              # never sends ICMP time-exceeded
+    rate_pps: Optional[float] = None  # ICMP rate limit per interface; None = unlimited
+
+
+@dataclass(slots=True)
+class SimPath:
+    dest: str
+    hops: list[SimHop]                # TTL 1..len(hops); the destination sits at len(hops) + 1
+    dest_rtt_ms: float
+    dest_silent: bool = False
+    dest_loss: float = 0.0
+
+    @property
+    def dest_ttl(self) -> int:
+        return len(self.hops) + 1
+
+
+@dataclass
+class SimTopology:
+    seed: int = 0
+    min_hops: int = 6                 # routers before the destination
+    max_hops: int = 18
+    shared_hops: int = 3              # common near side of every path
+    ecmp_p: float = 0.15              # chance a hop load-balances ...
+    max_width: int = 4                # ... over 2..max_width interfaces
+    loss: float = 0.02                # per-hop loss rate is drawn from [0, loss * 2]
+    silent_p: float = 0.05            # chance a router never answers
+    dest_silent_p: float = 0.1        # chance the destination never answers
+    rate_limit_p: float = 0.1         # chance a router rate limits its ICMP ...
+    rate_limit_pps: tuple[float, float] = (1.0, 10.0)  # ... to this many replies per second
+    hop_rtt_ms: tuple[float, float] = (0.5, 8.0)       # RTT added per hop
+    _paths: dict = field(default_factory=dict, repr=False)
+    _near: Optional[list] = field(default=None, repr=False)
+
+    def _hop(self, rng: random.Random, rtt_ms: float) -> SimHop:
+        width = rng.randint(2, self.max_width) if rng.random() < self.ecmp_p else 1
+        net = f"10.{rng.randrange(256)}.{rng.randrange(256)}"
+        return SimHop(
+            ifaces=tuple(f"{net}.{i + 1}" for i in range(width)),
+            rtt_ms=rtt_ms,
+            loss=rng.uniform(0.0, 2 * self.loss),
+            silent=rng.random() < self.silent_p,
+            rate_pps=rng.uniform(*self.rate_limit_pps) if rng.random() < self.rate_limit_p else None,
+        )
+
+    def _near_side(self) -> list[SimHop]:
+        if self._near is None:
+            rng = random.Random(f"{self.seed}:near")
+            hops, rtt = [], 0.0
+            for _ in range(self.shared_hops):
+                rtt += rng.uniform(*self.hop_rtt_ms)
+                hops.append(self._hop(rng, rtt))
+            self._near = hops
+        return self._near
+
+    def path(self, dest: str) -> SimPath:
+        p = self._paths.get(dest)
+        if p is not None:
+            return p
+        rng = random.Random(f"{self.seed}:{dest}")
+        n = rng.randint(max(self.min_hops, self.shared_hops), self.max_hops)
+        hops = list(self._near_side())
+        rtt = hops[-1].rtt_ms if hops else 0.0
+        while len(hops) < n:
+            rtt += rng.uniform(*self.hop_rtt_ms)
+            hops.append(self._hop(rng, rtt))
+        p = self._paths[dest] = SimPath(
+            dest=dest,
+            hops=hops,
+            dest_rtt_ms=rtt + rng.uniform(*self.hop_rtt_ms),
+            dest_silent=rng.random() < self.dest_silent_p,
+            dest_loss=rng.uniform(0.0, 2 * self.loss),
+        )
+        return p
+
+    @staticmethod
+    def iface(path: SimPath, ttl: int, flow_id: int) -> str:
+        """Interface a probe on `flow_id` crosses at `ttl` (stable per flow, like a real per-flow hash)."""
+        ifaces = path.hops[ttl - 1].ifaces
+        if len(ifaces) == 1:
+            return ifaces[0]
+        return ifaces[zlib.crc32(f"{path.dest}|{ttl}|{flow_id}".encode()) % len(ifaces)]
+
+
+class SimulatedProber(Prober):
+    """
+    Answers probes from a SimTopology. `elapsed[dest]` is the simulated time spent
+    on a destination's probes (the RTT for a reply, the reply wait for a loss) and
+    `now` the simulated clock, which drives ICMP rate limiting.
+    """
+
+    def __init__(self, topology: Optional[SimTopology] = None, seed: int = 0,
+                 timeout_s: float = 5.0, rtt_jitter: float = 0.2, initial_ttl: int = 64):
+        self.topo = topology or SimTopology(seed=seed)
+        self.timeout_s = timeout_s        # the reply wait when the caller passes none
+        self.rtt_jitter = rtt_jitter      # lognormal sigma around a hop's base RTT
+        self.initial_ttl = initial_ttl    # IP-TTL the destination's replies start with
+        self._rng = random.Random(seed)
+        self._buckets: dict[str, tuple[float, float]] = {}  # iface -> (tokens, last refill)
+        self.now = 0.0
+        self.elapsed: dict[str, float] = {}
+        self.probes = 0
+        self.rate_limited = 0
+
+    def _allow(self, iface: str, rate: Optional[float]) -> bool:
+        """Token bucket (burst 1) on the simulated clock."""
+        if rate is None:
+            return True
+        tokens, last = self._buckets.get(iface, (1.0, self.now))
+        tokens = min(1.0, tokens + (self.now - last) * rate)
+        allowed = tokens >= 1.0
+        self._buckets[iface] = (tokens - 1.0 if allowed else tokens, self.now)
+        if not allowed:
+            self.rate_limited += 1
+        return allowed
+
+    def _event(self, dest: str, ttl: int, flow_id: int, status: str, hop_ip: Optional[str] = None,
+               rtt_ms: Optional[float] = None, reply_ttl: Optional[int] = None) -> ProbeEvent:
+        ev: ProbeEvent = {
+            "target": dest, "ttl": ttl, "flow_id": flow_id, "protocol": "sim",
+            "status": status, "hop_ip": hop_ip, "rtt_ms": rtt_ms,
+            "timestamp": None, "raw": {},
+        }
+        if reply_ttl is not None:
+            ev["reply_ttl"] = reply_ttl
+        return ev
+
+    def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                   wait_s: Optional[float] = None) -> ProbeEvent:
+        path = self.topo.path(dest)
+        self.probes += 1
+        rng = self._rng
+        if ttl >= path.dest_ttl:
+            hop_ip, base, loss, silent, rate = dest, path.dest_rtt_ms, path.dest_loss, path.dest_silent, None
+            status = "dest_reached"
+        else:
+            hop = path.hops[ttl - 1]
+            hop_ip, base, loss, silent, rate = (self.topo.iface(path, ttl, flow_id), hop.rtt_ms,
+                                                hop.loss, hop.silent, hop.rate_pps)
+            status = "ttl_exceeded"
+
+        rtt = base * rng.lognormvariate(0.0, self.rtt_jitter)
+        wait = wait_s if wait_s is not None else self.timeout_s
+        if silent or rng.random() < loss or not self._allow(hop_ip, rate) or rtt / 1000.0 > wait:
+            ev = self._event(dest, ttl, flow_id, "timeout")
+            spent = wait
+        else:
+            reply_ttl = self.initial_ttl - path.dest_ttl + 1 if status == "dest_reached" else None
+            ev = self._event(dest, ttl, flow_id, status, hop_ip, round(rtt, 3), reply_ttl)
+            spent = rtt / 1000.0
+        self.now += spent
+        self.elapsed[dest] = self.elapsed.get(dest, 0.0) + spent
+        return ev
+
+    def clock(self) -> float:
+        """The simulated clock, for code that would otherwise read time.monotonic."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """A driver pausing between probes: advances the simulated clock only."""
+        self.now += max(0.0, seconds)
+
+    # -------------------------------
+    # Ground truth, for scoring results
+    # -------------------------------
+    def truth(self, dest: str) -> dict:
+        path = self.topo.path(dest)
+        return {
+            "dest_ttl": path.dest_ttl,
+            "dest_silent": path.dest_silent,
+            # TTL -> interfaces that can answer there (empty: the hop is silent)
+            "hops": {t: (() if h.silent else h.ifaces) for t, h in enumerate(path.hops, start=1)},
+        }
+
+    def score(self, dest: str, path: dict) -> dict:
+        """
+        Compare a result path (TTL -> IP, "∅" for dark) with the ground truth: a hop
+        is right if it names one of its interfaces, or is dark / missing when the
+        router is silent. "complete": every TTL up to the destination was right.
+        """
+        truth = self.truth(dest)
+        dest_ttl = truth["dest_ttl"]
+        right = 0
+        for ttl in range(1, dest_ttl + 1):
+            got = path.get(ttl)
+            if ttl == dest_ttl:
+                want = () if truth["dest_silent"] else (dest,)
+            else:
+                want = truth["hops"][ttl]
+            right += (got in want) if want else (got in (None, "∅"))
+        return {"accuracy": right / dest_ttl, "complete": right == dest_ttl}
@@ -0,0 +1,178 @@
+# app/prober/sweep.py
+import asyncio
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from app.logging import METRICS, perf_counter
+from app.prober.base import AsyncProber, ProbeEvent
+from app.prober.parse import first_trace, iter_traces, trace_event
+from app.prober.raw import RawPolicy
+from app.prober.scamper import DEFAULT_SCAMPER_BIN, batch_events, batch_runs, trace_template, wait_opt
+
+
+class SweepProber(AsyncProber):
+    """
+    Many traces, few scamper processes: probe_once() calls from concurrent traces
+    are held for up to `linger_s` (or until `round_size` of them are waiting) and
+    then go out together as one round. A round is split only by what a single
+    scamper command line cannot vary per target (TTL, flow ID and reply wait);
+    each part is one `scamper -f <target list> -c <trace template>` run, and its
+    JSON records are handed back to the waiting traces by "dst".
+
+    Traces driven by AsyncBatchRunner move in step: each gets its reply at the end
+    of a round and asks for its next probe straight away, so the next round picks
+    them all up again. Spawns grow with rounds (times the distinct TTLs in flight),
+    not with targets x probes. Targets must be IP addresses, since replies are
+    matched on the address scamper reports. `pps` is scamper's own probe rate
+    (its default is 20, far too low for a round of thousands of targets).
+    """
+
+    def __init__(self,
+                 scamper_bin: str = DEFAULT_SCAMPER_BIN,
+                 method: str = "udp-paris",
+                 use_sudo: bool = True,
+                 pps: int = 1000,
+                 round_size: int = 1024,
+                 linger_s: float = 0.005,
+                 scamper_cmd: Optional[list[str]] = None,
+                 raw_retention: str = "errors",
+                 raw_sample_rate: float = 0.01):
+        # scamper_cmd overrides the executable prefix (e.g. a fake-scamper stand-in)
+        if scamper_cmd is None:
+            if not os.path.exists(scamper_bin):
+                raise FileNotFoundError(f"scamper binary not found at {scamper_bin}")
+            scamper_cmd = [scamper_bin]
+            if use_sudo:
+                scamper_cmd = ["sudo", "-n"] + scamper_cmd
+        self.scamper_cmd = list(scamper_cmd)
+        self.method = method
+        self.pps = pps
+        self.round_size = max(1, round_size)
+        self.linger_s = linger_s
+        self.raw_policy = RawPolicy(raw_retention, raw_sample_rate)
+        self._tmpdir = tempfile.mkdtemp(prefix="scamper-sweep-")
+        self._pending: list[tuple[str, int, int, Optional[float], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._rounds: set[asyncio.Task] = set()
+        self._seq = 0
+        self.rounds = 0
+        self.spawns = 0
+        self.probes = 0
+
+    # -------------------------------
+    # Rounds
+    # -------------------------------
+    async def probe_once(self, dest: str, ttl: int, flow_id: int = 0,
+                         wait_s: Optional[float] = None) -> ProbeEvent:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((dest, ttl, flow_id, wait_s, fut))
+        if len(self._pending) >= self.round_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger_s, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._run_round(batch))
+        self._rounds.add(task)
+        task.add_done_callback(self._rounds.discard)
+
+    async def _run_round(self, batch: list) -> None:
+        self.rounds += 1
+        self.probes += len(batch)
+        # one scamper run per (ttl, flow, wait); a target twice in a round goes to a second run
+        groups: dict[tuple, list[tuple[str, asyncio.Future]]] = {}
+        seen: dict[tuple, int] = {}
+        for dest, ttl, flow_id, wait_s, fut in batch:
+            key = (ttl, flow_id, wait_opt(wait_s))
+            n = seen.get((key, dest), 0)
+            seen[(key, dest)] = n + 1
+            groups.setdefault((*key, n), []).append((dest, fut))
+        await asyncio.gather(*(self._run_group(key, reqs) for key, reqs in groups.items()))
+
+    async def _run_group(self, key: tuple, reqs: list[tuple[str, asyncio.Future]]) -> None:
+        ttl, flow_id, wait, _ = key
+        try:
+            self._seq += 1
+            listfile = os.path.join(self._tmpdir, f"round-{self._seq}.txt")
+            with open(listfile, "w", encoding="ascii") as fh:
+                fh.write("".join(f"{dest}\n" for dest, _ in reqs))
+            tpl = trace_template(self.method, ttl, flow_id=flow_id) + wait
+            try:
+                out = await self._run([*self.scamper_cmd, "-O", "json", "-p", str(self.pps),
+                                       "-f", listfile, "-c", tpl])
+            finally:
+                os.unlink(listfile)
+            t0 = perf_counter() if METRICS.enabled else 0.0
+            records = {obj.get("dst"): (obj, line) for obj, line in iter_traces(out)}
+            for dest, fut in reqs:
+                obj, line = records.get(dest, (None, b""))
+                ev = trace_event(obj, line, ttl, self.method, self.raw_policy, flow_id)
+                ev["target"] = dest
+                if obj is None:
+                    ev["raw"] = self.raw_policy.error(None, out)
+                if not fut.done():
+                    fut.set_result(ev)
+            if METRICS.enabled:
+                METRICS.observe("parse", perf_counter() - t0)
+        except Exception as e:
+            for _, fut in reqs:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    async def _run(self, argv: list[str]) -> bytes:
+        self.spawns += 1
+        t0 = perf_counter() if METRICS.enabled else 0.0
+        proc = await asyncio.create_subprocess_exec(
+            *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        out, _ = await proc.communicate()
+        if METRICS.enabled:
+            METRICS.observe("scamper_run", perf_counter() - t0)
+        return out
+
+    # -------------------------------
+    # Multi-TTL batches (one target each, not swept)
+    # -------------------------------
+    async def probe_batch(self, dest: str, requests: list[tuple[int, int]],
+                          wait_s: Optional[float] = None) -> list[ProbeEvent]:
+        runs = batch_runs(requests)
+        outs = await asyncio.gather(*(self._run_batch(dest, first, last, attempts, flow_id, wait_s)
+                                      for first, last, attempts, flow_id, _members in runs))
+        events: list = [None] * len(requests)
+        for (_first, _last, _attempts, _flow, members), out in zip(runs, outs):
+            obj, line = first_trace(out)
+            raw = self.raw_policy.error(None, out) if obj is None else None
+            for i, ev in zip(members, batch_events(obj, line, [requests[i] for i in members],
+                                                   self.method, self.raw_policy)):
+                ev["target"] = ev.get("target") or dest
+                if raw is not None:
+                    ev["raw"] = raw
+                events[i] = ev
+        return events
+
+    async def _run_batch(self, dest: str, first: int, last: int, attempts: int, flow_id: int,
+                         wait_s: Optional[float]) -> bytes:
+        tpl = trace_template(self.method, first, attempts, last, wait_s, flow_id)
+        try:
+            return await self._run([*self.scamper_cmd, "-O", "json", "-i", dest, "-c", tpl])
+        except Exception as e:
+            return f"exception: {e}".encode()
+
+    def stats(self) -> dict:
+        return {"rounds": self.rounds, "spawns": self.spawns, "probes": self.probes,
+                "probes_per_spawn": round(self.probes / self.spawns, 2) if self.spawns else None}
+
+    async def close(self) -> None:
+        self._flush()
+        if self._rounds:
+            await asyncio.gather(*self._rounds, return_exceptions=True)
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
@@ -0,0 +1,273 @@
+# cli/run_batch.py
+# Usage examples:
+#   python3 -m cli.run_batch targets.txt
+#   python3 -m cli.run_batch targets.txt --in-flight 256 --pps 500 --backend ctl
+#   python3 -m cli.run_batch - < targets.txt
+#   python3 -m cli.run_batch targets.txt --workers 8      # one process (and prober) per core
+#   python3 -m cli.run_batch targets.txt --backend sweep --in-flight 2000   # one scamper per round
+#   python3 -m cli.run_batch targets.txt --out results/run.jsonl --compress gzip --rotate-mb 256
+#   python3 -m cli.run_batch targets.txt --batch-budget 50000 --batch-grant 30   # one shared budget
+#   python3 -m cli.run_batch targets.txt --metrics-prom metrics.prom --metrics-jsonl metrics.jsonl
+#   python3 -m cli.run_batch targets.txt --journal run.journal --out run.jsonl   # rerun to resume
+#   python3 -m cli.run_batch targets.txt --prior yesterday.jsonl.gz --retrace-sample 0.5
+#
+#   python3 -m cli.run_batch prefixes.csv.gz --per-prefix 24 --shuffle
+#
+# Streams destinations from a plain / CSV / JSONL (optionally gzip) file, one
+# address per /--per-prefix for CIDR entries, deduplicated. Prints one compact
+# JSON result per line as traces finish (in input order with --workers); a run
+# summary goes to stderr.
+
+import argparse
+import asyncio
+import json
+import functools
+import sys
+
+from app.batch.runner import AsyncBatchRunner
+from app.batch.journal import Journal
+from app.batch.shard import run_sharded
+from app.brain.retrace import load_priors
+from app.config import Settings
+from app.io.readers import iter_targets
+from app.io.writers import JsonlWriter, iter_written, rewind_written
+from app.logging import METRICS, JsonlSnapshots
+
+
+def read_targets(args):
+    return iter_targets(args.targets, fmt=args.format, per_prefix=args.per_prefix,
+                        shuffle=args.shuffle, seed=args.seed, dedup=args.dedup)
+
+
+def build_prober(args):
+    if args.backend == "ctl":
+        from app.prober.aio import ExecutorProber
+        from app.prober.scamper_ctl import ScamperCtlProber
+        return ExecutorProber(
+            ScamperCtlProber(use_sudo=args.use_sudo, method=args.method,
+                             raw_retention=args.raw_retention),
+            max_workers=args.in_flight,
+        )
+    if args.backend == "sweep":
+        from app.prober.sweep import SweepProber
+        return SweepProber(use_sudo=args.use_sudo, method=args.method, raw_retention=args.raw_retention,
+                           round_size=args.sweep_round or args.in_flight,
+                           linger_s=args.sweep_linger_ms / 1000.0)
+    from app.prober.aio import AsyncScamperProber
+    return AsyncScamperProber(use_sudo=args.use_sudo, method=args.method, raw_retention=args.raw_retention)
+
+
+def build_settings(args) -> Settings:
+    return Settings(
+        method=args.method,
+        max_ttl=args.max_ttl,
+        per_hop_budget=args.per_hop_budget,
+        repeats_needed=args.repeats_needed,
+        total_budget=args.total_budget,
+        flow_ids=tuple(args.flow_ids),
+        use_sudo=args.use_sudo,
+        hop_cache=args.hop_cache,
+        strategy=args.strategy,
+        mda_alpha=args.mda_alpha,
+        raw_retention=args.raw_retention,
+        pace_ms=args.pace_ms,
+        pps=args.pps,
+        pace_burst=args.pace_burst,
+        adaptive_wait=args.adaptive_wait,
+        gap_limit=args.gap_limit,
+        ratelimit=args.ratelimit,
+        distance_probe=args.distance_probe,
+        batch_budget=args.batch_budget,
+        batch_grant=args.batch_grant,
+        window_ttls=args.window,
+        retrace_sample=args.retrace_sample,
+        metrics=args.metrics or bool(args.metrics_prom or args.metrics_jsonl),
+    )
+
+
+def check_args(ap, args) -> None:
+    """Refuse option combinations the runner would reject (or silently not honour)."""
+    if args.window > 1 and args.strategy != "forward":
+        ap.error(f"--window traces with --strategy forward only, not {args.strategy}")
+
+
+def open_journal(args):
+    if not args.journal:
+        return None
+    # results are kept in the journal only to rebuild a file --out after a crash
+    return Journal(args.journal, snapshots=args.journal_snapshots, fsync_every=args.journal_fsync,
+                   store_results=args.out != "-")
+
+
+def rewind_output(args, journal) -> None:
+    """Cut a file --out back to where the journal's checkpoint found it (before the writer opens it)."""
+    if journal is not None and args.out != "-" and journal.output_mark is not None:
+        rewind_written(args.out, args.compress, journal.output_mark)
+
+
+def recover_output(args, journal, writer) -> int:
+    """
+    Write again the results journaled past the checkpoint, which a crash may have
+    kept out of --out (it lags the journal), then checkpoint with the output's new
+    end. Only the journal tail is read; --out only without a checkpoint mark.
+    """
+    if journal is None or args.out == "-":
+        return 0
+    written = iter_written(args.out, args.compress) if journal.output_mark is None else None
+    n = 0
+    for res in journal.unwritten(written):
+        writer.write(res)
+        n += 1
+    journal.mark_output = writer.mark
+    journal.checkpoint()
+    return n
+
+
+def load_prior_results(args):
+    return load_priors(args.prior) if args.prior else None
+
+
+async def run_batch(args, emit, journal=None, priors=None) -> dict:
+    prober = build_prober(args)
+    runner = AsyncBatchRunner(prober, build_settings(args), in_flight=args.in_flight,
+                              pps=args.pps or None, on_result=emit, journal=journal, priors=priors)
+    try:
+        await runner.run(read_targets(args), collect=False)
+    finally:
+        await prober.close()
+    if hasattr(prober, "stats"):
+        runner.stats["prober"] = prober.stats()
+    return runner.stats
+
+
+def run_batch_sharded(args, emit, journal=None, priors=None) -> dict:
+    return run_sharded(
+        read_targets(args),
+        build_settings(args),
+        functools.partial(build_prober, args),
+        workers=args.workers,
+        in_flight=args.in_flight,
+        pps=args.pps or None,
+        on_result=emit,
+        journal=journal,
+        priors=priors,
+    )
+
+
+def build_argparser():
+    ap = argparse.ArgumentParser(description="Budget-aware traceroute over a target list (asyncio)")
+    ap.add_argument("targets", help="Target file: plain, .csv or .jsonl, optionally .gz ('-' for stdin)")
+    ap.add_argument("--format", default=None, choices=["plain", "csv", "jsonl"],
+                    help="Target file format (default: from the file name)")
+    ap.add_argument("--per-prefix", type=int, default=24, help="CIDR entries: one address per /N block")
+    ap.add_argument("--shuffle", action="store_true", help="Visit CIDR blocks in seeded random order")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no-dedup", dest="dedup", action="store_false", help="Keep repeated targets")
+    ap.add_argument("--in-flight", type=int, default=64, help="Targets traced concurrently (per worker)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Worker processes; targets are sharded by hash (1 = single process)")
+    ap.add_argument("--pps", type=float, default=0, help="Global probes-per-second limit (0 = unlimited)")
+    ap.add_argument("--pace-ms", type=int, default=0,
+                    help="Min spacing of probes to any one target in milliseconds (0 = none)")
+    ap.add_argument("--pace-burst", type=int, default=1, help="Probes the pacing buckets let through back to back")
+    ap.add_argument("--backend", default="exec", choices=["exec", "ctl", "sweep"],
+                    help="exec: async scamper process per probe; ctl: one persistent scamper; "
+                         "sweep: one scamper per round of probes across targets")
+    ap.add_argument("--sweep-round", type=int, default=0,
+                    help="sweep backend: most probes per round (0 = --in-flight)")
+    ap.add_argument("--sweep-linger-ms", type=float, default=5.0,
+                    help="sweep backend: how long a round waits for more probes to join")
+    ap.add_argument("--hop-cache", action="store_true",
+                    help="Share near-side hops (TTL <= 6) across targets instead of re-probing them")
+    ap.add_argument("--gap-limit", type=int, default=0,
+                    help="Stop after this many consecutive dark hops (0 = probe on to --max-ttl)")
+    ap.add_argument("--ratelimit", action="store_true",
+                    help="Detect ICMP rate-limiting routers and space probes to them instead of calling them dark")
+    ap.add_argument("--distance-probe", action="store_true",
+                    help="Probe at --max-ttl first and trim it to the destination's estimated distance")
+    ap.add_argument("--adaptive-wait", action="store_true",
+                    help="Derive each probe's reply timeout (scamper -w) from observed RTTs")
+    ap.add_argument("--out", default="-", help="JSONL output path ('-' = stdout)")
+    ap.add_argument("--compress", default=None, choices=["gzip", "bz2", "xz", "zstd"],
+                    help="Compress output files (zstd needs Python 3.14+)")
+    ap.add_argument("--rotate-mb", type=float, default=0, help="Start a new output file after this many MB")
+    ap.add_argument("--rotate-s", type=float, default=0, help="Start a new output file after this many seconds")
+    ap.add_argument("--raw-retention", default="none", choices=["none", "errors", "sampled", "full"],
+                    help="Which scamper payloads probers keep (results never include them)")
+    ap.add_argument("--strategy", default="forward", choices=["forward", "doubletree", "multipath"],
+                    help="forward: walk up from TTL 1; doubletree: start mid-path, stop on the shared stop set; "
+                         "multipath: enumerate ECMP interfaces per hop (MDA-lite)")
+    ap.add_argument("--mda-alpha", type=float, default=0.05,
+                    help="multipath: accept a hop's interface set at confidence 1 - alpha")
+    ap.add_argument("--method", default="udp-paris", choices=["udp-paris", "icmp-paris", "tcp"])
+    ap.add_argument("--max-ttl", type=int, default=32)
+    ap.add_argument("--per-hop-budget", type=int, default=6)
+    ap.add_argument("--repeats-needed", type=int, default=3)
+    ap.add_argument("--total-budget", type=int, default=120)
+    ap.add_argument("--window", type=int, default=1,
+                    help="TTLs of one target probed concurrently (1 = hop by hop)")
+    ap.add_argument("--batch-budget", type=int, default=0,
+                    help="One probe budget shared by every target (0 = --total-budget per target)")
+    ap.add_argument("--batch-grant", type=int, default=0,
+                    help="With --batch-budget: initial probes per target (0 = a fair share, "
+                         "at most --total-budget)")
+    ap.add_argument("--prior", metavar="PATH", action="append",
+                    help="Results of an earlier run (JSONL, .gz ok; repeatable): verify those paths "
+                         "with one probe per hop instead of tracing cold (hop by hop, even with --window)")
+    ap.add_argument("--retrace-sample", type=float, default=1.0,
+                    help="With --prior, fraction of known hops to verify (the rest are taken as before)")
+    ap.add_argument("--journal", metavar="PATH",
+                    help="Journal finished targets here; rerunning with the same journal and input resumes "
+                         "(and rewrites results a crash kept out of a file --out)")
+    ap.add_argument("--journal-snapshots", action="store_true",
+                    help="Also journal each trace's state after every hop, so interrupted traces resume mid-path")
+    ap.add_argument("--journal-fsync", type=int, default=64, help="fsync the journal every this many records")
+    ap.add_argument("--metrics", action="store_true",
+                    help="Time probe phases and count events; totals go into the stats line")
+    ap.add_argument("--metrics-prom", metavar="PATH",
+                    help="Write the metrics as Prometheus text when the run ends (single process)")
+    ap.add_argument("--metrics-jsonl", metavar="PATH",
+                    help="Append a metrics snapshot every --metrics-interval seconds (single process)")
+    ap.add_argument("--metrics-interval", type=float, default=10.0)
+    ap.add_argument("--flow-ids", type=int, nargs="+", default=[0, 1])
+    ap.add_argument("--use-sudo", action="store_true", default=True)
+    ap.add_argument("--no-sudo", dest="use_sudo", action="store_false")
+    return ap
+
+
+if __name__ == "__main__":
+    ap = build_argparser()
+    args = ap.parse_args()
+    check_args(ap, args)
+    journal = open_journal(args)
+    priors = load_prior_results(args)
+    rewind_output(args, journal)
+    writer = JsonlWriter(args.out, compress=args.compress,
+                         rotate_bytes=int(args.rotate_mb * 1024 * 1024) or None,
+                         rotate_s=args.rotate_s or None,
+                         append=journal is not None)
+    snapshots = None
+    if args.metrics_jsonl:
+        METRICS.enable()
+        snapshots = JsonlSnapshots(args.metrics_jsonl, args.metrics_interval).start()
+    try:
+        recovered = recover_output(args, journal, writer)
+        if args.workers > 1:
+            stats = run_batch_sharded(args, writer.write, journal, priors)
+        else:
+            stats = asyncio.run(run_batch(args, writer.write, journal, priors))
+    finally:
+        try:
+            if journal is not None:
+                journal.close()  # its last checkpoint marks the output, so before the writer
+        finally:
+            writer.close()
+            if snapshots is not None:
+                snapshots.stop()
+    if args.metrics_prom:
+        with open(args.metrics_prom, "w", encoding="utf-8") as fh:
+            fh.write(METRICS.prometheus())
+    stats["output"] = writer.stats()
+    if journal is not None:
+        stats["output"]["recovered"] = recovered
+    print(json.dumps(stats), file=sys.stderr)
@@ -0,0 +1,224 @@
+# tests/test_batch.py
+import asyncio
+import functools
+import time
+
+import pytest
+
+from app.batch.runner import AsyncBatchRunner
+from app.batch.shard import run_sharded, shard_of
+from app.config import Settings
+from app.prober.base import AsyncProber
+
+
+class SlowLinePath(AsyncProber):
+    """Every target sits 3 hops away; each probe takes `delay_s` of 'network' time."""
+
+    def __init__(self, delay_s=0.01, hops=3):
+        self.delay_s = delay_s
+        self.hops = hops
+        self.sent = 0
+
+    async def probe_once(self, dest, ttl, flow_id=0):
+        self.sent += 1
+        await asyncio.sleep(self.delay_s)
+        reached = ttl >= self.hops_to(dest)
+        return {"target": dest, "ttl": ttl, "flow_id": flow_id,
+                "status": "dest_reached" if reached else "ttl_exceeded",
+                "hop_ip": dest if reached else f"10.0.0.{ttl}", "rtt_ms": 1.0}
+
+    def hops_to(self, dest):
+        return self.hops
+
+
+def _settings():
+    s = Settings(repeats_needed=1, total_budget=20)
+    s.pace_ms = 0
+    return s
+
+
+def test_async_runner_traces_all_targets():
+    targets = [f"192.0.2.{i}" for i in range(1, 41)]
+    runner = AsyncBatchRunner(SlowLinePath(), _settings(), in_flight=8)
+    results = asyncio.run(runner.run(iter(targets)))
+    assert sorted(r["target"] for r in results) == sorted(targets)
+    assert all(r["stop_reason"] == "dest_reached" for r in results)
+    assert runner.stats["probes"] == 40 * 3
+
+
+def test_async_runner_wall_clock_scales_with_in_flight():
+    prober = SlowLinePath(delay_s=0.02)
+    targets = [f"192.0.2.{i}" for i in range(1, 33)]
+    t0 = time.monotonic()
+    asyncio.run(AsyncBatchRunner(prober, _settings(), in_flight=32).run(targets))
+    elapsed = time.monotonic() - t0
+    # serial would be 32 targets * 3 probes * 20ms ~= 1.9s
+    assert elapsed < 0.5
+
+
+def test_async_runner_respects_global_pps():
+    prober = SlowLinePath(delay_s=0)
+    runner = AsyncBatchRunner(prober, _settings(), in_flight=16, pps=200)
+    t0 = time.monotonic()
+    asyncio.run(runner.run([f"192.0.2.{i}" for i in range(1, 11)]))
+    # 30 probes at 200/s need at least ~0.145s
+    assert time.monotonic() - t0 >= 0.14
+
+
+def test_shard_of_is_stable_and_spread():
+    targets = [f"198.51.100.{i}" for i in range(200)]
+    first = [shard_of(t, 4) for t in targets]
+    assert first == [shard_of(t, 4) for t in targets]
+    assert set(first) == {0, 1, 2, 3}
+
+
+def test_run_sharded_merges_in_input_order():
+    targets = [f"192.0.2.{i}" for i in range(1, 25)]
+    out = []
+    stats = run_sharded(targets, _settings(), functools.partial(SlowLinePath, 0.001),
+                        workers=3, in_flight=4, on_result=out.append)
+    assert [r["target"] for r in out] == targets
+    assert stats["targets"] == len(targets)
+    assert stats["probes"] == 3 * len(targets)
+    by_shard = {st["shard"]: st["targets"] for st in stats["shards"]}
+    for k in range(3):
+        assert by_shard[k] == sum(1 for t in targets if shard_of(t, 3) == k)
+
+
+class _PathsByTarget(SlowLinePath):
+    def __init__(self, hops_by_target, delay_s=0):
+        super().__init__(delay_s=delay_s)
+        self.hops_by_target = hops_by_target
+
+    def hops_to(self, dest):
+        return self.hops_by_target[dest]
+
+
+def test_batch_budget_moves_unspent_credits_to_hard_targets():
+    paths = {"192.0.2.1": 3, "192.0.2.2": 3, "192.0.2.3": 3, "192.0.2.4": 12}
+
+    s = _settings()
+    s.total_budget = 8
+    alone = asyncio.run(AsyncBatchRunner(_PathsByTarget(paths), s, in_flight=1).run(list(paths)))
+    assert alone[-1]["stop_reason"] != "dest_reached"
+
+    s.batch_budget = 32  # the same 8 probes per target, pooled
+    runner = AsyncBatchRunner(_PathsByTarget(paths), s, in_flight=1)
+    results = asyncio.run(runner.run(list(paths)))
+    assert all(r["stop_reason"] == "dest_reached" for r in results)
+    assert [r["grant"]["returned"] for r in results[:3]] == [5, 5, 5]
+    assert results[-1]["grant"]["extra"] > 0
+    budget = runner.stats["budget"]
+    assert budget["spent"] == runner.stats["probes"] == 21 <= 32
+    assert budget["pool"] == 32 - 21
+
+
+def test_sharded_batch_budget_moves_unspent_credits_to_hard_targets():
+    # shard_of(., 2): .3 and .5 on one worker, .1 and .2 on the other
+    paths = {"192.0.2.1": 3, "192.0.2.2": 3, "192.0.2.3": 3, "192.0.2.5": 12}
+    s = _settings()
+    s.total_budget = 40   # a greedy first grant would take a worker's whole share
+    s.batch_budget = 32   # 16 per worker: 8 per target, pooled
+    results = []
+    stats = run_sharded(list(paths), s, functools.partial(_PathsByTarget, paths, 0.005),
+                        workers=2, in_flight=2, on_result=results.append)
+    assert all(r["stop_reason"] == "dest_reached" for r in results)
+    assert [r["grant"]["initial"] for r in results] == [8] * 4
+    assert [r["grant"]["returned"] for r in results[:3]] == [5, 5, 5]
+    assert results[-1]["grant"]["extra"] > 0
+    assert stats["budget"]["starved"] == 0
+    assert stats["budget"]["spent"] == stats["probes"] == 21
+
+
+def test_batch_budget_credits_go_back_once_however_often_results_are_built():
+    s = _settings()
+    s.total_budget = 8
+    s.batch_budget = 16
+    runner = AsyncBatchRunner(SlowLinePath(delay_s=0), s, in_flight=1)
+    sess = runner.ctrl.session("192.0.2.1")
+
+    async def drive():
+        while (probe := sess.next_probe()) is not None:
+            sess.feed(*probe, await runner.prober.probe_once("192.0.2.1", *probe))
+
+    asyncio.run(drive())
+    first = sess.result()
+    assert first["stop_reason"] == "dest_reached"
+    assert first["grant"]["returned"] == first["credits_unspent"] == 8 - 3
+    assert sess.result() == first
+    assert runner.allocator.pool == 16 - 3
+
+
+def test_batch_budget_grants_fair_shares_and_reports_starved_traces():
+    targets = [f"192.0.2.{i}" for i in range(1, 9)]
+    s = _settings()
+    s.per_hop_budget = 3  # the smallest grant worth starting a trace on
+    s.batch_budget = 24   # 3 probes per target, every trace asks up front
+    results = asyncio.run(AsyncBatchRunner(SlowLinePath(delay_s=0), s, in_flight=8).run(targets))
+    assert [r["grant"]["initial"] for r in results] == [3] * 8
+    assert all(r["stop_reason"] == "dest_reached" for r in results)
+
+    s.batch_budget = 20   # short of it: the last traces are not started on scraps
+    runner = AsyncBatchRunner(SlowLinePath(delay_s=0), s, in_flight=8)
+    results = asyncio.run(runner.run(targets))
+    starved = [r for r in results if r["probes_used"] == 0]
+    assert len(starved) == runner.stats["budget"]["starved"] == 2
+    assert all(r["stop_reason"] == "budget_exhausted" for r in starved)
+    assert sum(r["stop_reason"] == "dest_reached" for r in results) == 6
+
+
+def test_windowed_trace_cuts_latency():
+    s = _settings()
+    prober = SlowLinePath(delay_s=0.02, hops=8)
+    t0 = time.monotonic()
+    seq = asyncio.run(AsyncBatchRunner(prober, s).trace("192.0.2.1"))
+    seq_s = time.monotonic() - t0
+
+    s.window_ttls = 4
+    prober = SlowLinePath(delay_s=0.02, hops=8)
+    t0 = time.monotonic()
+    win = asyncio.run(AsyncBatchRunner(prober, s).trace("192.0.2.1"))
+    assert time.monotonic() - t0 < seq_s / 2
+    assert win["path"] == seq["path"]
+    assert win["stop_reason"] == "dest_reached"
+    assert win["probes_used"] == prober.sent
+
+
+def test_windowed_trace_refunds_probes_past_destination():
+    s = _settings()
+    s.window_ttls = 6
+    s.pace_ms = 15  # later TTLs are still queued on the pacer when the destination answers
+    s.pace_jitter_ms = 0
+    prober = SlowLinePath(delay_s=0, hops=2)
+    res = asyncio.run(AsyncBatchRunner(prober, s).trace("192.0.2.1"))
+    assert res["stop_reason"] == "dest_reached"
+    assert res["window"]["refunded"] > 0
+    assert res["probes_used"] == prober.sent
+    assert res["credits_unspent"] == s.total_budget - prober.sent
+
+
+def test_windowed_runner_refuses_other_strategies():
+    s = _settings()
+    s.window_ttls = 4
+    s.strategy = "doubletree"
+    with pytest.raises(ValueError, match="forward strategy only"):
+        AsyncBatchRunner(SlowLinePath(delay_s=0), s)
+    with pytest.raises(ValueError, match="forward strategy only"):
+        run_sharded(["192.0.2.1"], s, functools.partial(SlowLinePath, 0.0), workers=2)
+
+
+def test_windowed_runner_retraces_targets_with_a_prior_hop_by_hop():
+    s = _settings()
+    s.repeats_needed = 2
+    s.window_ttls = 4
+    cold = asyncio.run(AsyncBatchRunner(SlowLinePath(delay_s=0, hops=6), s).trace("192.0.2.1"))
+    assert "retrace" not in cold
+
+    prober = SlowLinePath(delay_s=0, hops=6)
+    runner = AsyncBatchRunner(prober, s, priors={"192.0.2.1": cold})
+    results = {r["target"]: r for r in asyncio.run(runner.run(["192.0.2.1", "192.0.2.2"]))}
+    again, other = results["192.0.2.1"], results["192.0.2.2"]
+    assert again["retrace"]["verified"] == 6 and not again["retrace"]["changed"]
+    assert again["path"] == cold["path"]
+    assert again["probes_used"] == 6 < cold["probes_used"]
+    assert "retrace" not in other and "window" in other  # no prior: windowed as before
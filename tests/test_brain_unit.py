@@ -1,7 +1,10 @@
 # tests/test_brain_unit.py
+import time
+
 import pytest
 
 from app.brain.controller import BudgetController
+from app.brain.hopcache import HopCache
 from app.config import Settings
 from app.prober.fake import FakeProber
 
@@ -65,3 +68,353 @@ def test_budgetcontroller_budget_exceeded():
     ctrl.remaining_budget = 0
     with pytest.raises(Exception):
         ctrl.run("8.8.8.8")
+
+
+def _linear_script(dest, hops, repeats=3, flows=(0, 1)):
+    """Every flow sees 10.0.0.<ttl> `repeats` times; dest answers at TTL `hops`."""
+    script = {}
+    for ttl in range(1, hops + 1):
+        for flow in flows:
+            ip = dest if ttl == hops else f"10.0.0.{ttl}"
+            status = "dest_reached" if ttl == hops else "ttl_exceeded"
+            script[(ttl, flow)] = [{
+                "target": dest, "ttl": ttl, "flow_id": flow, "protocol": "udp-paris",
+                "status": status, "hop_ip": ip, "rtt_ms": 1.0, "timestamp": None, "raw": {}
+            } for _ in range(repeats)]
+    return script
+
+
+class _CountingFake(FakeProber):
+    def __init__(self, script):
+        super().__init__(script)
+        self.batches = 0
+        self.sent = 0
+
+    def probe_batch(self, dest, requests):
+        self.batches += 1
+        self.sent += len(requests)
+        return super().probe_batch(dest, requests)
+
+
+def test_run_batched_matches_sequential_path():
+    s = Settings(total_budget=60, per_hop_budget=4, repeats_needed=2)
+    s.pace_ms = 0
+    seq = BudgetController(FakeProber(_linear_script("8.8.8.8", 6)), s)
+    expected = seq.run("8.8.8.8")
+
+    fake = _CountingFake(_linear_script("8.8.8.8", 6))
+    s.batch_ttls = 3
+    res = BudgetController(fake, s).run_batched("8.8.8.8")
+
+    assert res["path"] == expected["path"]
+    assert res["stop_reason"] == "dest_reached"
+    # every planned probe goes out (and is charged), the ones past the destination too
+    assert res["probes_used"] == fake.sent
+    assert fake.batches <= 3
+
+
+def test_run_batched_respects_total_budget():
+    s = Settings(total_budget=7, per_hop_budget=3, repeats_needed=2, batch_ttls=4)
+    res = BudgetController(FakeProber(script={}), s).run_batched("8.8.8.8")
+    assert res["probes_used"] == 7
+    assert all(v["final"] in (None, "∅") for v in res["per_ttl"].values())
+
+
+def test_hop_cache_expiry_and_bound():
+    now = [0.0]
+    cache = HopCache(max_entries=2, ttl_s=10, clock=lambda: now[0])
+    cache.put("v", 1, 0, "10.0.0.1")
+    cache.put("v", 2, 0, "10.0.0.2")
+    cache.put("v", 3, 0, "10.0.0.3")
+    assert cache.get("v", 1, 0) is None          # evicted (LRU)
+    assert cache.get("v", 3, 0) == "10.0.0.3"
+    now[0] = 11
+    assert cache.get("v", 3, 0) is None          # expired
+    assert cache.stats()["evictions"] == 1
+
+
+def test_hop_cache_skips_shared_near_side():
+    s = Settings(total_budget=60, per_hop_budget=4, repeats_needed=3, flow_ids=(0,), hop_cache=True)
+    s.pace_ms = 0
+    ctrl = BudgetController(None, s)
+
+    ctrl.prober = FakeProber(_linear_script("8.8.8.8", 8, repeats=3, flows=(0,)))
+    cold = ctrl.run("8.8.8.8")
+    ctrl.prober = FakeProber(_linear_script("8.8.4.4", 8, repeats=3, flows=(0,)))
+    warm = ctrl.run("8.8.4.4")
+
+    assert warm["path"] == {**cold["path"], 8: "8.8.4.4"}
+    # TTLs 1..6 confirmed with one probe each instead of three
+    assert warm["hop_cache"] == {"hits": 6, "probes_saved": 12}
+    assert warm["probes_used"] == cold["probes_used"] - 12
+
+
+class _TreeProber(FakeProber):
+    """Every destination is `hops` away behind the same routers 10.0.0.<ttl>."""
+
+    def __init__(self, hops):
+        super().__init__()
+        self.hops = hops
+
+    def probe_once(self, dest, ttl, flow_id=0):
+        reached = ttl >= self.hops
+        return {"target": dest, "ttl": ttl, "flow_id": flow_id,
+                "status": "dest_reached" if reached else "ttl_exceeded",
+                "hop_ip": dest if reached else f"10.0.0.{ttl}", "rtt_ms": 1.0}
+
+
+def test_doubletree_backward_stops_on_stop_set():
+    s = Settings(total_budget=80, repeats_needed=2, flow_ids=(0,), strategy="doubletree",
+                 doubletree_start_ttl=5)
+    s.pace_ms = 0
+    ctrl = BudgetController(_TreeProber(hops=8), s)
+
+    first = ctrl.run("192.0.2.10")
+    assert first["path"] == {**{k: f"10.0.0.{k}" for k in range(1, 8)}, 8: "192.0.2.10"}
+    assert first["stop_reason"] == "dest_reached"
+    assert first["backward_stop_ttl"] is None
+
+    # same /24: backward walk stops at the first already-known interface
+    second = ctrl.run("192.0.2.20")
+    assert second["start_ttl"] == 4  # half the mean distance seen so far
+    assert second["backward_stop_ttl"] == 3
+    assert second["probes_used"] < first["probes_used"]
+    assert second["baseline_probes_est"] == second["probes_used"] + 2 * 2
+    # the skipped near side comes from the first trace, and reaching the
+    # destination is still what stopped it
+    assert second["skipped_ttls"] == [1, 2]
+    assert second["path"] == {**{k: f"10.0.0.{k}" for k in range(1, 8)}, 8: "192.0.2.20"}
+    assert second["stop_reason"] == "dest_reached"
+
+    # different /24: no stop-set hits, full backward walk
+    third = ctrl.run("198.51.100.1")
+    assert third["backward_stop_ttl"] is None
+    assert len(third["path"]) == 8
+
+
+def test_doubletree_start_past_destination():
+    s = Settings(total_budget=80, repeats_needed=1, flow_ids=(0,), strategy="doubletree",
+                 doubletree_start_ttl=6)
+    s.pace_ms = 0
+    res = BudgetController(_TreeProber(hops=3), s).run("192.0.2.10")
+    assert res["path"] == {1: "10.0.0.1", 2: "10.0.0.2", 3: "192.0.2.10"}
+    assert res["stop_reason"] == "dest_reached"
+
+
+class _ShyDestProber(_TreeProber):
+    """The destination only answers probes whose TTL runs out right at it."""
+
+    def probe_once(self, dest, ttl, flow_id=0):
+        if ttl > self.hops:
+            return {"target": dest, "ttl": ttl, "flow_id": flow_id, "status": "timeout", "hop_ip": None}
+        return super().probe_once(dest, ttl, flow_id)
+
+
+def test_doubletree_backward_reaching_destination_keeps_that_stop_reason():
+    s = Settings(max_ttl=8, total_budget=80, repeats_needed=1, flow_ids=(0,), strategy="doubletree",
+                 doubletree_start_ttl=6)
+    s.pace_ms = 0
+    res = BudgetController(_ShyDestProber(hops=4), s).run("192.0.2.10")
+    assert res["path"][4] == "192.0.2.10"
+    assert res["stop_reason"] == "dest_reached"
+
+
+def test_state_is_lazy_and_sparse_result():
+    s = Settings(total_budget=60, per_hop_budget=4, repeats_needed=2, result_format="sparse")
+    s.pace_ms = 0
+    ctrl = BudgetController(FakeProber(_linear_script("8.8.8.8", 4)), s)
+    sess = ctrl.session("8.8.8.8")
+    assert len(sess.run.per_ttl) == 0
+    while (probe := sess.next_probe()) is not None:
+        sess.feed(*probe, ctrl.prober.probe_once("8.8.8.8", *probe))
+    assert sorted(sess.run.per_ttl) == [1, 2, 3, 4]
+    res = sess.result()
+    assert sorted(res["per_ttl"]) == [1, 2, 3, 4]
+    assert res["per_ttl"][2]["counts"] == {"10.0.0.2": 2}
+
+    s.result_format = "full"
+    assert sorted(ctrl._result("8.8.8.8", sess.run)["per_ttl"]) == list(range(1, 33))
+
+
+def test_results_carry_raw_only_in_debug():
+    script = _linear_script("8.8.8.8", 2, repeats=2, flows=(0,))
+    for evs in script.values():
+        for ev in evs:
+            ev["raw"] = {"hops": [1, 2, 3]}
+    s = Settings(repeats_needed=2, flow_ids=(0,), result_format="sparse")
+    s.pace_ms = 0
+    res = BudgetController(FakeProber(script), s).run("8.8.8.8")
+    assert "raw" not in res["per_ttl"][1]
+
+    s.debug = True
+    res = BudgetController(FakeProber(script), s).run("8.8.8.8")
+    assert res["per_ttl"][1]["raw"] == [{"hops": [1, 2, 3]}] * 2
+
+
+class _WaitRecorder(FakeProber):
+    def __init__(self, script):
+        super().__init__(script)
+        self.waits = []
+
+    def probe_once(self, dest, ttl, flow_id=0, wait_s=None):
+        self.waits.append(wait_s)
+        return super().probe_once(dest, ttl, flow_id=flow_id)
+
+
+def test_adaptive_wait_shortens_timeouts_and_seeds_prefix():
+    script = _linear_script("8.8.8.8", 6, repeats=4, flows=(0,))
+    del script[(3, 0)], script[(4, 0)]  # two dark hops
+    s = Settings(repeats_needed=2, per_hop_budget=3, flow_ids=(0,), adaptive_wait=True)
+    s.pace_ms = 0
+    prober = _WaitRecorder(script)
+    ctrl = BudgetController(prober, s)
+    res = ctrl.run("8.8.8.8")
+
+    assert prober.waits[0] is None            # no RTT seen yet: scamper's fixed wait
+    assert set(prober.waits[1:]) == {1.0}     # ~1ms hops: clamped to the 1s floor
+    aw = res["adaptive_wait"]
+    assert aw["timeouts"] == res["per_ttl"][3]["timeouts"] + res["per_ttl"][4]["timeouts"] > 0
+    assert aw["wait_saved_s"] == 4.0 * aw["timeouts"]
+
+    # a later trace into the same /24 starts from that estimate
+    prober.waits.clear()
+    prober.script = _WaitRecorder(_linear_script("8.8.8.9", 2, flows=(0,))).script
+    ctrl.run("8.8.8.9")
+    assert prober.waits[0] == 1.0
+    assert "adaptive_wait" not in BudgetController(FakeProber({}), Settings(max_ttl=1)).run("8.8.8.8")
+
+
+def test_gap_limit_stops_on_silent_tail():
+    script = _linear_script("8.8.8.8", 3, flows=(0,))
+    del script[(3, 0)]  # the destination never answers
+    s = Settings(repeats_needed=2, per_hop_budget=3, flow_ids=(0,), gap_limit=3, total_budget=120)
+    s.pace_ms = 0
+    res = BudgetController(FakeProber(script), s).run("8.8.8.8")
+    assert res["stop_reason"] == "gap_limit"
+    assert [res["path"][k] for k in (3, 4, 5)] == ["∅"] * 3
+    assert 6 not in res["path"]
+    assert res["credits_unspent"] == 120 - res["probes_used"] > 0
+
+    batched = BudgetController(FakeProber(_linear_script("8.8.8.8", 3, flows=(0,))), s)
+    del batched.prober.script[(3, 0)]
+    assert batched.run_batched("8.8.8.8")["stop_reason"] == "gap_limit"
+
+
+def test_distance_probe_trims_max_ttl():
+    script = _linear_script("8.8.8.8", 4, repeats=2, flows=(0,))
+    # reply to the TTL-32 distance probe: initial TTL 64, three routers on the way back
+    script[(32, 0)] = [dict(script[(4, 0)][0], ttl=32, reply_ttl=61)]
+    del script[(4, 0)]  # ... but the destination goes quiet afterwards
+    s = Settings(repeats_needed=2, per_hop_budget=3, flow_ids=(0,), distance_probe=True, distance_slack=1)
+    s.pace_ms = 0
+    res = BudgetController(FakeProber(script), s).run("8.8.8.8")
+    assert res["dest_distance_est"] == 4
+    assert res["stop_reason"] == "max_ttl"
+    assert max(k for k, v in res["per_ttl"].items() if v["attempts"]) == 5
+
+
+def test_run_windowed_matches_sequential_path():
+    s = Settings(total_budget=60, per_hop_budget=4, repeats_needed=2, window_ttls=3)
+    s.pace_ms = 0
+    seq = BudgetController(FakeProber(_linear_script("8.8.8.8", 6)), s).run("8.8.8.8")
+    win = BudgetController(FakeProber(_linear_script("8.8.8.8", 6)), s).run_windowed("8.8.8.8")
+    assert win["path"] == seq["path"]
+    assert win["stop_reason"] == "dest_reached"
+    assert win["window"]["size"] == 3
+    assert win["probes_used"] <= seq["probes_used"] + 2 * 3  # at most a window of overshoot
+
+
+class _SlowPastDest(FakeProber):
+    """Probes past TTL `hops` take `delay_s` to time out; tracks how many are running."""
+
+    def __init__(self, script, hops, delay_s):
+        super().__init__(script)
+        self.hops = hops
+        self.delay_s = delay_s
+        self.running = 0
+
+    def probe_once(self, dest, ttl, flow_id=0, wait_s=None):
+        if ttl <= self.hops:
+            return super().probe_once(dest, ttl, flow_id, wait_s)
+        self.running += 1
+        time.sleep(self.delay_s)
+        self.running -= 1
+        return super().probe_once(dest, ttl, flow_id, wait_s)
+
+
+def test_run_windowed_waits_for_probes_still_running():
+    s = Settings(total_budget=60, per_hop_budget=4, repeats_needed=1, flow_ids=(0,), window_ttls=4)
+    s.pace_ms = 0
+    fake = _SlowPastDest(_linear_script("8.8.8.8", 2, flows=(0,)), 2, 0.2)
+    res = BudgetController(fake, s).run_windowed("8.8.8.8")
+    assert res["stop_reason"] == "dest_reached"
+    assert fake.running == 0  # nothing left using the prober once run_windowed returns
+
+
+def test_windowed_timeouts_are_charged_their_own_wait():
+    from app.brain.rtt import RttEstimator
+    from app.brain.window import WindowSession
+    s = Settings(per_hop_budget=4, repeats_needed=1, flow_ids=(0,), adaptive_wait=True, window_ttls=2)
+    sess = WindowSession(BudgetController(FakeProber({}), s), "8.8.8.8", 2)
+    sess.run.rtt = RttEstimator(srtt=2000.0)
+    (t1, f1), (t2, f2) = sess.next_probes()
+    assert sess.probe_kw(t1, f1) == {"wait_s": 2.0}
+    sess.run.rtt.srtt = 3000.0  # the estimate moves while the first probe is out
+    assert sess.probe_kw(t2, f2) == {"wait_s": 3.0}
+    for ttl, flow_id in ((t2, f2), (t1, f1)):
+        sess.feed(ttl, flow_id, {"target": "8.8.8.8", "ttl": ttl, "flow_id": flow_id,
+                                 "status": "timeout", "hop_ip": None})
+    assert sess.run.wait_saved_s == pytest.approx((5.0 - 2.0) + (5.0 - 3.0))
+
+
+class _EcmpProber(FakeProber):
+    """hop ttl has `widths[ttl-1]` interfaces, picked per flow (per-flow load balancing)."""
+
+    def __init__(self, dest, widths):
+        super().__init__(script={})
+        self.dest = dest
+        self.widths = widths
+
+    def probe_once(self, dest, ttl, flow_id=0, wait_s=None):
+        if ttl > len(self.widths):
+            return {"status": "dest_reached", "hop_ip": self.dest, "ttl": ttl, "flow_id": flow_id}
+        return {"status": "ttl_exceeded", "hop_ip": f"10.{ttl}.0.{flow_id % self.widths[ttl - 1]}",
+                "ttl": ttl, "flow_id": flow_id}
+
+
+def test_multipath_enumerates_ecmp_interfaces():
+    from app.brain.multipath import mda_stop
+    assert [mda_stop(k, 0.05) for k in (1, 2, 3)] == [6, 11, 16]
+
+    s = Settings(strategy="multipath", total_budget=60, max_ttl=8, pace_ms=0)
+    res = BudgetController(_EcmpProber("192.0.2.7", [1, 2, 3]), s).run("192.0.2.7")
+    hops = res["per_ttl"]
+    assert res["strategy"] == "multipath" and res["stop_reason"] == "dest_reached"
+    # no divergence yet: settled like a forward hop, without the MDA's n_1 probes
+    assert hops[1]["interfaces"] == ["10.1.0.0"] and hops[1]["attempts"] == s.repeats_needed
+    assert hops[2]["interfaces"] == ["10.2.0.0", "10.2.0.1"] and hops[2]["attempts"] == 11
+    assert len(hops[3]["interfaces"]) == 3 and hops[3]["attempts"] == 16
+    assert all(hops[t]["confidence"] >= 0.95 for t in (2, 3))
+    # flows reused from the hop below give the links between adjacent hops
+    assert hops[2]["links"] == [("10.1.0.0", "10.2.0.0"), ("10.1.0.0", "10.2.0.1")]
+    assert len(hops[3]["links"]) == 6
+    # every interface at hop 2 reaches every one at hop 3: a mesh, not parallel paths
+    assert hops[3].get("meshed") and not hops[2].get("meshed")
+    assert res["probes_used"] == s.repeats_needed + 11 + 16 + 1
+
+
+def test_mda_uniformity_and_meshing_tests():
+    from app.brain.multipath import mda_uniform, meshed
+    assert mda_uniform({"a": 6, "b": 5}, 0.05)
+    assert not mda_uniform({"a": 14, "b": 1}, 0.05)
+    # two parallel paths: 1 -> 3 and 2 -> 4
+    assert not meshed({0: "1", 1: "2", 2: "1"}, {0: "3", 1: "4", 2: "3"})
+    assert meshed({0: "1", 1: "2", 2: "1", 3: "2"}, {0: "3", 1: "4", 2: "4", 3: "3"})
+
+
+def test_multipath_is_bounded_by_hop_budget():
+    s = Settings(strategy="multipath", total_budget=60, max_ttl=8, pace_ms=0, mda_hop_budget=4)
+    res = BudgetController(_EcmpProber("192.0.2.7", [1, 4]), s).run("192.0.2.7")
+    hop = res["per_ttl"][2]
+    assert hop["attempts"] == 4 and hop["confidence"] < 0.95
+    assert res["path"][2] in hop["interfaces"]
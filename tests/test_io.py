@@ -0,0 +1,115 @@
+# tests/test_io.py
+import gzip
+import json
+import threading
+
+import pytest
+
+from app.io.readers import BloomFilter, expand_cidr, iter_targets, permute_range
+from app.io.writers import JsonlWriter, iter_written, rewind_written
+
+
+def _result(i):
+    return {"target": f"192.0.2.{i}", "path": {1: "10.0.0.1", 2: "∅"}, "probes_used": i}
+
+
+def test_jsonl_writer_background_gzip(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    with JsonlWriter(path, compress="gzip") as w:
+        for i in range(100):
+            w.write(_result(i))
+    assert w.files == [path + ".gz"]
+    with gzip.open(path + ".gz", "rt", encoding="utf-8") as fh:
+        rows = [json.loads(line) for line in fh]
+    assert [r["probes_used"] for r in rows] == list(range(100))
+    assert rows[0]["path"] == {"1": "10.0.0.1", "2": "∅"}
+
+
+def test_jsonl_writer_rotates_by_size(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    w = JsonlWriter(path, rotate_bytes=2000, buffer_bytes=256, background=False)
+    for i in range(200):
+        w.write(_result(i))
+    w.close()
+    assert len(w.files) > 3
+    rows = []
+    for name in w.files:
+        with open(name, encoding="utf-8") as fh:
+            rows += [json.loads(line) for line in fh]
+    assert [r["probes_used"] for r in rows] == list(range(200))
+    assert w.stats()["records"] == 200
+
+
+def test_jsonl_writer_mark_rewinds_a_crashed_gzip_output(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    w = JsonlWriter(path, compress="gzip")
+    for i in range(10):
+        w.write(_result(i))
+    mark = w.mark()
+    for i in range(10, 500):
+        w.write(_result(i))
+    w.mark()  # on disk, but past the first mark: as if the crash came before the next checkpoint
+    rewind_written(path, "gzip", mark)
+    with JsonlWriter(path, compress="gzip", append=True) as again:
+        again.write(_result(10))
+    assert [r["probes_used"] for r in iter_written(path, "gzip")] == list(range(11))
+
+
+def test_jsonl_writer_does_not_hang_when_its_thread_dies_on_a_full_queue(tmp_path):
+    w = JsonlWriter(str(tmp_path / "out.jsonl"), queue_size=1)
+    taken = threading.Event()
+    release = threading.Event()
+
+    def fail(res):
+        taken.set()
+        release.wait()
+        raise OSError("disk full")
+
+    w._write_now = fail
+    w.write(_result(0))  # the thread takes it and gets stuck on the disk
+    taken.wait()
+    w.write(_result(1))  # fills the queue
+    threading.Timer(0.2, release.set).start()
+    with pytest.raises(RuntimeError, match="thread failed"):
+        w.write(_result(2))  # would wait forever for a slot the dead thread never frees
+    assert w.stats()["full_waits"] > 0
+    with pytest.raises(RuntimeError):
+        w.close()
+
+
+def test_permute_range_is_a_permutation():
+    for n in (1, 5, 256, 1000):
+        out = list(permute_range(n, seed=7))
+        assert sorted(out) == list(range(n))
+    assert list(permute_range(1000, seed=1)) != list(permute_range(1000, seed=2))
+
+
+def test_expand_cidr_one_per_block():
+    assert list(expand_cidr("10.1.0.0/22")) == ["10.1.0.1", "10.1.1.1", "10.1.2.1", "10.1.3.1"]
+    assert list(expand_cidr("10.1.0.0/30", per_prefix=32)) == ["10.1.0.0", "10.1.0.1", "10.1.0.2", "10.1.0.3"]
+    assert sorted(expand_cidr("10.1.0.0/22", shuffle=True, seed=3)) == sorted(expand_cidr("10.1.0.0/22"))
+    assert list(expand_cidr("8.8.8.8")) == ["8.8.8.8"]
+
+
+def test_iter_targets_formats_and_dedup(tmp_path):
+    plain = tmp_path / "t.txt"
+    plain.write_text("# header\n8.8.8.8\n1.1.1.1  # dns\n8.8.8.8\n192.0.2.0/23\n")
+    assert list(iter_targets(str(plain))) == ["8.8.8.8", "1.1.1.1", "192.0.2.1", "192.0.3.1"]
+
+    gz = tmp_path / "t.csv.gz"
+    with gzip.open(gz, "wt") as fh:
+        fh.write("name,target\na,9.9.9.9\nb,9.9.9.9\nc,10.0.0.0/24\n")
+    assert list(iter_targets(str(gz))) == ["9.9.9.9", "10.0.0.1"]
+
+    jl = tmp_path / "t.jsonl"
+    jl.write_text('{"dst": "4.4.4.4"}\n"5.5.5.5"\n')
+    assert list(iter_targets(str(jl))) == ["4.4.4.4", "5.5.5.5"]
+
+
+def test_bloom_filter_no_false_negatives():
+    bf = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f"10.0.{i // 256}.{i % 256}" for i in range(1000)]
+    assert all(bf.add(x) for x in items[:10])
+    for x in items:
+        bf.add(x)
+    assert all(x in bf for x in items)
@@ -0,0 +1,204 @@
+# tests/test_journal.py
+import asyncio
+import functools
+import os
+import signal
+import subprocess
+import sys
+
+from app.batch.journal import Journal
+from app.batch.runner import AsyncBatchRunner
+from app.batch.shard import run_sharded
+from app.brain.controller import BudgetController
+from app.brain.state import restore_run, snapshot_run
+from app.config import Settings
+from app.io.writers import JsonlWriter, iter_written, rewind_written
+from app.prober.sim import SimTopology, SimulatedProber
+from tests.test_batch import SlowLinePath, _settings
+
+
+class _Crash(Exception):
+    pass
+
+
+class _CrashAfter(SlowLinePath):
+    """Line path that dies (like a killed process) after `limit` probes."""
+
+    def __init__(self, limit, hops=6):
+        super().__init__(delay_s=0, hops=hops)
+        self.limit = limit
+
+    async def probe_once(self, dest, ttl, flow_id=0):
+        if self.sent >= self.limit:
+            raise _Crash()
+        return await super().probe_once(dest, ttl, flow_id)
+
+
+def test_snapshot_round_trip_and_resumed_session():
+    s = Settings(pace_ms=0)
+    sim = SimulatedProber(SimTopology(seed=3), seed=3)
+    ctrl = BudgetController(sim, s)
+    dest = "198.18.0.7"
+    full = ctrl.run(dest)
+
+    sess = ctrl.session(dest)
+    while sess.run.ttl < 4:
+        ttl, flow_id = sess.next_probe()
+        sess.feed(ttl, flow_id, sim.probe_once(dest, ttl, flow_id=flow_id, **sess.probe_kw()))
+    snap = snapshot_run(sess.run)
+    assert snapshot_run(restore_run(snap)) == snap
+
+    resumed = ctrl.session(dest, resume=snap)
+    assert resumed.run.probes_used == sess.run.probes_used
+    while (probe := resumed.next_probe()) is not None:
+        ttl, flow_id = probe
+        resumed.feed(ttl, flow_id, sim.probe_once(dest, ttl, flow_id=flow_id, **resumed.probe_kw()))
+    res = resumed.result()
+    # hops closed before the snapshot are kept as they were, the rest is traced afresh
+    assert all(res["path"][t] == sess.result()["path"][t] for t in range(1, 4))
+    assert res["stop_reason"] == full["stop_reason"] == "dest_reached"
+    assert sim.score(dest, res["path"])["accuracy"] >= sim.score(dest, full["path"])["accuracy"] - 0.1
+
+
+def test_journal_recovers_from_checkpoint_and_torn_tail(tmp_path):
+    path = str(tmp_path / "run.journal")
+    j = Journal(path, snapshots=True, store_results=True, checkpoint_every=3, fsync_every=1)
+    for i in (0, 1, 2, 4):
+        j.done(i, f"192.0.2.{i}", {"target": f"192.0.2.{i}"})
+    j.snapshot(3, "192.0.2.3", {"ttl": 2})
+    j._sync()
+    j._fh.close()  # crash: no final checkpoint
+    with open(path, "ab") as fh:
+        fh.write(b'{"t":"done","i":3')  # torn write
+
+    j = Journal(path, store_results=True)
+    assert j.recovered == {"from_checkpoint": True, "tail_records": 2, "done": 4, "partial": 1}
+    assert [r["target"] for r in j.unwritten()] == ["192.0.2.4"]  # only the tail's results
+    assert [j.finished(i) for i in range(6)] == [True, True, True, False, True, False]
+    assert j.resume_state(3) == {"ttl": 2}
+    j.done(3, "192.0.2.3", {"target": "192.0.2.3"})
+    j.close()
+
+    j = Journal(path)
+    assert j.watermark == 5 and j.recovered["tail_records"] == 0
+    assert sorted(r["target"] for r in j.results()) == [f"192.0.2.{i}" for i in range(5)]
+    j.close()
+
+
+def test_runner_resumes_where_the_crash_left_off(tmp_path):
+    targets = [f"192.0.2.{i}" for i in range(1, 9)]
+    path = str(tmp_path / "run.journal")
+
+    journal = Journal(path, snapshots=True)
+    runner = AsyncBatchRunner(_CrashAfter(limit=20), _settings(), in_flight=1, journal=journal)
+    try:
+        asyncio.run(runner.run(targets))
+    except _Crash:
+        pass
+    journal.close()
+    # 20 probes at 6 per trace: three targets done, the fourth stopped at its third hop
+    journal = Journal(path, snapshots=True)
+    assert journal.watermark == 3
+    assert journal.resume_state(3)["ttl"] == 3
+
+    prober = SlowLinePath(delay_s=0, hops=6)
+    runner = AsyncBatchRunner(prober, _settings(), in_flight=4, journal=journal)
+    out = asyncio.run(runner.run(targets))
+    journal.close()
+    assert sorted(r["target"] for r in out) == targets[3:]
+    assert prober.sent == 6 * 5 - 2
+    assert all(r["stop_reason"] == "dest_reached" for r in out)
+    assert next(r for r in out if r["target"] == targets[3])["probes_used"] == 6
+
+
+def test_windowed_runner_resumes_where_the_crash_left_off(tmp_path):
+    targets = [f"192.0.2.{i}" for i in range(1, 5)]
+    path = str(tmp_path / "run.journal")
+    s = _settings()
+    s.window_ttls = 2
+
+    journal = Journal(path, snapshots=True)
+    runner = AsyncBatchRunner(_CrashAfter(limit=16), s, in_flight=1, journal=journal)
+    try:
+        asyncio.run(runner.run(targets))
+    except _Crash:
+        pass
+    journal.close()
+    journal = Journal(path, snapshots=True)
+    assert journal.watermark == 2
+    snap = journal.resume_state(2)
+    assert snap["ttl"] > 1
+
+    prober = SlowLinePath(delay_s=0, hops=6)
+    runner = AsyncBatchRunner(prober, s, in_flight=2, journal=journal)
+    out = {r["target"]: r for r in asyncio.run(runner.run(targets))}
+    journal.close()
+    assert sorted(out) == targets[2:]
+    assert all(r["stop_reason"] == "dest_reached" and len(r["path"]) == 6 for r in out.values())
+    # the resumed trace carries on from its snapshot's probes instead of starting over
+    assert sum(r["probes_used"] for r in out.values()) == snap["probes_used"] + prober.sent
+    assert prober.sent < 12
+
+
+def test_sharded_run_skips_journaled_targets(tmp_path):
+    targets = [f"192.0.2.{i}" for i in range(1, 13)]
+    journal = Journal(str(tmp_path / "run.journal"))
+    for i in range(0, 12, 2):
+        journal.done(i, targets[i])
+    out = []
+    stats = run_sharded(targets, _settings(), functools.partial(SlowLinePath, 0.0),
+                        workers=2, in_flight=2, on_result=out.append, journal=journal)
+    journal.close()
+    assert [r["target"] for r in out] == targets[1::2]
+    assert stats["targets"] == 6 and stats["journal"]["watermark"] == 12
+
+_KILLED_RUN = """
+import asyncio, os, signal, sys
+from app.batch.journal import Journal
+from app.batch.runner import AsyncBatchRunner
+from app.io.writers import JsonlWriter
+from tests.test_batch import SlowLinePath, _settings
+
+out, journal_path, targets = sys.argv[1], sys.argv[2], sys.argv[3:]
+writer = JsonlWriter(out, append=True)
+journal = Journal(journal_path, store_results=True, fsync_every=8, checkpoint_every=32, mark_output=writer.mark)
+emitted = []
+
+def emit(res):
+    writer.write(res)
+    emitted.append(res)
+    if len(emitted) == 150:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+runner = AsyncBatchRunner(SlowLinePath(delay_s=0), _settings(), in_flight=8, on_result=emit, journal=journal)
+asyncio.run(runner.run(targets))
+"""
+
+
+def test_killed_run_resumes_with_every_target_in_the_output(tmp_path):
+    root = os.path.join(os.path.dirname(__file__), "..")
+    out, path = str(tmp_path / "out.jsonl"), str(tmp_path / "run.journal")
+    targets = [f"10.0.{i // 250}.{i % 250 + 1}" for i in range(400)]
+    proc = subprocess.run([sys.executable, "-c", _KILLED_RUN, out, path, *targets], cwd=root)
+    assert proc.returncode == -signal.SIGKILL
+
+    journal = Journal(path, store_results=True, checkpoint_every=32)
+    # the journal got well ahead of the (buffered) output
+    assert journal.watermark >= 100
+    assert len(list(iter_written(out))) < journal.watermark
+    # the output is rebuilt from the checkpoint's mark and the journal tail alone
+    assert journal.output_mark is not None
+    tail = list(journal.unwritten())
+    assert 0 < len(tail) < 32
+
+    rewind_written(out, None, journal.output_mark)
+    writer = JsonlWriter(out, append=True)
+    for res in tail:
+        writer.write(res)
+    journal.mark_output = writer.mark
+    runner = AsyncBatchRunner(SlowLinePath(delay_s=0), _settings(), in_flight=8,
+                              on_result=writer.write, journal=journal)
+    asyncio.run(runner.run(targets, collect=False))
+    journal.close()
+    writer.close()
+    assert sorted(r["target"] for r in iter_written(out)) == sorted(targets)  # each exactly once
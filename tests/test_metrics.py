@@ -0,0 +1,52 @@
+# tests/test_metrics.py
+import json
+
+import pytest
+
+from app.brain.controller import BudgetController
+from app.config import Settings
+from app.logging import METRICS, JsonlSnapshots, Metrics
+from app.prober.sim import SimTopology, SimulatedProber
+
+
+@pytest.fixture
+def metrics():
+    METRICS.reset()
+    yield METRICS
+    METRICS.disable()
+    METRICS.reset()
+
+
+def test_histograms_and_prometheus_text():
+    m = Metrics(enabled=True)
+    for v in (0.0005, 0.002, 0.002, 3.0):
+        m.observe("parse", v)
+    m.inc("probes", 4)
+    h = m.histograms["parse"]
+    assert h.count == 4 and h.quantile(0.5) == 0.0032 and h.quantile(1.0) == 3.2
+    text = m.prometheus()
+    assert "traceroute_probes_total 4" in text
+    assert 'traceroute_phase_seconds_bucket{phase="parse",le="0.001"} 1' in text
+    assert 'traceroute_phase_seconds_bucket{phase="parse",le="+Inf"} 4' in text
+    assert 'traceroute_phase_seconds_count{phase="parse"} 4' in text
+
+
+def test_controller_reports_phases_and_counters(metrics, tmp_path):
+    ctrl = BudgetController(SimulatedProber(SimTopology(seed=1), seed=1), Settings(pace_ms=0))
+    assert not metrics.enabled
+    ctrl.run("198.18.0.1")
+    assert metrics.counters == {} and metrics.histograms == {}
+
+    ctrl = BudgetController(SimulatedProber(SimTopology(seed=1), seed=1), Settings(pace_ms=0, metrics=True))
+    snaps = JsonlSnapshots(str(tmp_path / "m.jsonl"), interval_s=60).start()
+    results = [ctrl.run(f"198.18.0.{i}") for i in range(10)]
+    snaps.stop()
+
+    c = metrics.counters
+    assert c["probes"] == sum(r["probes_used"] for r in results)
+    assert c["dest_reached"] == sum(r["stop_reason"] == "dest_reached" for r in results)
+    assert c["pool_deposits"] > 0
+    assert {"ctl_next", "probe", "ctl_feed"} <= set(metrics.histograms)
+    assert metrics.histograms["probe"].count == c["probes"]
+    snap = json.loads((tmp_path / "m.jsonl").read_text().splitlines()[-1])
+    assert snap["counters"]["probes"] == c["probes"]
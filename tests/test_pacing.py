@@ -0,0 +1,65 @@
+# tests/test_pacing.py
+import asyncio
+import time
+
+from app.brain.controller import BudgetController
+from app.config import Settings
+from app.prober.fake import FakeProber
+from app.prober.pacing import Pacer
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_global_and_per_destination_limits():
+    clock = _Clock()
+    pacer = Pacer(pps=100, per_dest_pps=10, clock=clock)
+    # different targets only share the 100/s process bucket
+    assert [round(pacer.reserve(f"192.0.2.{i}"), 3) for i in range(3)] == [0.0, 0.01, 0.02]
+    # a second probe to the same target waits for its own 10/s bucket
+    assert round(pacer.reserve("192.0.2.0"), 3) == 0.1
+    st = pacer.stats()
+    assert st["probes"] == 4
+    assert st["throttled"] == 3
+    assert st["throttled_global"] == 2 and st["throttled_dest"] == 1
+
+
+def test_burst_and_batch_reservations():
+    clock = _Clock()
+    pacer = Pacer(pps=10, burst=3, clock=clock)
+    assert [pacer.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert round(pacer.reserve(), 3) == 0.1
+    clock.now += 10  # bucket refilled
+    # a batch bigger than the burst goes out at once and is paid back afterwards
+    assert pacer.reserve(n=5) == 0.0
+    # 3 saved tokens, 5 spent: the next probe waits for 3 more
+    assert round(pacer.reserve(), 3) == 0.3
+
+
+def test_pacer_is_shared_by_sync_and_async_callers():
+    pacer = Pacer(pps=200)
+    t0 = time.monotonic()
+    for _ in range(5):
+        pacer.wait("192.0.2.1")
+
+    async def main():
+        await asyncio.gather(*(pacer.wait_async(f"192.0.2.{i}") for i in range(5)))
+
+    asyncio.run(main())
+    # 10 probes at 200/s: the first is free, then 9 * 5ms
+    assert time.monotonic() - t0 >= 0.044
+    assert pacer.stats()["rate_pps"] <= 201
+
+
+def test_controller_paces_through_its_pacer():
+    s = Settings(total_budget=6, per_hop_budget=2, repeats_needed=2, flow_ids=(0,), max_ttl=3)
+    clock = _Clock()
+    ctrl = BudgetController(FakeProber(script={}), s, pacer=Pacer(per_dest_pps=1000, clock=clock))
+    res = ctrl.run("192.0.2.9")
+    assert res["probes_used"] == 6
+    assert ctrl.pacer.stats()["probes"] == 6
@@ -0,0 +1,92 @@
+# tests/test_ratelimit.py
+from app.brain.controller import BudgetController
+from app.brain.ratelimit import RateLimits
+from app.config import Settings
+from app.prober.fake import FakeProber
+from app.prober.sim import SimTopology, SimulatedProber
+from tools.bench_sim import targets
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def _feed(rl, clock, pattern, ip="10.0.0.1", ttl=2, step=0.01, pause=5.0):
+    """`pattern`: strings of 'o' (answered) / 'x' (lost), one string per burst; bursts are `pause` apart."""
+    for burst in pattern:
+        for c in burst:
+            rl.observe(ip, c == "o", ttl)
+            clock.t += step
+        clock.t += pause
+
+
+def test_periodic_loss_is_flagged_and_random_loss_is_not():
+    clock = _Clock()
+    rl = RateLimits(clock=clock, min_samples=3)
+    _feed(rl, clock, ["oxx", "ox", "ox"])
+    assert rl.limited("10.0.0.1")
+    assert rl.expect(2, 0) == "10.0.0.1"
+    clock.t = 100.0
+    rl.observe("10.0.0.1", True)
+    assert 0.9 < rl.hold("10.0.0.1") <= 1.1
+    # lost after a pause as often as right after a reply: loss, not a limiter
+    _feed(rl, clock, ["oox", "xoo", "oxo", "xxo", "oox"], ip="10.0.0.2")
+    assert not rl.limited("10.0.0.2")
+    assert rl.hold("10.0.0.2") == 0.0
+
+
+def test_throttled_timeouts_do_not_make_a_hop_dark():
+    clock = _Clock()
+    rl = RateLimits(clock=clock, min_samples=2)
+    _feed(rl, clock, ["ox", "ox"])
+    s = Settings(pace_ms=0, per_hop_budget=3)
+    ctrl = BudgetController(FakeProber(), s, rate_limits=rl)
+    run = ctrl._new_run("192.0.2.1")
+    tstate = run.per_ttl[2]
+    rl.observe("10.0.0.1", True, 2)
+    clock.t += 0.01 + s.probe_wait_s  # timeouts come back a reply wait after going out
+    for _ in range(3):
+        ctrl._record(run, "192.0.2.1", 2, {"status": "timeout", "flow_id": 0})
+    ctrl._decide(tstate, 3)
+    assert (tstate.timeouts, tstate.limited) == (0, 3)
+    # silent, but not dark: the stop set, gap_limit and scoring never see a fake interface
+    assert tstate.final == "∅"
+    assert ctrl._ttl_dict(tstate)["rate_limited"] == 3
+    s.gap_limit = 1
+    ctrl._close_hop(run, 2, tstate, 3)
+    assert run.stop_reason is None
+
+
+def test_spacing_probes_to_limited_routers_saves_probes_and_time():
+    dests = targets(150)
+    out = {}
+    for on in (False, True):
+        topo = SimTopology(seed=4, rate_limit_p=1.0, loss=0.0, silent_p=0.0, dest_silent_p=0.0)
+        sim = SimulatedProber(topo, seed=4)
+        ctrl = BudgetController(sim, Settings(pace_ms=0, ratelimit=on))
+        res = [ctrl.run(d) for d in dests]
+        out[on] = (sum(r["probes_used"] for r in res), sim.now, sim.rate_limited)
+    assert out[True][0] < 0.97 * out[False][0]
+    assert out[True][1] < 0.9 * out[False][1]
+    assert out[True][2] < out[False][2]
+
+
+def test_one_close_pair_of_replies_does_not_end_detection():
+    clock = _Clock()
+    rl = RateLimits(clock=clock, min_samples=3)
+    _feed(rl, clock, ["ox", "ox", "ox"])
+    assert rl.limited("10.0.0.1")
+    # a burst lets two replies through 10 ms apart ...
+    _feed(rl, clock, ["oo"])
+    # ... but later losses right after a reply still look early
+    _feed(rl, clock, ["ox", "ox", "ox", "ox", "ox", "ox"], step=0.2)
+    assert rl.limited("10.0.0.1")
+    clock.t += 10.0
+    rl.observe("10.0.0.1", True)
+    assert rl.hold("10.0.0.1") > 0.2
+    # the slot is booked: a second probe queued now goes out an interval later
+    assert rl.hold("10.0.0.1") > 2 * 0.2
@@ -0,0 +1,69 @@
+# tests/test_retrace.py
+import json
+
+from app.brain.controller import BudgetController
+from app.brain.retrace import compact_prior, load_priors
+from app.brain.state import snapshot_run
+from app.config import Settings
+from app.prober.sim import SimHop, SimTopology, SimulatedProber
+
+DESTS = [f"198.18.1.{i}" for i in range(60)]
+
+
+def _cold_and_sim(seed=2):
+    topo = SimTopology(seed=seed)
+    ctrl = BudgetController(SimulatedProber(topo, seed=seed), Settings(pace_ms=0))
+    return topo, {d: ctrl.run(d) for d in DESTS}
+
+
+def test_retrace_of_unchanged_paths_is_cheap():
+    topo, cold = _cold_and_sim()
+    cold_probes = sum(r["probes_used"] for r in cold.values())
+    sim = SimulatedProber(topo, seed=7)
+
+    ctrl = BudgetController(sim, Settings(pace_ms=0))
+    again = {d: ctrl.run(d, prior=cold[d]) for d in DESTS}
+    probes = sum(r["probes_used"] for r in again.values())
+    assert probes < 0.6 * cold_probes
+    # a lost verification probe only escalates the hop; what changes is the odd
+    # rate-limited router going dark or another ECMP interface answering
+    assert sum(bool(r["retrace"]["changed"]) for r in again.values()) <= 5
+    assert all(sim.score(d, r["path"])["accuracy"] >= sim.score(d, cold[d]["path"])["accuracy"] - 0.1
+               for d, r in again.items())
+
+    sampled = BudgetController(sim, Settings(pace_ms=0, retrace_sample=0.3))
+    fewer = sum(sampled.run(d, prior=cold[d])["probes_used"] for d in DESTS)
+    assert fewer < 0.7 * probes
+
+
+def test_retrace_reports_changed_hops(tmp_path):
+    topo, cold = _cold_and_sim()
+    dest = next(d for d, r in cold.items()
+                if r["stop_reason"] == "dest_reached" and len(r["path"]) >= 8 and "∅" not in r["path"].values())
+    path = topo.path(dest)
+    path.hops[5] = SimHop(("10.250.0.1",), path.hops[5].rtt_ms)
+
+    out = tmp_path / "prior.jsonl"
+    out.write_text(json.dumps(cold[dest]) + "\n")  # ttl keys come back as strings
+    prior = load_priors(str(out))[dest]
+    assert prior == compact_prior(cold[dest])
+
+    res = BudgetController(SimulatedProber(topo, seed=1), Settings(pace_ms=0)).run(dest, prior=prior)
+    assert res["path"][6] == "10.250.0.1"
+    assert 6 in res["retrace"]["escalated"]
+    assert {"ttl": 6, "was": cold[dest]["path"][6], "now": "10.250.0.1"} in res["retrace"]["changed"]
+    assert res["stop_reason"] == "dest_reached"
+
+
+def test_interrupted_retrace_starts_over_instead_of_resuming():
+    topo, cold = _cold_and_sim()
+    dest = next(d for d, r in cold.items() if r["stop_reason"] == "dest_reached")
+    ctrl = BudgetController(SimulatedProber(topo, seed=1), Settings(pace_ms=0))
+    sess = ctrl.session(dest, prior=cold[dest])
+    for _ in range(3):
+        ttl, flow_id = sess.next_probe()
+        sess.feed(ttl, flow_id, ctrl.prober.probe_once(dest, ttl, flow_id=flow_id))
+    snap = snapshot_run(sess.run)
+
+    again = ctrl.session(dest, resume=snap, prior=cold[dest])
+    assert again.run.probes_used == 0 and not again.escalated
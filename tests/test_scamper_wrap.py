@@ -0,0 +1,213 @@
+# tests/test_scamper_wrap.py
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.prober.parse import first_trace, index_hops, iter_traces
+from app.prober.scamper import batch_runs, parse_scamper_batch, parse_scamper_json_v01
+from app.prober.raw import RawPayload, RawPolicy, decode_raw
+from app.prober.scamper_ctl import ScamperCtlProber
+
+FAKE_SCAMPER = os.path.join(os.path.dirname(__file__), "..", "tools", "fake_scamper.py")
+RECORDED = os.path.join(os.path.dirname(__file__), "data", "scamper_trace.jsonl")
+
+
+def _trace_line(dst, hops):
+    return json.dumps({"type": "trace", "dst": dst, "hops": hops})
+
+
+def test_parse_picks_requested_ttl():
+    out = "\n".join([
+        json.dumps({"type": "cycle-start"}),
+        _trace_line("8.8.8.8", [
+            {"probe_ttl": 2, "addr": "10.0.0.2", "rtt": 2.0, "icmp_type": 11, "icmp_code": 0},
+            {"probe_ttl": 3, "addr": "10.0.0.3", "rtt": 3.0, "icmp_type": 11, "icmp_code": 0},
+        ]),
+        json.dumps({"type": "cycle-stop"}),
+    ])
+    ev = parse_scamper_json_v01(out, 3)
+    assert ev["status"] == "ttl_exceeded"
+    assert ev["hop_ip"] == "10.0.0.3"
+    assert ev["target"] == "8.8.8.8"
+
+
+def test_parse_dest_reached_and_timeout():
+    out = _trace_line("8.8.8.8", [
+        {"probe_ttl": 9, "addr": "8.8.8.8", "rtt": 9.0, "icmp_type": 3, "icmp_code": 3},
+    ])
+    assert parse_scamper_json_v01(out, 9)["status"] == "dest_reached"
+    assert parse_scamper_json_v01(out, 4)["status"] == "timeout"
+    assert parse_scamper_json_v01("garbage", 4)["raw"] == {}
+
+
+def test_parse_recorded_output_streaming():
+    with open(RECORDED, "rb") as fh:
+        assert [obj["dst"] for obj, _ in iter_traces(fh)] == ["8.8.8.8", "1.1.1.1", "9.9.9.9", "192.0.2.77"]
+        fh.seek(0)
+        obj, line = first_trace(fh)
+        by_ttl = index_hops(obj)
+        assert [h["addr"] for h in by_ttl[2]] == ["10.0.2.1", "10.0.2.2", "10.0.2.1"]
+        assert json.loads(line)["dst"] == "8.8.8.8"
+
+    with open(RECORDED, "rb") as fh:
+        out = fh.read()
+    evs = parse_scamper_batch(out, [(2, 0), (2, 1), (10, 0), (11, 0)])
+    assert [e["hop_ip"] for e in evs] == ["10.0.2.1", "10.0.2.2", "8.8.8.8", None]
+    assert [e["status"] for e in evs] == ["ttl_exceeded", "ttl_exceeded", "dest_reached", "timeout"]
+    assert evs[2]["reply_ttl"] == obj["hops"][-1]["reply_ttl"]
+
+
+@pytest.fixture
+def ctl_prober():
+    p = ScamperCtlProber(scamper_cmd=[sys.executable, FAKE_SCAMPER, "--hops", "8"],
+                         probe_timeout_s=5.0)
+    yield p
+    p.close()
+
+
+def test_ctl_prober_single_probe(ctl_prober):
+    ev = ctl_prober.probe_once("192.0.2.50", 3, flow_id=1)
+    assert ev["status"] == "ttl_exceeded"
+    assert ev["hop_ip"] == "10.0.3.1"
+    assert ev["flow_id"] == 1
+
+    ev = ctl_prober.probe_once("192.0.2.50", 8)
+    assert ev["status"] == "dest_reached"
+    assert ev["hop_ip"] == "192.0.2.50"
+
+
+def test_ctl_prober_matches_concurrent_replies(ctl_prober):
+    jobs = [(f"192.0.2.{i}", ttl) for i in range(1, 6) for ttl in range(1, 10)]
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        evs = list(ex.map(lambda j: ctl_prober.probe_once(j[0], j[1]), jobs))
+    for (dest, ttl), ev in zip(jobs, evs):
+        assert ev["target"] == dest
+        assert ev["ttl"] == ttl
+        expect = dest if ttl >= 8 else f"10.0.{ttl}.1"
+        assert ev["hop_ip"] == expect
+
+
+def test_ctl_prober_survives_process_exit(ctl_prober):
+    ctl_prober._proc.kill()
+    ctl_prober._proc.wait()
+    ctl_prober._sock.close()
+    deadline = time.monotonic() + 2
+    ev = ctl_prober.probe_once("192.0.2.1", 1)
+    assert time.monotonic() < deadline
+    assert ev["status"] == "timeout"
+    assert "error" in ev["raw"]
+
+
+def test_parse_batch_assigns_replies_in_order():
+    out = _trace_line("8.8.8.8", [
+        {"probe_ttl": 1, "addr": "10.0.0.1", "rtt": 1.0, "icmp_type": 11, "icmp_code": 0},
+        {"probe_ttl": 1, "addr": "10.0.0.9", "rtt": 1.0, "icmp_type": 11, "icmp_code": 0},
+        {"probe_ttl": 3, "addr": "8.8.8.8", "rtt": 3.0, "icmp_type": 3, "icmp_code": 3},
+    ])
+    reqs = [(1, 0), (1, 1), (2, 0), (3, 0)]
+    evs = parse_scamper_batch(out, reqs)
+    assert [e["hop_ip"] for e in evs] == ["10.0.0.1", "10.0.0.9", None, "8.8.8.8"]
+    assert [e["flow_id"] for e in evs] == [0, 1, 0, 0]
+    assert evs[3]["status"] == "dest_reached"
+    assert batch_runs(reqs) == [(1, 3, 1, 0, [0, 2, 3]), (1, 1, 1, 1, [1])]
+
+
+def test_ctl_prober_batch_single_command(ctl_prober):
+    reqs = [(6, 0), (6, 1), (7, 0), (8, 0), (9, 0)]
+    evs = ctl_prober.probe_batch("192.0.2.77", reqs)
+    assert [e["status"] for e in evs] == ["ttl_exceeded", "ttl_exceeded", "ttl_exceeded",
+                                          "dest_reached", "timeout"]
+
+
+def _emitted(log_path, hops):
+    """Probes fake_scamper sent for the commands in its --log (a trace stops at the destination)."""
+    total = 0
+    with open(log_path, encoding="utf-8") as fh:
+        for line in fh:
+            opts = line.split()
+            q, f, m = (int(opts[opts.index(o) + 1]) for o in ("-q", "-f", "-m"))
+            total += q * (min(m, hops) - f + 1)
+    return total
+
+
+def test_batch_sends_exactly_the_plan(tmp_path):
+    from app.brain.controller import BudgetController
+    from app.config import Settings
+
+    log = str(tmp_path / "cmds.log")
+    prober = ScamperCtlProber(scamper_cmd=[sys.executable, FAKE_SCAMPER, "--hops", "4", "--log", log],
+                              probe_timeout_s=5.0)
+    try:
+        plan = [(1, 0), (3, 0), (3, 1), (3, 0), (4, 0), (4, 1), (4, 0), (5, 0), (5, 1), (5, 0)]
+        assert batch_runs(plan) == [(1, 1, 1, 0, [0]), (3, 5, 2, 0, [1, 3, 4, 6, 7, 9]),
+                                    (3, 5, 1, 1, [2, 5, 8])]
+        evs = prober.probe_batch("192.0.2.9", plan)
+        assert [e["flow_id"] for e in evs] == [f for _, f in plan]
+        # the destination answers at TTL 4, so nothing went out at TTL 5
+        assert [e.get("sent", True) for e in evs] == [True] * 7 + [False] * 3
+        assert _emitted(log, 4) == 7
+        with open(log, encoding="utf-8") as fh:
+            assert sum(" -s 40001 " in line for line in fh) == 1
+
+        open(log, "w").close()
+        s = Settings(pace_ms=0, flow_ids=[0, 1], repeats_needed=3, per_hop_budget=3, batch_ttls=3)
+        res = BudgetController(prober, s).run_batched("192.0.2.10")
+        assert res["stop_reason"] == "dest_reached"
+        assert res["probes_used"] == _emitted(log, 4)
+    finally:
+        prober.close()
+
+
+def test_raw_policy_modes():
+    line = _trace_line("8.8.8.8", [{"probe_ttl": 1, "addr": "10.0.0.1", "icmp_type": 11, "icmp_code": 0}])
+    assert parse_scamper_json_v01(line, 1, raw_policy=RawPolicy("errors"))["raw"] == {}
+    full = parse_scamper_json_v01(line, 1, raw_policy=RawPolicy("full"))["raw"]
+    assert isinstance(full, RawPayload)
+    assert full.json()["dst"] == "8.8.8.8"
+    policy = RawPolicy("sampled", 0.5, seed=1)
+    sampled = [parse_scamper_json_v01(line, 1, raw_policy=policy)["raw"] for _ in range(200)]
+    assert 50 < sum(1 for r in sampled if r) < 150
+
+    assert RawPolicy("none").error("boom", "long output") == {"error": "boom"}
+    err = RawPolicy("errors").error("boom", "long output")
+    assert decode_raw(err) == {"error": "boom", "output": "long output"}
+
+
+def test_ctl_prober_passes_adaptive_wait(ctl_prober):
+    assert " -w 2 " in ctl_prober._build_cmd("192.0.2.1", 3, 7, wait_s=1.2)
+    assert " -w" not in ctl_prober._build_cmd("192.0.2.1", 3, 7)
+    ev = ctl_prober.probe_once("192.0.2.1", 2, wait_s=1.0)
+    assert ev["hop_ip"] is not None
+
+
+def test_flow_ids_reach_scamper(ctl_prober):
+    assert " -s 40001 " in ctl_prober._build_cmd("192.0.2.1", 3, 7, flow_id=1)
+    assert " -s" not in ctl_prober._build_cmd("192.0.2.1", 3, 7)
+
+
+def test_sweep_prober_shares_scamper_runs_across_targets():
+    from app.batch.runner import AsyncBatchRunner
+    from app.config import Settings
+    from app.prober.sweep import SweepProber
+
+    targets = [f"192.0.2.{i}" for i in range(1, 41)]
+    prober = SweepProber(scamper_cmd=[sys.executable, FAKE_SCAMPER, "--hops", "5"], linger_s=0.05)
+    runner = AsyncBatchRunner(prober, Settings(repeats_needed=1, pace_ms=0), in_flight=len(targets))
+
+    async def main():
+        try:
+            return await runner.run(targets)
+        finally:
+            await prober.close()
+
+    results = asyncio.run(main())
+    assert sorted(r["target"] for r in results) == sorted(targets)
+    assert all(r["stop_reason"] == "dest_reached" and r["path"][5] == r["target"] for r in results)
+    assert prober.probes == 5 * len(targets)
+    # every trace steps through the TTLs together: one scamper run per TTL
+    assert prober.rounds == prober.spawns == 5
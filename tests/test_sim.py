@@ -0,0 +1,65 @@
+# tests/test_sim.py
+from app.brain.controller import BudgetController
+from app.config import Settings
+from app.prober.sim import SimHop, SimPath, SimTopology, SimulatedProber
+from tools.bench_sim import baseline_trace, check, run_seeds
+
+
+def _probe_all(seed):
+    sim = SimulatedProber(SimTopology(seed=seed), seed=seed)
+    return [sim.probe_once(f"198.18.0.{d}", ttl, flow_id=f)
+            for d in range(5) for ttl in range(1, 20) for f in (0, 1)]
+
+
+def test_simulation_is_reproducible_from_seed():
+    assert _probe_all(3) == _probe_all(3)
+    assert _probe_all(3) != _probe_all(4)
+    topo = SimTopology(seed=3, shared_hops=3)
+    # the near side is shared by every destination
+    assert topo.path("198.18.0.1").hops[:3] == topo.path("198.18.0.2").hops[:3]
+
+
+def test_ecmp_rate_limit_and_destination():
+    topo = SimTopology()
+    topo._paths["192.0.2.1"] = SimPath(
+        dest="192.0.2.1",
+        hops=[SimHop(("10.0.0.1",), 1.0),
+              SimHop(("10.0.1.1", "10.0.1.2"), 2.0),
+              SimHop(("10.0.2.1",), 3.0, rate_pps=1.0),
+              SimHop(("10.0.3.1",), 4.0, silent=True)],
+        dest_rtt_ms=5.0,
+    )
+    sim = SimulatedProber(topo, rtt_jitter=0.0)
+    # Paris: the interface depends on the flow, and only on the flow
+    seen = {f: sim.probe_once("192.0.2.1", 2, flow_id=f)["hop_ip"] for f in range(16)}
+    assert set(seen.values()) == {"10.0.1.1", "10.0.1.2"}
+    assert all(sim.probe_once("192.0.2.1", 2, flow_id=f)["hop_ip"] == ip for f, ip in seen.items())
+    # 1 reply/s: back to back, the second probe is dropped
+    assert sim.probe_once("192.0.2.1", 3)["status"] == "ttl_exceeded"
+    assert sim.probe_once("192.0.2.1", 3)["status"] == "timeout"
+    assert sim.rate_limited == 1
+    assert sim.probe_once("192.0.2.1", 4, wait_s=1.0)["status"] == "timeout"
+    ev = sim.probe_once("192.0.2.1", 9)
+    assert ev["status"] == "dest_reached" and ev["reply_ttl"] == 60
+
+    path = {1: "10.0.0.1", 2: "10.0.1.2", 3: "10.0.2.1", 4: "∅", 5: "192.0.2.1"}
+    assert sim.score("192.0.2.1", path) == {"accuracy": 1.0, "complete": True}
+    assert sim.score("192.0.2.1", {**path, 4: "10.9.9.9"})["accuracy"] == 0.8
+
+    res = BudgetController(sim, Settings(pace_ms=0)).run("192.0.2.1")
+    assert res["stop_reason"] == "dest_reached"
+    assert baseline_trace(sim, "192.0.2.1")["probes_used"] == 15
+
+
+def test_benchmark_thresholds():
+    # the gate looks at medians over seeds: any one seed can stray past it
+    report = run_seeds(300, seeds=range(5))
+    assert check(report, max_probe_ratio=0.9, max_time_ratio=1.55,
+                 max_accuracy_drop=0.02, max_cpu_ms=5.0, max_complete_drop=0.16) == []
+    assert report["controller"]["traces"] == report["baseline"]["traces"] == 300
+    assert [r["seed"] for r in report["runs"]] == [0, 1, 2, 3, 4]
+    # a strategy that gets one hop of most paths wrong fails on completeness alone
+    broken = {**report, "controller": {**report["controller"], "complete": 0.005}}
+    assert check(broken, max_probe_ratio=0.9, max_time_ratio=1.55,
+                 max_accuracy_drop=0.02, max_cpu_ms=5.0, max_complete_drop=0.16) == [
+        f"complete 0.005 is more than 0.16 below baseline {report['baseline']['complete']}"]
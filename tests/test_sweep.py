@@ -0,0 +1,38 @@
+# tests/test_sweep.py
+from app.brain.controller import BudgetController
+from app.config import Settings
+from app.prober.replay import RecordingProber
+from app.prober.sim import SimTopology, SimulatedProber
+from tools.bench_sim import targets
+from tools.sweep import grid, pareto, sweep
+
+
+def test_pareto_keeps_only_undominated_configs():
+    rows = [
+        {"id": "a", "probes_per_trace": 10, "accuracy": 0.90, "complete": 0.8},
+        {"id": "b", "probes_per_trace": 20, "accuracy": 0.99, "complete": 0.9},
+        {"id": "c", "probes_per_trace": 25, "accuracy": 0.95, "complete": 0.9},  # worse than b
+        {"id": "d", "probes_per_trace": 12, "accuracy": 0.90, "complete": 0.8},  # worse than a
+    ]
+    assert [r["id"] for r in pareto(rows)] == ["a", "b"]
+    assert len(grid({"per_hop_budget": [3, 6], "repeats_needed": [1, 2, 3]})) == 6
+
+
+def test_sweep_over_simulated_and_recorded_probes(tmp_path):
+    configs = grid({"repeats_needed": [1, 3]})
+    out = sweep(configs, {"kind": "sim", "seed": 2, "paths": 40}, jobs=2)
+    cheap, careful = out["results"]
+    assert cheap["probes_per_trace"] < careful["probes_per_trace"]
+    assert out["pareto"][0]["repeats_needed"] == 1
+
+    log = str(tmp_path / "run.log")
+    rec = RecordingProber(SimulatedProber(SimTopology(seed=2), seed=2), log)
+    ctrl = BudgetController(rec, Settings(pace_ms=0, repeats_needed=3))
+    for dest in targets(40):
+        ctrl.run(dest)
+    rec.close()
+    out = sweep(configs, {"kind": "replay", "path": log}, jobs=1)
+    by_rn = {r["repeats_needed"]: r for r in out["results"]}
+    # the recorded configuration replays exactly; the cheaper one reads a prefix of it
+    assert by_rn[3]["probes_per_trace"] * 40 == rec.recorded
+    assert by_rn[1]["probes_per_trace"] < by_rn[3]["probes_per_trace"]
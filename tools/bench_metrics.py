@@ -0,0 +1,214 @@
+# tools/bench_metrics.py
+# Usage:
+#   python3 -m tools.bench_metrics [n_traces] [rounds]
+#
+# Cost of the app/logging.py instrumentation on the probe path, over simulated
+# traces. BudgetController.run drives a ScamperProber through a paced Pacer, so
+# the controller, pacer, scamper-run and parse metric guards are all on the path.
+# Only what would block is stubbed, the same way for every run: scamper's
+# subprocess answers from app/prober/sim.py with the JSON record scamper would
+# print, and the pacer sleeps on a virtual clock.
+#
+# The disabled overhead is `ctrl.run` with METRICS disabled against the same run
+# with every metric guard cut out of the controller, pacing and scamper sources
+# (see _StripMetrics). Both variants are loaded the same way from the installed
+# modules and run interleaved a few traces at a time; the figure is the median
+# ratio of their CPU over those slices. The enabled overhead is the shipped
+# modules recording into an enabled registry against the same, disabled.
+# The stub's own CPU (a fraction of what spawning scamper costs) is part of both
+# runs, so the figure is an upper bound for real traces. Exits with status 1 if
+# the disabled overhead is above 1%.
+
+import ast
+import gc
+import inspect
+import json
+import shlex
+import statistics
+import sys
+import time
+import types
+
+from app.brain import controller as controller_mod
+from app.config import Settings
+from app.logging import METRICS, Metrics
+from app.prober import pacing as pacing_mod
+from app.prober import scamper as scamper_mod
+from app.prober.sim import SimTopology, SimulatedProber
+from tools.bench_sim import targets
+from tools.fake_scamper import parse_trace_cmd
+
+MAX_DISABLED_PCT = 1.0
+PACE_MS = 30
+
+FLAGS = ("timed",)
+REGISTRIES = ("METRICS", "M")
+
+
+def _is_flag(node: ast.AST) -> bool:
+    """`timed`, `METRICS.enabled` or `M.enabled`: the tests guarding instrumentation."""
+    if isinstance(node, ast.Name):
+        return node.id in FLAGS
+    return (isinstance(node, ast.Attribute) and node.attr == "enabled"
+            and isinstance(node.value, ast.Name) and node.value.id in REGISTRIES)
+
+
+class _StripMetrics(ast.NodeTransformer):
+    """Drops metric guards: their `if` (keeping any else), flag reads and `t0 = perf_counter() if ...`."""
+
+    def visit_If(self, node: ast.If):
+        self.generic_visit(node)
+        if _is_flag(node.test):
+            return node.orelse or None
+        return node
+
+    def visit_Assign(self, node: ast.Assign):
+        value = node.value
+        if (_is_flag(value) or (isinstance(value, ast.IfExp) and _is_flag(value.test))
+                or (isinstance(value, ast.Name) and value.id == "METRICS")):
+            return None
+        return node
+
+    def generic_visit(self, node: ast.AST) -> ast.AST:
+        super().generic_visit(node)
+        if getattr(node, "body", None) == []:
+            node.body.append(ast.Pass())
+        return node
+
+
+def load(module: types.ModuleType, strip: bool = False) -> types.ModuleType:
+    """A fresh copy of `module` from its source, with the metric guards removed if `strip`."""
+    tree = ast.parse(inspect.getsource(module))
+    if strip:
+        tree = ast.fix_missing_locations(_StripMetrics().visit(tree))
+    copy = types.ModuleType(module.__name__)
+    copy.__file__ = module.__file__
+    exec(compile(tree, module.__file__, "exec"), copy.__dict__)
+    return copy
+
+
+class VirtualTime:
+    """Stands in for the `time` module in the pacer copy: sleeping only moves the clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SimScamper:
+    """Stands in for `subprocess` in the scamper copy: runs the trace command against the simulator."""
+
+    PIPE = STDOUT = None
+
+    def __init__(self, sim: SimulatedProber, flow_port_base: int):
+        self.sim = sim
+        self.flow_port_base = flow_port_base
+
+    def run(self, cmd: str, **kw) -> types.SimpleNamespace:
+        argv = shlex.split(cmd)
+        dest = argv[argv.index("-i") + 1]
+        opts = parse_trace_cmd(argv[argv.index("-c") + 1] + " " + dest)
+        ttl = int(opts["-f"])
+        flow_id = int(opts["-s"]) - self.flow_port_base if "-s" in opts else 0
+        wait_s = float(opts["-w"]) if "-w" in opts else None
+        ev = self.sim.probe_once(dest, ttl, flow_id=flow_id, wait_s=wait_s)
+        hops = []
+        if ev["status"] != "timeout":
+            reached = ev["status"] == "dest_reached"
+            hops.append({"addr": ev["hop_ip"], "probe_ttl": ttl, "probe_id": 1, "rtt": ev["rtt_ms"],
+                         "reply_ttl": ev.get("reply_ttl"), "icmp_type": 3 if reached else 11,
+                         "icmp_code": 3 if reached else 0})
+        record = {"type": "trace", "version": "0.1", "method": opts["-P"], "dst": dest,
+                  "firsthop": ttl, "hoplimit": ttl, "attempts": 1, "probe_count": 1, "hops": hops}
+        return types.SimpleNamespace(stdout=json.dumps(record).encode() + b"\n")
+
+
+class Variant:
+    """
+    The controller, pacing and scamper modules, shipped or with the instrumentation
+    stripped, recording into `metrics`.
+    """
+
+    def __init__(self, strip: bool, metrics: Metrics = METRICS):
+        self.pacing = load(pacing_mod, strip)
+        self.scamper = load(scamper_mod, strip)
+        self.controller = load(controller_mod, strip)
+        self.controller.Pacer = self.pacing.Pacer
+        for module in (self.pacing, self.scamper, self.controller):
+            module.METRICS = metrics
+
+    def controller_for(self, settings: Settings):
+        vtime = VirtualTime()
+        self.pacing.time = vtime
+        self.scamper.subprocess = SimScamper(SimulatedProber(SimTopology(seed=0), seed=0),
+                                             self.scamper.FLOW_PORT_BASE)
+        prober = self.scamper.ScamperProber(scamper_bin=sys.executable, use_sudo=False,
+                                            raw_retention="none")
+        pacer = self.pacing.Pacer.from_settings(settings, clock=vtime.monotonic)
+        return self.controller.BudgetController(prober, settings, pacer=pacer)
+
+
+def trace_round(variant: Variant, dests: list[str]) -> float:
+    """CPU seconds per trace over `dests`."""
+    ctrl = variant.controller_for(Settings(pace_ms=PACE_MS))
+    t0 = time.process_time()
+    for dest in dests:
+        ctrl.run(dest)
+    return (time.process_time() - t0) / len(dests)
+
+
+def compare(a: Variant, b: Variant, dests: list[str], rounds: int, block: int = 5) -> float:
+    """
+    Median of a's CPU over b's, taken `block` traces at a time with the two
+    interleaved (so drift in the machine's speed hits both alike); a and b must
+    trace alike.
+    """
+    ratios = []
+    for r in range(rounds):
+        ctrls = (a.controller_for(Settings(pace_ms=PACE_MS)), b.controller_for(Settings(pace_ms=PACE_MS)))
+        gc.collect()
+        gc.disable()
+        try:
+            for i in range(0, len(dests), block):
+                cpu, hops = [0.0, 0.0], [None, None]
+                for k in ((0, 1) if (i // block + r) % 2 == 0 else (1, 0)):
+                    t0 = time.process_time()
+                    results = [ctrls[k].run(dest) for dest in dests[i:i + block]]
+                    cpu[k] = time.process_time() - t0
+                    hops[k] = [res.get("hops") for res in results]
+                if hops[0] != hops[1]:
+                    raise SystemExit("stripped and shipped runs traced differently")
+                ratios.append(cpu[0] / cpu[1])
+        finally:
+            gc.enable()
+    return statistics.median(ratios)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    dests = targets(n)
+    shipped, stripped = Variant(strip=False), Variant(strip=True)
+
+    METRICS.disable()
+    disabled_pct = 100.0 * (compare(shipped, stripped, dests, rounds) - 1.0)
+    recording = Metrics(enabled=True)
+    enabled_pct = 100.0 * (compare(Variant(strip=False, metrics=recording), shipped, dests, rounds) - 1.0)
+    off = min(trace_round(shipped, dests) for _ in range(rounds))
+    probes = recording.snapshot()["counters"]["probes"] / (n * rounds)
+
+    print(f"traces:                {n} x {rounds} rounds")
+    print(f"probes per trace:      {probes:9.1f}")
+    print(f"cpu per trace:         {off * 1e6:9.1f} us")
+    print(f"enabled overhead:      {enabled_pct:9.3f} %")
+    print(f"disabled overhead:     {disabled_pct:9.3f} %   (limit {MAX_DISABLED_PCT}%)")
+    sys.exit(1 if disabled_pct > MAX_DISABLED_PCT else 0)
+
+
+if __name__ == "__main__":
+    main()
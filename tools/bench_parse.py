@@ -0,0 +1,71 @@
+# tools/bench_parse.py
+# Usage:
+#   python3 -m tools.bench_parse [path] [rounds]
+#
+# Parse cost of scamper `-O json` output: the original path (text decode, json.loads
+# on every line, a scan over all hops per requested TTL) against app.prober.parse
+# (bytes prefilter, orjson when installed, one hop index per record). Defaults to
+# the recorded trace in tests/data.
+
+import json
+import sys
+import time
+
+from app.prober.parse import DECODER, iter_traces, trace_events
+
+DEFAULT_PATH = "tests/data/scamper_trace.jsonl"
+
+
+def legacy_parse(out: bytes, requests: list[tuple[int, int]]) -> int:
+    replies = 0
+    for line in out.decode("utf-8", "replace").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if obj.get("type") != "trace":
+            continue
+        hops = obj.get("hops", []) or []
+        for ttl, _flow in requests:
+            for h in hops:
+                if (h.get("probe_ttl") or h.get("ttl")) == ttl:
+                    replies += 1
+                    break
+    return replies
+
+
+def fast_parse(out: bytes, requests: list[tuple[int, int]]) -> int:
+    replies = 0
+    for obj, line in iter_traces(out):
+        replies += sum(1 for ev in trace_events(obj, line, requests) if ev["hop_ip"])
+    return replies
+
+
+def bench(fn, out: bytes, requests, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        fn(out, requests)
+    return (time.perf_counter() - t0) / rounds
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with open(path, "rb") as fh:
+        out = fh.read()
+    requests = [(ttl, 0) for ttl in range(1, 33)]
+
+    assert legacy_parse(out, requests) == fast_parse(out, requests), "parsers disagree"
+    legacy = bench(legacy_parse, out, requests, rounds)
+    fast = bench(fast_parse, out, requests, rounds)
+    print(f"{path}: {len(out)} bytes, {rounds} rounds, {len(requests)} TTLs requested per record")
+    print(f"  legacy (json.loads every line, hop scan) {legacy * 1e6:9.1f} us")
+    print(f"  fast   (prefilter, index)                {fast * 1e6:9.1f} us   {legacy / fast:5.2f}x")
+    print(f"  decoder: {DECODER}")
+
+
+if __name__ == "__main__":
+    main()
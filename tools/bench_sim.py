@@ -0,0 +1,227 @@
+# tools/bench_sim.py
+# Usage:
+#   python3 -m tools.bench_sim                       # 2000 simulated paths x seeds 0-4, default Settings
+#   python3 -m tools.bench_sim --paths 5000 --seeds 7 8 9
+#   python3 -m tools.bench_sim --adaptive-wait --gap-limit 5
+#   python3 -m tools.bench_sim --ratelimit --shared-hops 6 --rate-limit-p 0.3
+#
+# BudgetController against a regular_trace-style baseline (scamper trace -q 3
+# -g 10: q probes per TTL on one flow until the destination answers or gaplimit
+# silent hops in a row) over the same simulated topology (app/prober/sim.py);
+# --strategy multipath is measured against plain per-hop MDA instead.
+# Reports probes, path accuracy, simulated time and CPU time per trace, and exits
+# with status 1 when a threshold is missed, so it can gate changes. Thresholds
+# apply to the medians over several seeds: single topologies swing too much.
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+
+from app.brain.controller import BudgetController
+from app.brain.multipath import mda_stop
+from app.config import Settings
+from app.prober.sim import SimTopology, SimulatedProber
+
+
+def baseline_trace(prober, dest: str, q: int = 3, gaplimit: int = 10, max_ttl: int = 32) -> dict:
+    """What tools/regular_trace.py gets from scamper, probe for probe."""
+    path, probes, gap = {}, 0, 0
+    stop_reason = "max_ttl"
+    for ttl in range(1, max_ttl + 1):
+        events = prober.probe_batch(dest, [(ttl, 0)] * q)
+        probes += q
+        cnt = Counter(ev["hop_ip"] for ev in events if ev.get("hop_ip"))
+        path[ttl] = max(cnt, key=cnt.get) if cnt else "∅"
+        if any(ev.get("status") == "dest_reached" for ev in events):
+            stop_reason = "dest_reached"
+            break
+        gap = 0 if cnt else gap + 1
+        if gap >= gaplimit:
+            stop_reason = "gap_limit"
+            break
+    return {"target": dest, "path": path, "probes_used": probes, "stop_reason": stop_reason}
+
+
+def mda_baseline_trace(prober, dest: str, q: int = 3, gaplimit: int = 10, max_ttl: int = 32,
+                       alpha: float = 0.05, hop_budget: int = 16) -> dict:
+    """
+    Plain per-hop MDA, the reference for the multipath strategy: every probe on
+    a fresh flow until a hop's replies reach n_k for the k interfaces seen
+    (mda_stop) or hop_budget probes; a hop silent for q probes is dark.
+    """
+    path, probes, gap, flow = {}, 0, 0, 0
+    stop_reason = "max_ttl"
+    for ttl in range(1, max_ttl + 1):
+        cnt: Counter = Counter()
+        reached = False
+        attempts = 0
+        while attempts < hop_budget and (cnt or attempts < q):
+            ev = prober.probe_once(dest, ttl, flow_id=flow)
+            flow += 1
+            attempts += 1
+            if ev.get("hop_ip"):
+                cnt[ev["hop_ip"]] += 1
+            reached = reached or ev.get("status") == "dest_reached"
+            if reached or (cnt and sum(cnt.values()) >= mda_stop(len(cnt), alpha)):
+                break
+        probes += attempts
+        path[ttl] = max(cnt, key=cnt.get) if cnt else "∅"
+        if reached:
+            stop_reason = "dest_reached"
+            break
+        gap = 0 if cnt else gap + 1
+        if gap >= gaplimit:
+            stop_reason = "gap_limit"
+            break
+    return {"target": dest, "path": path, "probes_used": probes, "stop_reason": stop_reason}
+
+
+def targets(n: int) -> list[str]:
+    return [f"198.18.{i // 256 % 256}.{i % 256}" if i < 65536 else f"198.19.{i // 256 % 256}.{i % 256}"
+            for i in range(n)]
+
+
+def _measure(trace, prober: SimulatedProber, dests: list[str]) -> dict:
+    probes = right = complete = 0
+    cpu = 0.0
+    for dest in dests:
+        t0 = time.process_time()
+        res = trace(dest)
+        cpu += time.process_time() - t0
+        probes += res["probes_used"]
+        score = prober.score(dest, res["path"])
+        right += score["accuracy"]
+        complete += score["complete"]
+    n = len(dests)
+    return {
+        "traces": n,
+        "probes_per_trace": round(probes / n, 3),
+        "accuracy": round(right / n, 4),
+        "complete": round(complete / n, 4),
+        "sim_s_per_trace": round(sum(prober.elapsed.values()) / n, 3),
+        "cpu_ms_per_trace": round(cpu * 1000 / n, 4),
+        "rate_limited": prober.rate_limited,
+    }
+
+
+def run_suite(n: int = 2000, seed: int = 0, settings: Settings | None = None,
+              q: int = 3, gaplimit: int = 10, topology: dict | None = None) -> dict:
+    """
+    Both tracers over the same `n` simulated paths, each with a fresh prober on the
+    same seed. `topology`: SimTopology fields to override (shared_hops, rate_limit_p, ...).
+    """
+    s = settings or Settings()
+    # simulated probes take no real time: no pacing sleeps
+    s.pace_ms, s.pps = 0, 0.0
+    dests = targets(n)
+
+    topo = topology or {}
+    sim = SimulatedProber(SimTopology(seed=seed, **topo), seed=seed)
+    ctrl = BudgetController(sim, s)
+    controller = _measure(ctrl.run, sim, dests)
+
+    sim = SimulatedProber(SimTopology(seed=seed, **topo), seed=seed)
+    if s.strategy == "multipath":
+        # ECMP enumeration is measured against the tool that does the same job
+        baseline = _measure(lambda d: mda_baseline_trace(sim, d, q=q, gaplimit=gaplimit, max_ttl=s.max_ttl,
+                                                         alpha=s.mda_alpha, hop_budget=s.mda_hop_budget),
+                            sim, dests)
+    else:
+        baseline = _measure(lambda d: baseline_trace(sim, d, q=q, gaplimit=gaplimit, max_ttl=s.max_ttl),
+                            sim, dests)
+
+    return {
+        "seed": seed,
+        "controller": controller,
+        "baseline": baseline,
+        "baseline_kind": "mda" if s.strategy == "multipath" else "trace",
+        "probe_ratio": round(controller["probes_per_trace"] / baseline["probes_per_trace"], 4),
+        "time_ratio": round(controller["sim_s_per_trace"] / baseline["sim_s_per_trace"], 4),
+    }
+
+
+def run_seeds(n: int = 2000, seeds=(0, 1, 2, 3, 4), settings: Settings | None = None,
+              q: int = 3, gaplimit: int = 10, topology: dict | None = None) -> dict:
+    """
+    run_suite() once per seed. Every figure check() looks at is the median over the
+    seeds; "runs" keeps each seed's ratios, accuracy and completeness.
+    """
+    s = settings or Settings()
+    reports = [run_suite(n, seed, s, q=q, gaplimit=gaplimit, topology=topology) for seed in seeds]
+
+    def median_of(side: str) -> dict:
+        return {k: statistics.median(r[side][k] for r in reports) for k in reports[0][side]}
+
+    return {
+        "seeds": list(seeds),
+        "controller": median_of("controller"),
+        "baseline": median_of("baseline"),
+        "baseline_kind": reports[0]["baseline_kind"],
+        "probe_ratio": statistics.median(r["probe_ratio"] for r in reports),
+        "time_ratio": statistics.median(r["time_ratio"] for r in reports),
+        "runs": [{"seed": r["seed"], "probe_ratio": r["probe_ratio"], "time_ratio": r["time_ratio"],
+                  "accuracy": r["controller"]["accuracy"], "complete": r["controller"]["complete"],
+                  "baseline_complete": r["baseline"]["complete"]} for r in reports],
+    }
+
+
+def check(report: dict, max_probe_ratio: float, max_time_ratio: float,
+          max_accuracy_drop: float, max_cpu_ms: float, max_complete_drop: float) -> list[str]:
+    """Threshold violations in `report` (run_suite() or, to gate, run_seeds(); empty = pass)."""
+    c, b = report["controller"], report["baseline"]
+    failures = []
+    if report["probe_ratio"] > max_probe_ratio:
+        failures.append(f"probe_ratio {report['probe_ratio']} > {max_probe_ratio}")
+    if report["time_ratio"] > max_time_ratio:
+        failures.append(f"time_ratio {report['time_ratio']} > {max_time_ratio}")
+    if b["accuracy"] - c["accuracy"] > max_accuracy_drop:
+        failures.append(f"accuracy {c['accuracy']} is more than {max_accuracy_drop} below baseline {b['accuracy']}")
+    # accuracy averages over hops; a strategy that gets one hop of every path wrong
+    # barely moves it, but no longer gets whole paths right
+    if b["complete"] - c["complete"] > max_complete_drop:
+        failures.append(f"complete {c['complete']} is more than {max_complete_drop} below baseline {b['complete']}")
+    if c["cpu_ms_per_trace"] > max_cpu_ms:
+        failures.append(f"cpu_ms_per_trace {c['cpu_ms_per_trace']} > {max_cpu_ms}")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description="BudgetController vs regular traceroute on a simulated network")
+    ap.add_argument("--paths", type=int, default=2000, help="Number of simulated destinations")
+    ap.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2, 3, 4],
+                    help="Topology / probe outcome seeds; thresholds apply to the medians over them")
+    ap.add_argument("--q", type=int, default=3, help="Baseline probes per TTL (scamper -q)")
+    ap.add_argument("--gaplimit", type=int, default=10, help="Baseline gap limit (scamper -g)")
+    ap.add_argument("--strategy", default="forward", choices=["forward", "doubletree", "multipath"])
+    ap.add_argument("--adaptive-wait", action="store_true")
+    ap.add_argument("--gap-limit", type=int, default=0, help="Controller gap limit (Settings.gap_limit)")
+    ap.add_argument("--hop-cache", action="store_true")
+    ap.add_argument("--ratelimit", action="store_true")
+    # topology
+    ap.add_argument("--shared-hops", type=int, default=3, help="Routers every path shares (SimTopology.shared_hops)")
+    ap.add_argument("--rate-limit-p", type=float, default=0.1,
+                    help="Chance a router rate limits its ICMP (SimTopology.rate_limit_p)")
+    # regression thresholds
+    ap.add_argument("--max-probe-ratio", type=float, default=0.9, help="Controller / baseline probes per trace")
+    ap.add_argument("--max-time-ratio", type=float, default=1.55, help="Controller / baseline simulated time")
+    ap.add_argument("--max-accuracy-drop", type=float, default=0.02, help="Baseline accuracy minus controller's")
+    ap.add_argument("--max-complete-drop", type=float, default=0.16,
+                    help="Baseline share of fully right paths minus controller's")
+    ap.add_argument("--max-cpu-ms", type=float, default=5.0, help="Controller CPU time per trace")
+    args = ap.parse_args()
+
+    s = Settings(strategy=args.strategy, adaptive_wait=args.adaptive_wait,
+                 gap_limit=args.gap_limit, hop_cache=args.hop_cache, ratelimit=args.ratelimit)
+    topology = {"shared_hops": args.shared_hops, "rate_limit_p": args.rate_limit_p}
+    report = run_seeds(args.paths, args.seeds, s, q=args.q, gaplimit=args.gaplimit, topology=topology)
+    report["failures"] = check(report, args.max_probe_ratio, args.max_time_ratio,
+                               args.max_accuracy_drop, args.max_cpu_ms, args.max_complete_drop)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
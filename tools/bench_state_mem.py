@@ -0,0 +1,108 @@
+# tools/bench_state_mem.py
+# Usage:
+#   python3 -m tools.bench_state_mem [n_traces] [hops]
+#
+# Per-trace memory of the controller's trace state (and of its result dict),
+# measured with tracemalloc: the original eager dataclasses (max_ttl TtlStates,
+# one Counter each) against the slotted / lazily created ones, and the "full"
+# against the "sparse" result format.
+
+import sys
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+
+from app.brain.controller import BudgetController
+from app.brain.state import RunState
+from app.config import Settings
+
+
+# --- the pre-compaction state layout, kept here only for comparison ---
+@dataclass
+class LegacyTtlState:
+    final: str | None = None
+    counts: Counter = field(default_factory=Counter)
+    timeouts: int = 0
+    attempts: int = 0
+    confident: bool = False
+    base_cap: int = 0
+    dyn_cap: int = 0
+    pool_in: int = 0
+    pool_out: int = 0
+
+
+@dataclass
+class LegacyRunState:
+    max_ttl: int
+    total_budget: int
+    ttl: int = 1
+    probes_used: int = 0
+    stop_reason: str | None = None
+    dest_reached: bool = False
+    pool: int = 0
+    per_ttl: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        for k in range(1, self.max_ttl + 1):
+            self.per_ttl[k] = LegacyTtlState()
+
+
+def fill(run, hops: int, legacy: bool) -> None:
+    """Simulate a trace that reached the destination at `hops` with 2 replies per hop."""
+    for ttl in range(1, hops + 1):
+        t = run.per_ttl[ttl]
+        for _ in range(2):
+            t.attempts += 1
+            if legacy:
+                t.counts[f"10.{ttl}.0.1"] += 1
+            else:
+                t.add_reply(f"10.{ttl}.0.1")
+        t.final = f"10.{ttl}.0.1"
+        t.confident = True
+        run.probes_used += 2
+    run.ttl = hops
+
+
+def measure(make, n: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objs = [make(i) for i in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    del objs
+    return total / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    hops = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    s = Settings()
+
+    def legacy_state(_i):
+        run = LegacyRunState(max_ttl=s.max_ttl, total_budget=s.total_budget)
+        fill(run, hops, legacy=True)
+        return run
+
+    def compact_state(_i):
+        run = RunState(max_ttl=s.max_ttl, total_budget=s.total_budget)
+        fill(run, hops, legacy=False)
+        return run
+
+    full = BudgetController(None, Settings(result_format="full"))
+    sparse = BudgetController(None, Settings(result_format="sparse"))
+    run = compact_state(0)
+
+    rows = [
+        ("state: legacy (eager)", measure(legacy_state, n)),
+        ("state: compact (lazy, slots)", measure(compact_state, n)),
+        ("result: full per_ttl", measure(lambda i: full._result(f"192.0.2.{i % 250}", run), n)),
+        ("result: sparse per_ttl", measure(lambda i: sparse._result(f"192.0.2.{i % 250}", run), n)),
+    ]
+    print(f"{n} traces, {hops} probed hops, max_ttl={s.max_ttl}")
+    for name, per_trace in rows:
+        print(f"  {name:32s} {per_trace / 1024:8.2f} KiB/trace")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# tools/fake_scamper.py
+# Stand-in for `scamper -U <sock>` that speaks the control-socket line protocol
+# without touching the network. Used by tests and for local throughput checks.
+# With -c it runs one command instead, over -i targets or a -f target list, and
+# prints the JSON records to stdout like `scamper -O json` does.
+#
+# Usage:
+#   python3 tools/fake_scamper.py -U /tmp/ctl.sock [-p pps] [--hops 8] [--delay-ms 0]
+#   python3 tools/fake_scamper.py -O json -f targets.txt -c "trace -P udp-paris -q 1 -f 3 -m 3"
+#
+# --log FILE appends every trace command it runs (one line per target), so tests
+# can count the probes that actually went out.
+#
+# Topology: hop k answers from 10.0.<k>.1 until TTL >= --hops, where the
+# destination itself answers (ICMP port unreachable, like udp-paris).
+
+import argparse
+import json
+import os
+import shlex
+import socket
+import threading
+import time
+
+
+def build_trace(dest: str, first: int, last: int, attempts: int, userid: int, hops: int, method: str) -> dict:
+    replies = []
+    for ttl in range(first, last + 1):
+        for i in range(attempts):
+            if ttl >= hops:
+                replies.append({"addr": dest, "probe_ttl": ttl, "probe_id": i + 1,
+                                "rtt": 20.0 + ttl, "reply_ttl": 64 - hops + 1,
+                                "icmp_type": 3, "icmp_code": 3})
+            else:
+                replies.append({"addr": f"10.0.{ttl}.1", "probe_ttl": ttl, "probe_id": i + 1,
+                                "rtt": 1.0 + ttl, "reply_ttl": 255 - ttl + 1,
+                                "icmp_type": 11, "icmp_code": 0})
+        if ttl >= hops:
+            break
+    return {
+        "type": "trace", "version": "0.1", "userid": userid, "method": method,
+        "src": "192.0.2.1", "dst": dest, "firsthop": first, "hoplimit": last,
+        "attempts": attempts, "stop_reason": "COMPLETED" if last >= hops else "HOPLIMIT",
+        "hop_count": len(replies), "probe_count": len(replies), "hops": replies,
+    }
+
+
+def parse_trace_cmd(line: str) -> dict:
+    toks = shlex.split(line)
+    opts = {"-P": "udp-paris", "-q": "1", "-f": "1", "-m": "1", "-U": "0"}
+    i = 1
+    while i < len(toks) - 1:
+        if toks[i] in ("-Q",):
+            i += 1
+            continue
+        opts[toks[i]] = toks[i + 1]
+        i += 2
+    opts["dest"] = toks[-1]
+    return opts
+
+
+def log_cmd(args, line: str) -> None:
+    if args.log:
+        with open(args.log, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+
+def serve_client(conn: socket.socket, args) -> None:
+    rfile = conn.makefile("rb")
+    wlock = threading.Lock()
+    ids = 0
+
+    def send(data: bytes) -> None:
+        with wlock:
+            conn.sendall(data)
+
+    def reply(opts: dict) -> None:
+        if args.delay_ms:
+            time.sleep(args.delay_ms / 1000.0)
+        obj = build_trace(opts["dest"], int(opts["-f"]), int(opts["-m"]), int(opts["-q"]),
+                          int(opts["-U"]), args.hops, opts["-P"])
+        payload = (json.dumps(obj, separators=(",", ":")) + "\n").encode()
+        send(b"DATA %d\n" % len(payload) + payload)
+
+    for raw in rfile:
+        line = raw.decode().strip()
+        if not line:
+            continue
+        if line.startswith("attach"):
+            send(b"OK\nMORE\n")
+        elif line == "done":
+            send(b"OK\n")
+            break
+        elif line.startswith("trace"):
+            try:
+                opts = parse_trace_cmd(line)
+            except (ValueError, IndexError):
+                send(b"ERR could not parse command\nMORE\n")
+                continue
+            log_cmd(args, line)
+            ids += 1
+            send(b"OK id-%d\n" % ids)
+            if args.delay_ms:
+                threading.Thread(target=reply, args=(opts,), daemon=True).start()
+            else:
+                reply(opts)
+            send(b"MORE\n")
+        else:
+            send(b"ERR unknown command\n")
+    conn.close()
+
+
+def run_once(args) -> None:
+    targets = list(args.targets)
+    if args.listfile:
+        with open(args.listfile, encoding="utf-8") as fh:
+            targets += [line.strip() for line in fh if line.strip()]
+    out = [json.dumps({"type": "cycle-start"})]
+    for userid, dest in enumerate(targets):
+        opts = parse_trace_cmd(f"{args.command} {dest}")
+        log_cmd(args, f"{args.command} {dest}")
+        obj = build_trace(dest, int(opts["-f"]), int(opts["-m"]), int(opts["-q"]),
+                          userid, args.hops, opts["-P"])
+        out.append(json.dumps(obj, separators=(",", ":")))
+    out.append(json.dumps({"type": "cycle-stop"}))
+    print("\n".join(out))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="fake scamper control socket")
+    ap.add_argument("-U", dest="sock", help="unix control socket path")
+    ap.add_argument("-p", dest="pps", type=int, default=0, help="ignored (scamper pps)")
+    ap.add_argument("-O", dest="format", default="json", help="ignored (always json)")
+    ap.add_argument("-c", dest="command", help="run this command on the targets and exit")
+    ap.add_argument("-i", dest="targets", nargs="+", default=[], help="targets for -c")
+    ap.add_argument("-f", dest="listfile", help="file of targets for -c, one per line")
+    ap.add_argument("--hops", type=int, default=8, help="TTL at which the destination answers")
+    ap.add_argument("--delay-ms", type=int, default=0, help="artificial per-command reply delay")
+    ap.add_argument("--log", help="append every trace command run to this file")
+    args = ap.parse_args()
+    if args.command:
+        run_once(args)
+        return
+    if not args.sock:
+        ap.error("-U or -c is required")
+
+    if os.path.exists(args.sock):
+        os.unlink(args.sock)
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(args.sock)
+    srv.listen(8)
+    try:
+        while True:
+            conn, _ = srv.accept()
+            threading.Thread(target=serve_client, args=(conn, args), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.close()
+        if os.path.exists(args.sock):
+            os.unlink(args.sock)
+
+
+if __name__ == "__main__":
+    main()
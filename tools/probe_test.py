@@ -2,6 +2,7 @@
 # Usage: python3 tools/probe_test.py 8.8.8.8 5
 import sys
 import json
+from app.prober.raw import decode_raw
 from app.prober.scamper import ScamperProber
 
 def main():
@@ -10,8 +11,9 @@ def main():
         return
     target = sys.argv[1]
     ttl = int(sys.argv[2]) if len(sys.argv) > 2 else 5
-    p = ScamperProber(use_sudo=True, pace_ms=40)
+    p = ScamperProber(use_sudo=True, raw_retention="full")
     ev = p.probe_once(target, ttl)
+    ev["raw"] = decode_raw(ev.get("raw"))
     print(json.dumps(ev, indent=2))
 
 if __name__ == "__main__":
@@ -14,35 +14,36 @@ import sys
 import json
 import shlex
 import subprocess
-from collections import defaultdict, Counter
+from collections import Counter
+
+from app.prober.parse import first_trace, index_hops
 
 def run_scamper_full_trace(target: str, q: int = 3, method: str = "udp-paris"):
     # Build scamper command: target via -i, template via -c
     # Paris mode keeps flow tuple stable across probes
     cmd = f"sudo -n scamper -O json -i {shlex.quote(target)} -c 'trace -P {method} -q {q} -g 10 -G 2'"
-    proc = subprocess.run(cmd, shell=True, text=True,
-                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    out = proc.stdout
-
-    trace_obj = None
-    # Scamper prints multiple JSON lines (cycle-start / trace / cycle-stop)
-    for line in out.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            obj = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-        if obj.get("type") == "trace":
-            trace_obj = obj
-            break
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    # Scamper prints multiple JSON lines (cycle-start / trace / cycle-stop);
+    # read stdout line by line and decode only the trace record
+    seen = bytearray()
+
+    def lines():
+        for line in proc.stdout:
+            if len(seen) < 500:
+                seen.extend(line)
+            yield line
+
+    trace_obj, line = first_trace(lines())
+    proc.stdout.close()
+    proc.wait()
 
     if trace_obj is None:
         # Surface a helpful snippet for debugging
+        out = seen.decode("utf-8", "replace")
         raise RuntimeError(f"Could not parse scamper 'trace' JSON.\nOutput (first 500 chars):\n{out[:500]}")
 
-    return trace_obj, out, q
+    return trace_obj, line.decode("utf-8", "replace"), q
 
 def summarize_trace(trace_obj: dict, q_assumed: int = 3) -> dict:
     """
@@ -51,17 +52,8 @@ def summarize_trace(trace_obj: dict, q_assumed: int = 3) -> dict:
     - per_ttl_counts: counts of replying IPs per TTL
     - probes_used_est: q_assumed * number of TTLs probed (firsthop..hoplimit)
     """
-    hops = trace_obj.get("hops", []) or []
-
     # Aggregate replies by TTL
-    by_ttl = defaultdict(list)
-    for h in hops:
-        ttl = h.get("probe_ttl") or h.get("ttl")
-        if ttl is None:
-            continue
-        addr = h.get("addr")
-        if addr:
-            by_ttl[ttl].append(addr)
+    by_ttl = index_hops(trace_obj)
 
     firsthop = trace_obj.get("firsthop", 1)
     hoplimit = trace_obj.get("hoplimit")
@@ -73,7 +65,7 @@ def summarize_trace(trace_obj: dict, q_assumed: int = 3) -> dict:
     path = {}
     per_ttl_counts = {}
     for ttl in range(firsthop, hoplimit + 1):
-        cnt = Counter(by_ttl.get(ttl, []))
+        cnt = Counter(h["addr"] for h in by_ttl.get(ttl, ()) if h.get("addr"))
         per_ttl_counts[ttl] = dict(cnt)
         path[ttl] = (max(cnt, key=cnt.get) if cnt else "∅")
 
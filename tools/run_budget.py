@@ -2,6 +2,11 @@
 # Usage examples:
 #   python3 -m tools.run_budget 8.8.8.8
 #   python3 -m tools.run_budget 8.8.8.8 --per-hop-budget 6 --repeats-needed 3 --total-budget 50 --max-ttl 30
+#   python3 -m tools.run_budget 8.8.8.8 --backend ctl     # one long-lived scamper process
+#   python3 -m tools.run_budget 8.8.8.8 --batch-ttls 4    # one scamper trace per 4 TTLs
+#   python3 -m tools.run_budget 8.8.8.8 --window 4        # 4 TTLs in flight at once
+#   python3 -m tools.run_budget 8.8.8.8 --record run.log   # keep every probe result ...
+#   python3 -m tools.run_budget 8.8.8.8 --replay run.log   # ... and feed them back offline
 #   python3 -m tools.run_budget fake
 
 import json
@@ -9,6 +14,13 @@ import argparse
 from app.config import Settings
 from app.brain.controller import BudgetController
 
+def pick_run(ctrl, args):
+    if args.batch_ttls:
+        return ctrl.run_batched
+    if args.window > 1:
+        return ctrl.run_windowed
+    return ctrl.run
+
 def run_with_fake(args):
     from app.prober.fake import FakeProber
     script = {}
@@ -35,19 +47,45 @@ def run_with_fake(args):
         total_budget=args.total_budget,
         flow_ids=tuple(args.flow_ids),
         pace_ms=args.pace_ms,
+        pps=args.pps,
         use_sudo=args.use_sudo,
+        batch_ttls=args.batch_ttls or 4,
+        strategy=args.strategy,
+        mda_alpha=args.mda_alpha,
+        raw_retention=args.raw_retention,
+        debug=args.debug,
+        adaptive_wait=args.adaptive_wait,
+        gap_limit=args.gap_limit,
+        ratelimit=args.ratelimit,
+        distance_probe=args.distance_probe,
+        window_ttls=args.window,
     )
     ctrl = BudgetController(p, s)
-    res = ctrl.run(args.target or "8.8.8.8")
+    res = pick_run(ctrl, args)(args.target or "8.8.8.8")
+    res["pacing"] = ctrl.pacer.stats()
     print(json.dumps(res, indent=2))
 
 def run_with_scamper(args):
-    from app.prober.scamper import ScamperProber
-    p = ScamperProber(
-        use_sudo=args.use_sudo,
-        method=args.method,
-        pace_ms=args.pace_ms
-    )
+    if args.replay:
+        from app.prober.replay import ReplayProber
+        p = ReplayProber(args.replay, fallback=args.replay_fallback)
+    elif args.backend == "ctl":
+        from app.prober.scamper_ctl import ScamperCtlProber
+        p = ScamperCtlProber(
+            use_sudo=args.use_sudo,
+            method=args.method,
+            raw_retention=args.raw_retention,
+        )
+    else:
+        from app.prober.scamper import ScamperProber
+        p = ScamperProber(
+            use_sudo=args.use_sudo,
+            method=args.method,
+            raw_retention=args.raw_retention,
+        )
+    if args.record:
+        from app.prober.replay import RecordingProber
+        p = RecordingProber(p, args.record)
     s = Settings(
         method=args.method,
         max_ttl=args.max_ttl,
@@ -55,16 +93,37 @@ def run_with_scamper(args):
         repeats_needed=args.repeats_needed,
         total_budget=args.total_budget,
         flow_ids=tuple(args.flow_ids),
-        pace_ms=args.pace_ms,
+        # a replay answers from the log at once: nothing to space out
+        pace_ms=0 if args.replay else args.pace_ms,
+        pps=0 if args.replay else args.pps,
         use_sudo=args.use_sudo,
+        batch_ttls=args.batch_ttls or 4,
+        strategy=args.strategy,
+        mda_alpha=args.mda_alpha,
+        raw_retention=args.raw_retention,
+        debug=args.debug,
+        adaptive_wait=args.adaptive_wait,
+        gap_limit=args.gap_limit,
+        ratelimit=args.ratelimit,
+        distance_probe=args.distance_probe,
+        window_ttls=args.window,
     )
     ctrl = BudgetController(p, s)
-    res = ctrl.run(args.target)
+    try:
+        res = pick_run(ctrl, args)(args.target)
+    finally:
+        p.close()
+    res["pacing"] = ctrl.pacer.stats()
     print(json.dumps(res, indent=2))
 
 def build_argparser():
     ap = argparse.ArgumentParser(description="Budget-aware traceroute runner")
     ap.add_argument("target", nargs="?", help="Destination host/IP (or 'fake' to use FakeProber)")
+    ap.add_argument("--strategy", default="forward", choices=["forward", "doubletree", "multipath"],
+                    help="forward: walk up from TTL 1; doubletree: start mid-path, stop on the shared stop set; "
+                         "multipath: enumerate ECMP interfaces per hop (MDA-lite)")
+    ap.add_argument("--mda-alpha", type=float, default=0.05,
+                    help="multipath: accept a hop's interface set at confidence 1 - alpha")
     ap.add_argument("--method", default="udp-paris", choices=["udp-paris", "icmp-paris", "tcp"],
                     help="Probe method (Paris modes recommended)")
     ap.add_argument("--max-ttl", type=int, default=32, help="Maximum TTL to probe")
@@ -72,7 +131,29 @@ def build_argparser():
     ap.add_argument("--repeats-needed", type=int, default=3, help="Same IP replies needed to lock a hop")
     ap.add_argument("--total-budget", type=int, default=120, help="Global max number of probes")
     ap.add_argument("--flow-ids", type=int, nargs="+", default=[0, 1], help="Flow IDs to cycle (for ECMP peek)")
-    ap.add_argument("--pace-ms", type=int, default=30, help="Base pacing between probes (milliseconds)")
+    ap.add_argument("--pace-ms", type=int, default=30, help="Min spacing of probes to the target (milliseconds)")
+    ap.add_argument("--pps", type=float, default=0, help="Process-wide probes-per-second limit (0 = unlimited)")
+    ap.add_argument("--batch-ttls", type=int, default=0,
+                    help="Batched mode: plan this many TTLs per scamper trace (0 = one probe at a time)")
+    ap.add_argument("--window", type=int, default=1,
+                    help="Windowed mode: keep this many TTLs in flight at once (1 = hop by hop)")
+    ap.add_argument("--raw-retention", default="errors", choices=["none", "errors", "sampled", "full"],
+                    help="Which scamper payloads to keep per probe")
+    ap.add_argument("--debug", action="store_true", help="Include retained payloads in per_ttl output")
+    ap.add_argument("--gap-limit", type=int, default=0,
+                    help="Stop after this many consecutive dark hops (0 = probe on to --max-ttl)")
+    ap.add_argument("--ratelimit", action="store_true",
+                    help="Detect ICMP rate-limiting routers and space probes to them instead of calling them dark")
+    ap.add_argument("--distance-probe", action="store_true",
+                    help="Probe at --max-ttl first and trim it to the destination's estimated distance")
+    ap.add_argument("--adaptive-wait", action="store_true",
+                    help="Derive each probe's reply timeout (scamper -w) from the RTTs seen so far")
+    ap.add_argument("--backend", default="exec", choices=["exec", "ctl"],
+                    help="exec: one scamper process per probe; ctl: one persistent scamper (control socket)")
+    ap.add_argument("--record", metavar="PATH", help="Append every probe result to this log (app/prober/replay.py)")
+    ap.add_argument("--replay", metavar="PATH", help="Answer probes from a recorded log instead of scamper (unpaced)")
+    ap.add_argument("--replay-fallback", default="timeout", choices=["timeout", "cycle", "error"],
+                    help="What probes missing from the --replay log get")
     ap.add_argument("--use-sudo", action="store_true", default=True, help="Use sudo -n to run scamper")
     ap.add_argument("--no-sudo", dest="use_sudo", action="store_false", help="Disable sudo (only if caps set)")
     return ap
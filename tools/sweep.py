@@ -0,0 +1,189 @@
+# tools/sweep.py
+# Usage:
+#   python3 -m tools.sweep                                  # default grid, 500 simulated paths
+#   python3 -m tools.sweep --param per_hop_budget=4,6,8 --param repeats_needed=1,2,3
+#   python3 -m tools.sweep --random 200 --paths 2000 --jobs 8
+#   python3 -m tools.sweep --replay run.log                 # a recording (tools.run_budget --record)
+#
+# Settings tuning offline: every configuration in a grid (or a random sample of
+# it) traces the same destinations through BudgetController, on a process pool,
+# against simulated paths (app/prober/sim.py) or a recording (app/prober/replay.py).
+# No pacing and no real waits, so thousands of configurations take minutes.
+# Prints every configuration's probes / accuracy / completeness per trace and the
+# Pareto frontier of probes against accuracy and completeness.
+
+import argparse
+import itertools
+import json
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.brain.controller import BudgetController
+from app.config import Settings
+
+DEFAULT_SPACE = {
+    "per_hop_budget": [3, 4, 6, 8],
+    "repeats_needed": [1, 2, 3],
+    "rollover_cap_per_hop": [0, 2, 4],
+    "hard_per_hop_max": [6, 8],
+    "rollover_pool_max": [5, 10, 20],
+}
+
+
+class RecordedTruth:
+    """
+    Reference paths for a recording, which has no ground truth: per TTL the
+    interface that answered most often over everything recorded, and the first
+    TTL the destination answered at. Built in one streaming pass over the log.
+    """
+
+    def __init__(self, path: str):
+        from app.prober.parse import loads
+        counts: dict[str, dict[int, Counter]] = {}
+        self.dest_ttl: dict[str, int] = {}
+        self.max_ttl: dict[str, int] = {}
+        with open(path, "rb") as fh:
+            for line in fh:
+                parts = line.split(b"\t", 3)
+                if len(parts) != 4:
+                    continue
+                dest, ttl = parts[0].decode(), int(parts[1])
+                ev = loads(parts[3])
+                self.max_ttl[dest] = max(ttl, self.max_ttl.get(dest, 0))
+                if ev.get("status") == "dest_reached" or ev.get("hop_ip") == dest:
+                    self.dest_ttl[dest] = min(ttl, self.dest_ttl.get(dest, ttl))
+                elif ev.get("hop_ip"):
+                    counts.setdefault(dest, {}).setdefault(ttl, Counter())[ev["hop_ip"]] += 1
+        self.paths = {d: {t: c.most_common(1)[0][0] for t, c in per.items()} for d, per in counts.items()}
+        self.targets = sorted(self.max_ttl)
+
+    def score(self, dest: str, path: dict) -> dict:
+        last = self.dest_ttl.get(dest, self.max_ttl[dest])
+        ref = self.paths.get(dest, {})
+        right = 0
+        for ttl in range(1, last + 1):
+            want = dest if ttl == self.dest_ttl.get(dest) else ref.get(ttl)
+            got = path.get(ttl)
+            right += (got == want) if want else (got in (None, "∅"))
+        return {"accuracy": right / last, "complete": right == last}
+
+
+def grid(space: dict) -> list[dict]:
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def pareto(rows: list[dict]) -> list[dict]:
+    """Rows no other row beats on probes (lower), accuracy and completeness (higher) at once."""
+    def dominates(a, b):
+        no_worse = (a["probes_per_trace"] <= b["probes_per_trace"] and a["accuracy"] >= b["accuracy"]
+                    and a["complete"] >= b["complete"])
+        better = (a["probes_per_trace"] < b["probes_per_trace"] or a["accuracy"] > b["accuracy"]
+                  or a["complete"] > b["complete"])
+        return no_worse and better
+    front = [r for r in rows if not any(dominates(o, r) for o in rows)]
+    return sorted(front, key=lambda r: r["probes_per_trace"])
+
+
+# -------------------------------
+# worker side (one call per configuration, in a pool process)
+# -------------------------------
+_truth_cache: dict = {}
+
+
+def _source(data: dict):
+    """(prober, scorer, targets) for one configuration; probers are never shared across configs."""
+    if data["kind"] == "replay":
+        from app.prober.replay import ReplayProber
+        truth = _truth_cache.get(data["path"])
+        if truth is None:
+            truth = _truth_cache[data["path"]] = RecordedTruth(data["path"])
+        return ReplayProber(data["path"], fallback=data.get("fallback", "timeout")), truth, truth.targets
+    from app.prober.sim import SimTopology, SimulatedProber
+    from tools.bench_sim import targets
+    sim = SimulatedProber(SimTopology(seed=data["seed"]), seed=data["seed"])
+    return sim, sim, targets(data["paths"])
+
+
+def evaluate(task: tuple[dict, dict, dict]) -> dict:
+    params, base, data = task
+    # no pacing: replayed and simulated probes cost no real time
+    s = Settings(**{**base, **params, "pace_ms": 0, "pps": 0.0})
+    prober, scorer, dests = _source(data)
+    ctrl = BudgetController(prober, s)
+    probes = right = complete = 0
+    try:
+        for dest in dests:
+            res = ctrl.run(dest)
+            probes += res["probes_used"]
+            score = scorer.score(dest, res["path"])
+            right += score["accuracy"]
+            complete += score["complete"]
+    finally:
+        prober.close()
+    n = max(1, len(dests))
+    return {
+        **params,
+        "probes_per_trace": round(probes / n, 3),
+        "accuracy": round(right / n, 4),
+        "complete": round(complete / n, 4),
+    }
+
+
+def sweep(configs: list[dict], data: dict, base: Optional[dict] = None, jobs: Optional[int] = None) -> dict:
+    tasks = [(c, base or {}, data) for c in configs]
+    if data["kind"] == "replay":
+        # build the sidecar index once, before the workers open it
+        from app.prober.replay import ReplayIndex
+        ReplayIndex(data["path"]).close()
+    if jobs == 1:
+        rows = [evaluate(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            rows = list(pool.map(evaluate, tasks, chunksize=max(1, len(tasks) // (4 * (jobs or 8)))))
+    return {"configs": len(rows), "results": rows, "pareto": pareto(rows)}
+
+
+def parse_param(text: str) -> tuple[str, list]:
+    name, _, values = text.partition("=")
+    if not hasattr(Settings, name):
+        raise argparse.ArgumentTypeError(f"unknown Settings field: {name}")
+    return name, [json.loads(v) for v in values.split(",")]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sweep BudgetController Settings over simulated or recorded probes")
+    ap.add_argument("--param", type=parse_param, action="append", default=[],
+                    help="Settings field and values to try, e.g. per_hop_budget=4,6,8 (replaces the default grid)")
+    ap.add_argument("--random", type=int, default=0, help="Try this many random grid points instead of all")
+    ap.add_argument("--seed", type=int, default=0, help="Simulation and random-search seed")
+    ap.add_argument("--paths", type=int, default=500, help="Simulated destinations per configuration")
+    ap.add_argument("--replay", metavar="PATH", help="Use a recorded log instead of the simulator")
+    ap.add_argument("--replay-fallback", default="timeout", choices=["timeout", "cycle"],
+                    help="What probes missing from the recording get")
+    ap.add_argument("--total-budget", type=int, default=120)
+    ap.add_argument("--max-ttl", type=int, default=32)
+    ap.add_argument("--jobs", type=int, default=None, help="Worker processes (default: one per core)")
+    ap.add_argument("--all", action="store_true", help="Print every configuration, not just the frontier")
+    args = ap.parse_args()
+
+    space = dict(args.param) if args.param else DEFAULT_SPACE
+    configs = grid(space)
+    if args.random and args.random < len(configs):
+        configs = random.Random(args.seed).sample(configs, args.random)
+    if args.replay:
+        data = {"kind": "replay", "path": args.replay, "fallback": args.replay_fallback}
+    else:
+        data = {"kind": "sim", "seed": args.seed, "paths": args.paths}
+    base = {"total_budget": args.total_budget, "max_ttl": args.max_ttl}
+
+    out = sweep(configs, data, base, jobs=args.jobs)
+    if not args.all:
+        del out["results"]
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()